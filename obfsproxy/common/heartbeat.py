@@ -59,6 +59,14 @@ class Heartbeat(object):
         if ip not in self.unique_ips:
             self.unique_ips.add(ip)
 
+    def merge_stats(self, n_connections, unique_ips):
+        """
+        Merge the stats gathered by another process (e.g. a worker): the
+        number of connections and the set of unique IPs (in integer form).
+        """
+        self.n_connections += n_connections
+        self.unique_ips.update(unique_ips)
+
     def reset_stats(self):
         """Reset stats."""
 
@@ -99,11 +107,20 @@ class Heartbeat(object):
             log.debug("Resetting heartbeat.")
             self.reset_stats()
 
+    def say_log_stats(self):
+        """Log the number of log records dropped because of overload."""
+
+        log_stats = log.get_log_stats()
+        if log_stats and log_stats['dropped']:
+            log.warning("Heartbeat: %d log record(s) dropped so far, %d queued." % \
+                        (log_stats['dropped'], log_stats['queued']))
+
     def talk(self):
         """Do a heartbeat."""
 
         self.say_uptime()
         self.say_stats()
+        self.say_log_stats()
 
 # A heartbeat singleton.
 heartbeat = Heartbeat()
@@ -1,14 +1,134 @@
 """obfsproxy logging code"""
+import collections
 import logging
 import sys
+import threading
+import time
 
 from twisted.python import log
 
+# Maximum number of records waiting to be written by the log file sink.
+LOG_QUEUE_SIZE = 10000
+
+# Maximum number of records the log file sink takes from its queue at once.
+LOG_BATCH_SIZE = 256
+
 def get_obfslogger():
     """ Return the current ObfsLogger instance """
     return OBFSLOGGER
 
 
+class AsyncLogHandler(logging.Handler):
+    """
+    Log handler that passes records to 'target' on a background thread,
+    so that the reactor thread never blocks on disk I/O.
+
+    At most 'capacity' records are queued. When the queue is full, the
+    oldest record of the lowest severity is dropped to make room, unless
+    the new record has an even lower severity, in which case the new
+    record is dropped.
+
+    Attributes:
+    target: the handler that formats and writes the records
+    queued: number of records waiting to be written
+    dropped: number of records dropped because the queue was full
+    written: number of records passed to 'target'
+    """
+
+    def __init__(self, target, capacity=LOG_QUEUE_SIZE):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.capacity = capacity
+
+        # One queue of (sequence number, record) per severity level, so
+        # that we can drop low severity records first.
+        self.queues = collections.defaultdict(collections.deque)
+        self.seq = 0
+        self.queued = 0
+        self.dropped = 0
+        self.written = 0
+        self.pending = 0 # taken from the queue but not written yet
+        self.idle = False
+        self.closing = False
+        self.cond = threading.Condition(threading.Lock())
+
+        self.thread = threading.Thread(target=self._run, name='obfslogger-sink')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        with self.cond:
+            if self.closing:
+                return
+            if self.queued >= self.capacity:
+                lowest = min(level for level, q in self.queues.items() if q)
+                if record.levelno < lowest:
+                    self.dropped += 1
+                    return
+                self.queues[lowest].popleft()
+                self.queued -= 1
+                self.dropped += 1
+            self.queues[record.levelno].append((self.seq, record))
+            self.seq += 1
+            self.queued += 1
+            if self.idle:
+                self.cond.notify_all()
+
+    def _pop(self):
+        """Return the oldest queued record. Requires holding 'cond'."""
+        queue = min((q for q in self.queues.values() if q),
+                    key=lambda q: q[0][0])
+        self.queued -= 1
+        return queue.popleft()[1]
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queued and not self.closing:
+                    self.idle = True
+                    self.cond.wait()
+                self.idle = False
+                if not self.queued:
+                    return
+                batch = [self._pop() for _ in xrange(min(self.queued, LOG_BATCH_SIZE))]
+                self.pending = len(batch)
+            for record in batch:
+                self.target.handle(record)
+            with self.cond:
+                self.written += self.pending
+                self.pending = 0
+                if not self.queued:
+                    # Wake up flush()
+                    self.cond.notify_all()
+
+    def flush(self, timeout=5.0):
+        """Wait up to 'timeout' seconds for the queued records to be written."""
+        deadline = time.time() + timeout
+        with self.cond:
+            while (self.queued or self.pending) and self.thread.is_alive():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+        self.target.flush()
+
+    def close(self):
+        """Write the queued records, stop the thread and close 'target'."""
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.target.close()
+        logging.Handler.close(self)
+
+    def get_stats(self):
+        """Return a dictionary with the counters of the handler."""
+        with self.cond:
+            return {'queued': self.queued,
+                    'dropped': self.dropped,
+                    'written': self.written}
+
 class ObfsLogger(object):
     """
     Maintain state of logging options specified with command line arguments
@@ -17,11 +137,13 @@ class ObfsLogger(object):
     safe_logging: Boolean value indicating if we should scrub addresses
                   before logging
     obfslogger: Our logging instance
+    file_handler: Asynchronous handler that logs to our log file (if any)
     """
 
     def __init__(self):
 
         self.safe_logging = True
+        self.file_handler = None
 
         observer = log.PythonLoggingObserver('obfslogger')
         observer.start()
@@ -42,13 +164,29 @@ class ObfsLogger(object):
     def set_log_file(self, filename):
         """Set up our logger so that it starts logging to file in 'filename' instead."""
 
-        # remove the default handler, and add the FileHandler:
+        # remove the default handler (or the previous log file), and
+        # add the FileHandler. Records are written on a background
+        # thread so that logging does not block the reactor.
         self.obfslogger.removeHandler(self.default_handler)
+        if self.file_handler:
+            self.obfslogger.removeHandler(self.file_handler)
+            self.file_handler.close()
+
+        file_handler = logging.FileHandler(filename)
+        self.set_formatter(file_handler)
 
-        log_handler = logging.FileHandler(filename)
-        self.set_formatter(log_handler)
+        self.file_handler = AsyncLogHandler(file_handler)
+        self.obfslogger.addHandler(self.file_handler)
+
+    def get_log_stats(self):
+        """
+        Return the counters of our log file sink (queued, dropped and
+        written records), or None if we don't log to a file.
+        """
 
-        self.obfslogger.addHandler(log_handler)
+        if not self.file_handler:
+            return None
+        return self.file_handler.get_stats()
 
 
     def set_log_severity(self, sev_string):
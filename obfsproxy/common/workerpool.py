@@ -0,0 +1,119 @@
+"""
+Bounded pool of threads for CPU-heavy work.
+
+Handshakes need a few modular exponentiations which take milliseconds each.
+Running them in the reactor thread stalls the data forwarding of every
+other connection, so transports can hand them over to a pool of worker
+threads instead. The pool has a fixed number of threads and a limit on the
+number of jobs waiting for one: when both are exhausted (e.g. during a
+flood of handshakes), new jobs fail right away with PoolFullError instead
+of piling up.
+
+gmpy releases the GIL during exponentiations, so the workers run in
+parallel to the reactor if it is installed.
+"""
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import threadpool
+
+import obfsproxy.common.log as logging
+
+log = logging.get_obfslogger()
+
+# Default number of worker threads.
+DEFAULT_SIZE = 2
+
+# Default number of jobs that may wait for a free worker.
+DEFAULT_QUEUE_LIMIT = 64
+
+class PoolFullError(Exception): pass
+
+class WorkerPool(object):
+    """
+    Runs jobs in at most 'size' threads, with at most 'queue_limit' jobs
+    waiting for a thread. The threads are started with the first job and
+    stopped when the reactor shuts down.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, queue_limit=DEFAULT_QUEUE_LIMIT,
+                 _reactor=reactor):
+        if size < 1:
+            raise ValueError("The number of worker threads must be positive.")
+        if queue_limit < 0:
+            raise ValueError("The queue limit must not be negative.")
+        self.size = size
+        self.queue_limit = queue_limit
+        self.reactor = _reactor
+        self.pool = None
+        # Jobs that are queued or running.
+        self.pending = 0
+        self.rejected = 0
+
+    def start(self):
+        if self.pool is None:
+            self.pool = threadpool.ThreadPool(0, self.size, 'obfsproxy-workers')
+            self.pool.start()
+            self.reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+
+    def stop(self):
+        """Stop the threads once they are done with the queued jobs."""
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+
+    def is_full(self):
+        return self.pending >= self.size + self.queue_limit
+
+    def run(self, f, *args, **kwargs):
+        """
+        Call 'f' with the given arguments in a worker thread. Return a
+        Deferred firing in the reactor thread with the result of the call.
+
+        The Deferred fails with PoolFullError if the queue is full.
+        """
+        if self.is_full():
+            self.rejected += 1
+            log.debug("Worker pool full (%d jobs), rejecting job." % self.pending)
+            return defer.fail(PoolFullError("%d jobs are pending." % self.pending))
+
+        self.start()
+        self.pending += 1
+
+        def job():
+            try:
+                return f(*args, **kwargs)
+            finally:
+                # Count the job as done even if its Deferred was cancelled.
+                self.reactor.callFromThread(self._job_done)
+
+        return threads.deferToThreadPool(self.reactor, self.pool, job)
+
+    def _job_done(self):
+        self.pending -= 1
+
+_instance = None
+
+def new(size=DEFAULT_SIZE, queue_limit=DEFAULT_QUEUE_LIMIT):
+    global _instance
+    if _instance:
+        raise RuntimeError('Worker pool already set')
+    _instance = WorkerPool(size, queue_limit)
+    return _instance
+
+def get():
+    return _instance
+
+def reset():
+    global _instance
+    if _instance:
+        _instance.stop()
+    _instance = None
+
+def run(f, *args, **kwargs):
+    """
+    Call 'f' in the worker pool and return a Deferred with its result. If no
+    pool was set up, 'f' is called right away.
+    """
+    if _instance is None:
+        return defer.maybeDeferred(f, *args, **kwargs)
+    return _instance.run(f, *args, **kwargs)
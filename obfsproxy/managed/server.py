@@ -9,15 +9,20 @@ from pyptlib.config import EnvError
 import obfsproxy.transports.transports as transports
 import obfsproxy.transports.base as base
 import obfsproxy.network.launch_transport as launch_transport
+import obfsproxy.network.workers as workers
 import obfsproxy.common.log as logging
 import obfsproxy.common.transport_config as transport_config
 
 import pprint
+import sys
 
 log = logging.get_obfslogger()
 
-def do_managed_server():
-    """Start the managed-proxy protocol as a server."""
+def do_managed_server(n_workers=1):
+    """Start the managed-proxy protocol as a server.
+
+    If 'n_workers' is greater than one, each transport is served by that
+    many worker processes sharing its address (see network.workers)."""
 
     should_start_event_loop = False
 
@@ -61,7 +66,19 @@ def do_managed_server():
             continue
 
         try:
-            if ext_orport:
+            if n_workers > 1:
+                supervisor = workers.WorkerSupervisor(n_workers,
+                                                      {'argv': sys.argv[1:],
+                                                       'transport': transport,
+                                                       'role': 'ext_server' if ext_orport else 'server',
+                                                       'bindaddr': transport_bindaddr,
+                                                       'remote_addrport': ext_orport if ext_orport else orport,
+                                                       'ext_or_cookie_file': authcookie if ext_orport else None,
+                                                       'state_location': ptserver.config.getStateLocation(),
+                                                       'server_transport_options': transport_options or None,
+                                                       'obfsproxy_mode': 'managed'})
+                addrport = supervisor.start()
+            elif ext_orport:
                 addrport = launch_transport.launch_transport_listener(transport,
                                                                       transport_bindaddr,
                                                                       'ext_server',
@@ -78,6 +95,10 @@ def do_managed_server():
             log.warning("Could not find transport '%s'" % transport)
             ptserver.reportMethodError(transport, "Could not find transport.")
             continue
+        except workers.WorkerError, e:
+            log.warning("Could not launch workers for '%s' (%s)." % (transport, e))
+            ptserver.reportMethodError(transport, "Could not launch workers.")
+            continue
         except error.CannotListenError, e:
             error_msg = "Could not set up listener (%s:%s) for '%s' (%s)." % \
                         (e.interface, e.port, transport, e.socketError[1])
@@ -43,6 +43,8 @@ AUTH_COOKIE_LEN = 32
 AUTH_COOKIE_HEADER_LEN = 32
 AUTH_COOKIE_FILE_LEN = AUTH_COOKIE_LEN + AUTH_COOKIE_HEADER_LEN
 AUTH_COOKIE_HEADER = "! Extended ORPort Auth Cookie !\x0a"
+# Seconds between two checks whether the cookie file changed.
+AUTH_COOKIE_CHECK_INTERVAL = 1
 
 def _read_auth_cookie(cookie_path):
     """
@@ -72,6 +74,61 @@ def _read_auth_cookie(cookie_path):
     except IOError, exc:
         raise CouldNotReadCookie("Unable to read '%s' (%s)" % (cookie_path, exc))
 
+class AuthCookie(object):
+    """
+    Extended ORPort authentication cookie stored in 'cookie_path'.
+
+    The cookie is read once and cached. The file is read again only if its
+    inode, size or mtime changed, which is checked at most once every
+    'check_interval' seconds.
+    """
+
+    def __init__(self, cookie_path, check_interval=AUTH_COOKIE_CHECK_INTERVAL, _reactor=reactor):
+        self.cookie_path = cookie_path
+        self.check_interval = check_interval
+        self.reactor = _reactor
+
+        # HMAC-SHA256 keyed with the cookie.
+        self.cookie_hmac = None
+        # (inode, size, mtime) of the file the cookie was read from.
+        self.file_id = None
+        self.last_check = None
+
+    def get(self):
+        """
+        Return a KeyedHMAC keyed with the authentication cookie.
+        Throw CouldNotReadCookie if we couldn't read the cookie.
+        """
+
+        if self.cookie_hmac is None or \
+           self.reactor.seconds() - self.last_check >= self.check_interval:
+            self.refresh()
+
+        return self.cookie_hmac
+
+    def refresh(self):
+        """
+        Read the cookie again if the cookie file changed.
+        Throw CouldNotReadCookie if we couldn't read the cookie.
+        """
+
+        try:
+            st = os.stat(self.cookie_path)
+        except OSError, exc:
+            self.cookie_hmac = self.file_id = None
+            raise CouldNotReadCookie("Unable to stat '%s' (%s)" % (self.cookie_path, exc))
+
+        file_id = (st.st_ino, st.st_size, st.st_mtime)
+        if file_id != self.file_id:
+            self.cookie_hmac = self.file_id = None
+            auth_cookie = _read_auth_cookie(self.cookie_path)
+            log.debug("Read Extended ORPort authentication cookie from '%s'." % self.cookie_path)
+
+            self.cookie_hmac = hmac_sha256.KeyedHMAC(auth_cookie)
+            self.file_id = file_id
+
+        self.last_check = self.reactor.seconds()
+
 class ExtORPortProtocol(network.GenericProtocol):
     """
     Represents a connection to the Extended ORPort. It begins by
@@ -92,20 +149,20 @@ class ExtORPortProtocol(network.GenericProtocol):
 
     peer_addr: The address of the client, in the other side of the
                circuit, that connected to our downstream side.
-    cookie_file: Path to the Extended ORPort authentication cookie.
+    auth_cookie: The Extended ORPort authentication cookie (an AuthCookie).
     client_nonce: A random nonce used in the Extended ORPort
                   authentication protocol.
     client_hash: Our hash which is used to verify our knowledge of the
                  authentication cookie in the Extended ORPort Authentication
                  protocol.
     """
-    def __init__(self, circuit, ext_orport_addr, cookie_file, peer_addr, transport_name):
+    def __init__(self, circuit, ext_orport_addr, auth_cookie, peer_addr, transport_name):
         self.state = STATE_WAIT_FOR_AUTH_TYPES
         self.name = "ext_%s" % hex(id(self))
 
         self.ext_orport_addr = ext_orport_addr
         self.peer_addr = peer_addr
-        self.cookie_file = cookie_file
+        self.auth_cookie = auth_cookie
 
         self.client_nonce = rand.random_bytes(AUTH_NONCE_LEN)
         self.client_hash = None
@@ -250,7 +307,7 @@ class ExtORPortProtocol(network.GenericProtocol):
 
         server_hash = self.buffer.read(AUTH_HASH_LEN)
         server_nonce = self.buffer.read(AUTH_NONCE_LEN)
-        auth_cookie = _read_auth_cookie(self.cookie_file)
+        auth_cookie = self.auth_cookie.get()
 
         proper_server_hash = hmac_sha256.hmac_sha256_digest(auth_cookie,
                                                             AUTH_SERVER_TO_CLIENT_CONST + self.client_nonce + server_nonce)
@@ -343,22 +400,23 @@ class ExtORPortProtocol(network.GenericProtocol):
 
 
 class ExtORPortClientFactory(network.StaticDestinationClientFactory):
-    def __init__(self, circuit, cookie_file, peer_addr, transport_name):
+    def __init__(self, circuit, auth_cookie, peer_addr, transport_name):
         self.circuit = circuit
         self.peer_addr = peer_addr
-        self.cookie_file = cookie_file
+        self.auth_cookie = auth_cookie
         self.transport_name = transport_name
 
         self.name = "fact_ext_c_%s" % hex(id(self))
 
     def buildProtocol(self, addr):
-        return ExtORPortProtocol(self.circuit, addr, self.cookie_file, self.peer_addr, self.transport_name)
+        return ExtORPortProtocol(self.circuit, addr, self.auth_cookie, self.peer_addr, self.transport_name)
 
 class ExtORPortServerFactory(network.StaticDestinationClientFactory):
     def __init__(self, ext_or_addrport, ext_or_cookie_file, transport_name, transport_class, pt_config):
         self.ext_or_host = ext_or_addrport[0]
         self.ext_or_port = ext_or_addrport[1]
         self.cookie_file = ext_or_cookie_file
+        self.auth_cookie = AuthCookie(ext_or_cookie_file)
 
         self.transport_name = transport_name
         self.transport_class = transport_class
@@ -369,13 +427,20 @@ class ExtORPortServerFactory(network.StaticDestinationClientFactory):
     def startFactory(self):
         log.debug("%s: Starting up Extended ORPort server factory." % self.name)
 
+        # Read the cookie now, so that connections don't have to. If Tor
+        # did not write it yet, it is read on the first connection.
+        try:
+            self.auth_cookie.refresh()
+        except CouldNotReadCookie, err:
+            log.warning("%s: %s" % (self.name, err))
+
     def buildProtocol(self, addr):
         log.debug("%s: New connection from %s:%d." % (self.name, log.safe_addr_str(addr.host), addr.port))
 
         circuit = network.Circuit(self.transport_class())
 
         # XXX instantiates a new factory for each client
-        clientFactory = ExtORPortClientFactory(circuit, self.cookie_file, addr, self.transport_name)
+        clientFactory = ExtORPortClientFactory(circuit, self.auth_cookie, addr, self.transport_name)
         reactor.connectTCP(self.ext_or_host, self.ext_or_port, clientFactory)
 
         return network.StaticDestinationProtocol(circuit, 'server', addr)
@@ -2,10 +2,11 @@ import obfsproxy.network.network as network
 import obfsproxy.transports.transports as transports
 import obfsproxy.network.socks as socks
 import obfsproxy.network.extended_orport as extended_orport
+import obfsproxy.network.workers as workers
 
 from twisted.internet import reactor
 
-def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_config, ext_or_cookie_file=None):
+def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_config, ext_or_cookie_file=None, reuse_port=False):
     """
     Launch a listener for 'transport' in role 'role' (socks/client/server/ext_server).
 
@@ -21,6 +22,9 @@ def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_con
     ORPort Authentication cookie is stored. It's only used in
     'ext_server' mode.
 
+    If 'reuse_port' is set, the listener shares 'bindaddr' with other
+    processes using SO_REUSEPORT (see obfsproxy.network.workers).
+
     Return a tuple (addr, port) representing where we managed to bind.
 
     Throws obfsproxy.transports.transports.TransportNotFound if the
@@ -43,6 +47,9 @@ def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_con
         assert(remote_addrport)
         factory = network.StaticDestinationServerFactory(remote_addrport, role, transport_class, pt_config)
 
-    addrport = reactor.listenTCP(listen_port, factory, interface=listen_host)
+    if reuse_port:
+        addrport = workers.listen_reuseport(listen_host, listen_port, factory)
+    else:
+        addrport = reactor.listenTCP(listen_port, factory, interface=listen_host)
 
     return (addrport.getHost().host, addrport.getHost().port)
@@ -1,5 +1,7 @@
 from twisted.internet import reactor
+from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Protocol, Factory
+from zope.interface import implementer
 
 import obfsproxy.common.log as logging
 import obfsproxy.common.heartbeat as heartbeat
@@ -59,8 +61,59 @@ There are two kinds of client listeners: a 'simple' client listener
 always connects to the same remote peer every time it needs to
 initiate a downstream connection; a 'socks' client listener can be
 told to connect to an arbitrary remote peer using the SOCKS protocol.
+
+Flow control: once a circuit is completed, each of its connections is
+registered as a streaming producer of the other one. When the write
+buffer of a connection fills up, Twisted pauses reading from the other
+connection of the circuit until the buffer is drained. Pluggable
+transports that buffer data themselves can also pause reading from the
+upstream connection (see Circuit.pauseUpstream()).
 """
 
+# Reasons to pause reading from a connection.
+PAUSED_BY_CONSUMER = 'consumer'   # the other connection's buffer is full
+PAUSED_BY_TRANSPORT = 'transport' # the pluggable transport asked for it
+
+@implementer(IPushProducer)
+class ReadPauser(object):
+    """
+    Streaming producer that pauses reading from a connection.
+
+    Reading stays paused while there is any reason to pause it: the write
+    buffer of the other connection of the circuit is full, or the
+    pluggable transport buffers too much data.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.reasons = set()
+
+    def pause(self, reason):
+        if not self.reasons and self.conn.transport:
+            log.debug("%s: Pausing reading (%s)." % (self.conn.name, reason))
+            self.conn.transport.pauseProducing()
+        self.reasons.add(reason)
+
+    def resume(self, reason):
+        if reason not in self.reasons:
+            return
+        self.reasons.discard(reason)
+        if not self.reasons and self.conn.transport and not self.conn.closed:
+            log.debug("%s: Resuming reading (%s)." % (self.conn.name, reason))
+            self.conn.transport.resumeProducing()
+
+    def isPausedBy(self, reason):
+        return reason in self.reasons
+
+    def pauseProducing(self):
+        self.pause(PAUSED_BY_CONSUMER)
+
+    def resumeProducing(self):
+        self.resume(PAUSED_BY_CONSUMER)
+
+    def stopProducing(self):
+        pass # The circuit closes both connections.
+
 class Circuit(Protocol):
     """
     A Circuit holds a pair of connections. The upstream connection and
@@ -129,6 +182,10 @@ class Circuit(Protocol):
         # Set us as the circuit of our pluggable transport instance.
         self.transport.circuit = self
 
+        # Each connection stops reading when the other can't keep up.
+        self.upstream.transport.registerProducer(self.downstream.pauser, True)
+        self.downstream.transport.registerProducer(self.upstream.pauser, True)
+
         # Call the transport-specific circuitConnected method since
         # this is a good time to perform a handshake.
         self.transport.circuitConnected()
@@ -166,6 +223,24 @@ class Circuit(Protocol):
             log.info("%s: %s: Closing circuit." % (self.name, str(err)))
             self.close()
 
+    def pauseUpstream(self):
+        """
+        Stop reading from the upstream connection, e.g. because the
+        pluggable transport has buffered too much data.
+        """
+        self.upstream.pauser.pause(PAUSED_BY_TRANSPORT)
+
+    def resumeUpstream(self):
+        """Undo pauseUpstream()."""
+        self.upstream.pauser.resume(PAUSED_BY_TRANSPORT)
+
+    def isDownstreamFull(self):
+        """
+        Return True if the write buffer of the downstream connection is
+        full, so that reading from upstream is paused.
+        """
+        return self.upstream.pauser.isPausedBy(PAUSED_BY_CONSUMER)
+
     def close(self, reason=None, side=None):
         """
         Tear down the circuit. The reason for the torn down circuit is given in
@@ -196,11 +271,13 @@ class GenericProtocol(Protocol, object):
             away. This can happen because the circuit is not yet
             complete, or because the pluggable transport needs more
             data before deciding what to do.
+    pauser: Producer that pauses reading from this connection.
     """
     def __init__(self, circuit):
         self.circuit = circuit
         self.buffer = obfs_buf.Buffer()
         self.closed = False # True if connection is closed.
+        self.pauser = ReadPauser(self)
 
     def connectionLost(self, reason):
         log.debug("%s: Connection was lost (%s)." % (self.name, reason.getErrorMessage()))
@@ -222,6 +299,18 @@ class GenericProtocol(Protocol, object):
 
         self.transport.write(buf)
 
+    def writeSequence(self, seq):
+        """
+        Write the strings in 'seq' to the underlying transport at once.
+        """
+        if self.closed:
+            log.debug("%s: Calling writeSequence() while connection is closed. Ignoring.", self.name)
+            return
+
+        log.debug("%s: Writing %d bytes." % (self.name, sum(len(buf) for buf in seq)))
+
+        self.transport.writeSequence(seq)
+
     def close(self, also_close_circuit=True):
         """
         Close the connection.
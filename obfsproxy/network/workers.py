@@ -0,0 +1,300 @@
+"""
+Multi-process server mode.
+
+A single reactor confines a bridge to one CPU core. In multi-process mode,
+obfsproxy acts as a supervisor that reserves the listening address and
+spawns a number of worker processes. Each worker runs its own reactor and
+listens on the same address using SO_REUSEPORT, so that the kernel
+balances incoming connections among them.
+
+The supervisor restarts workers that exit or stop sending heartbeats.
+Workers periodically report their connection stats to the supervisor,
+which merges them into its own heartbeat.
+
+The supervisor passes the worker configuration in the environment variable
+`WORKER_SPEC_ENV` and talks to the worker through pipes: the worker's
+stdin, which gets closed when the supervisor stops or dies, and file descriptor
+`STATS_FD`, on which the worker writes one line of stats per report. The
+worker's stdout is a pipe too, whose lines the supervisor logs: in managed
+mode the supervisor's stdout belongs to the managed-proxy protocol with Tor,
+which workers must not write to.
+"""
+
+import ast
+import os
+import signal
+import socket
+import sys
+import time
+
+from twisted.internet import reactor, error, protocol, stdio, task
+from twisted.protocols.basic import LineReceiver
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.heartbeat as heartbeat
+
+log = logging.get_obfslogger()
+
+# Environment variable carrying the configuration of a worker.
+WORKER_SPEC_ENV = 'OBFSPROXY_WORKER_SPEC'
+
+# File descriptor of the worker where stats are reported.
+STATS_FD = 3
+
+# Seconds between stats reports of workers.
+STATS_INTERVAL = 10
+
+# Seconds without reports after which a worker is considered hung.
+HEARTBEAT_TIMEOUT = 3 * STATS_INTERVAL
+
+# Seconds to wait before restarting a worker that exited. The delay doubles
+# every time the worker exits again before running for STABLE_WORKER_TIME
+# seconds, up to MAX_RESTART_DELAY.
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+STABLE_WORKER_TIME = HEARTBEAT_TIMEOUT
+
+# Backlog of the listening sockets of workers.
+LISTEN_BACKLOG = 50
+
+class WorkerError(Exception): pass
+
+def reuseport_socket(host, port):
+    """
+    Return a TCP socket bound to ('host', 'port') with SO_REUSEPORT set,
+    so that other processes can bind to the same address.
+
+    Throws WorkerError if SO_REUSEPORT is not supported.
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise WorkerError("SO_REUSEPORT is not supported on this platform.")
+
+    family, socktype, proto, _, sockaddr = \
+        socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+    sock = socket.socket(family, socktype, proto)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(sockaddr)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+def listen_reuseport(host, port, factory):
+    """
+    Listen on ('host', 'port') with a socket that shares its address with
+    the other workers. Return the listening port.
+    """
+    sock = reuseport_socket(host, port)
+    try:
+        sock.listen(LISTEN_BACKLOG)
+        sock.setblocking(False)
+        # The reactor works on its own copy of the socket.
+        return reactor.adoptStreamPort(sock.fileno(), sock.family, factory)
+    finally:
+        sock.close()
+
+def get_worker_spec():
+    """Return the configuration of this worker or None if we are not one."""
+    spec = os.environ.get(WORKER_SPEC_ENV)
+    if not spec:
+        return None
+    return ast.literal_eval(spec)
+
+def encode_stats():
+    """Return the heartbeat stats gathered since the last report."""
+    hb = heartbeat.heartbeat
+    stats = {'pid': os.getpid(),
+             'connections': hb.n_connections,
+             'unique_ips': [ip.encode('hex') for ip in hb.unique_ips]}
+    hb.reset_stats()
+    return repr(stats)
+
+def decode_stats(line):
+    """Return the stats dictionary reported by a worker in 'line'."""
+    stats = ast.literal_eval(line)
+    stats['unique_ips'] = set(ip.decode('hex') for ip in stats['unique_ips'])
+    return stats
+
+class WorkerReporter(LineReceiver):
+    """
+    Runs in the worker: reports stats to the supervisor and stops the
+    worker when the supervisor goes away.
+    """
+    delimiter = '\n'
+
+    def __init__(self):
+        self.reporting = None
+
+    def connectionMade(self):
+        self.reporting = task.LoopingCall(self.report)
+        self.reporting.start(STATS_INTERVAL, now=True)
+
+    def report(self):
+        self.sendLine(encode_stats())
+
+    def lineReceived(self, line):
+        pass
+
+    def connectionLost(self, reason):
+        if self.reporting and self.reporting.running:
+            self.reporting.stop()
+        log.info("Lost the connection with the supervisor, exiting.")
+        try:
+            reactor.stop()
+        except error.ReactorNotRunning:
+            # We are shutting down already (e.g. SIGTERM).
+            pass
+
+def start_reporting():
+    """Start reporting stats to the supervisor of this worker."""
+    return stdio.StandardIO(WorkerReporter(), stdin=0, stdout=STATS_FD)
+
+class WorkerProcessProtocol(protocol.ProcessProtocol):
+    """Runs in the supervisor: represents a worker process."""
+
+    def __init__(self, supervisor, index):
+        self.supervisor = supervisor
+        self.index = index
+        self.bufs = {1: '', STATS_FD: ''}
+        self.started = supervisor.reactor.seconds()
+        self.last_seen = time.time()
+
+    def childDataReceived(self, childFD, data):
+        if childFD == STATS_FD:
+            for line in self.read_lines(childFD, data):
+                try:
+                    stats = decode_stats(line)
+                except (ValueError, SyntaxError, TypeError, KeyError):
+                    log.warning("Worker %d sent invalid stats." % self.index)
+                    continue
+                self.last_seen = time.time()
+                self.supervisor.stats_received(self, stats)
+        elif childFD == 1:
+            # E.g. the logs of a worker without a log file.
+            for line in self.read_lines(childFD, data):
+                log.warning("Worker %d: %s" % (self.index, line))
+
+    def read_lines(self, childFD, data):
+        """Return the complete lines received on 'childFD'."""
+        lines = (self.bufs[childFD] + data).split('\n')
+        self.bufs[childFD] = lines.pop()
+        return lines
+
+    def processEnded(self, reason):
+        self.supervisor.worker_ended(self, reason)
+
+class WorkerSupervisor(object):
+    """
+    Spawns 'n_workers' worker processes that serve a transport on the same
+    address, restarts them when they die and aggregates their stats.
+
+    'spec' is a dictionary with the configuration of the workers. It must
+    contain the 'argv' with which obfsproxy was called and the 'bindaddr'
+    on which the workers should listen.
+    """
+
+    def __init__(self, n_workers, spec, _reactor=reactor):
+        if n_workers < 1:
+            raise ValueError("The number of workers must be positive.")
+        self.n_workers = n_workers
+        self.spec = dict(spec)
+        self.reactor = _reactor
+        self.workers = {}
+        self.restarts = 0
+        # Number of times each worker exited soon after being (re)started.
+        self.crashes = {}
+        self.stopping = False
+        self.reserved_sock = None
+        self.monitor = None
+
+    def reserve_address(self):
+        """
+        Bind (without listening) to the address of the workers so that it
+        stays ours while workers come and go. Return the bound (host, port).
+        """
+        host, port = self.spec['bindaddr']
+        try:
+            self.reserved_sock = reuseport_socket(host, int(port))
+        except socket.error, e:
+            raise WorkerError("Could not bind to %s:%s (%s)." % (host, port, e))
+        addrport = self.reserved_sock.getsockname()[:2]
+        self.spec['bindaddr'] = addrport
+        return addrport
+
+    def start(self):
+        """Reserve the address and spawn the workers. Return the address."""
+        addrport = self.reserve_address()
+        for index in xrange(self.n_workers):
+            self.spawn_worker(index)
+        self.monitor = task.LoopingCall(self.check_heartbeats)
+        self.monitor.clock = self.reactor
+        self.monitor.start(STATS_INTERVAL, now=False)
+        self.reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+        return addrport
+
+    def spawn_worker(self, index):
+        env = dict(os.environ)
+        env[WORKER_SPEC_ENV] = repr(self.spec)
+        args = [sys.executable, '-m', 'obfsproxy.pyobfsproxy'] + list(self.spec['argv'])
+        worker = WorkerProcessProtocol(self, index)
+        self.reactor.spawnProcess(worker, sys.executable, args, env=env,
+                                  childFDs={0: 'w', 1: 'r', 2: 2, STATS_FD: 'r'})
+        self.workers[index] = worker
+        log.debug("Spawned worker %d (pid %s)." % (index, worker.transport.pid))
+        return worker
+
+    def worker_ended(self, worker, reason):
+        if self.workers.get(worker.index) is not worker:
+            return
+        del self.workers[worker.index]
+        if self.stopping:
+            return
+        delay = self.restart_delay(worker)
+        log.warning("Worker %d exited (%s), restarting it in %ds." %
+                    (worker.index, reason.getErrorMessage(), delay))
+        self.restarts += 1
+        self.reactor.callLater(delay, self.restart_worker, worker.index)
+
+    def restart_delay(self, worker):
+        """Return the delay before restarting 'worker', which exited."""
+        if self.reactor.seconds() - worker.started >= STABLE_WORKER_TIME:
+            self.crashes[worker.index] = 0
+        crashes = self.crashes.get(worker.index, 0)
+        self.crashes[worker.index] = crashes + 1
+        return min(RESTART_DELAY * 2 ** crashes, MAX_RESTART_DELAY)
+
+    def restart_worker(self, index):
+        if not self.stopping and index not in self.workers:
+            self.spawn_worker(index)
+
+    def stats_received(self, worker, stats):
+        heartbeat.heartbeat.merge_stats(stats['connections'], stats['unique_ips'])
+
+    def check_heartbeats(self):
+        """Kill the workers that stopped reporting, they get restarted."""
+        now = time.time()
+        for worker in self.workers.values():
+            if now - worker.last_seen > HEARTBEAT_TIMEOUT:
+                log.warning("Worker %d stopped sending heartbeats, killing it." %
+                            worker.index)
+                self.signal_worker(worker, signal.SIGKILL)
+
+    def signal_worker(self, worker, signum):
+        try:
+            worker.transport.signalProcess(signum)
+        except Exception:
+            # The process exited already.
+            pass
+
+    def stop(self):
+        """Terminate the workers by closing their stdin."""
+        self.stopping = True
+        if self.monitor and self.monitor.running:
+            self.monitor.stop()
+        for worker in self.workers.values():
+            worker.transport.closeStdin()
+        if self.reserved_sock:
+            self.reserved_sock.close()
+            self.reserved_sock = None
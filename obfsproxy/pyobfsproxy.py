@@ -11,7 +11,9 @@ import sys
 
 import obfsproxy.network.launch_transport as launch_transport
 import obfsproxy.network.network as network
+import obfsproxy.network.workers as workers
 import obfsproxy.transports.transports as transports
+import obfsproxy.transports.dh_pool as dh_pool
 import obfsproxy.common.log as logging
 import obfsproxy.common.argparser as argparser
 import obfsproxy.common.heartbeat as heartbeat
@@ -31,10 +33,16 @@ from twisted.internet import task # for LoopingCall
 
 log = logging.get_obfslogger()
 
-def set_up_cli_parsing():
+def set_up_cli_parsing(argv=None):
     """Set up our CLI parser. Register our arguments and options and
     query individual transports to register their own external-mode
-    arguments."""
+    arguments.
+
+    Only the transports named in `argv` (default: sys.argv) are imported
+    to register their arguments, the rest just get an empty subparser."""
+
+    if argv is None:
+        argv = sys.argv[1:]
 
     parser = argparser.MyArgumentParser(
         description='py-obfsproxy: A pluggable transports proxy written in Python')
@@ -56,6 +64,18 @@ def set_up_cli_parsing():
     parser.add_argument('--proxy', action='store', dest='proxy',
                         help='Outgoing proxy (<proxy_type>://[<user_name>][:<password>][@]<ip>:<port>)')
 
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of server processes sharing the listening '
+                        'address with SO_REUSEPORT (default: %(default)s)')
+
+    parser.add_argument('--dh-pool-depth', type=int, default=dh_pool.DEFAULT_DEPTH,
+                        help='number of UniformDH keypairs of obfs3 and ScrambleSuit '
+                        'that are precomputed, 0 disables the pool (default: %(default)s)')
+
+    parser.add_argument('--dh-pool-refill', type=float, default=dh_pool.DEFAULT_REFILL_INTERVAL,
+                        help='seconds between the precomputation of two UniformDH '
+                        'keypairs (default: %(default)s)')
+
     # Managed mode is a subparser for now because there are no
     # optional subparsers: bugs.python.org/issue9253
     subparsers.add_parser("managed", help="managed mode")
@@ -63,22 +83,27 @@ def set_up_cli_parsing():
     # Add a subparser for each transport. Also add a
     # transport-specific function to later validate the parsed
     # arguments.
-    for transport, transport_class in transports.transports.items():
+    for transport in sorted(transports.transports):
         subparser = subparsers.add_parser(transport, help='%s help' % transport)
-        transport_class['base'].register_external_mode_cli(subparser)
-        subparser.set_defaults(validation_function=transport_class['base'].validate_external_mode_cli)
+        if transport not in argv:
+            continue
+        transport_class = transports.get_transport_class(transport, 'base')
+        transport_class.register_external_mode_cli(subparser)
+        subparser.set_defaults(validation_function=transport_class.validate_external_mode_cli)
 
     return parser
 
-def do_managed_mode():
+def do_managed_mode(n_workers=1):
     """This function starts obfsproxy's managed-mode functionality."""
 
     if checkClientMode():
         log.info('Entering client managed-mode.')
+        if n_workers > 1:
+            log.warning("Multiple workers are only supported by servers.")
         managed_client.do_managed_client()
     else:
         log.info('Entering server managed-mode.')
-        managed_server.do_managed_server()
+        managed_server.do_managed_server(n_workers)
 
 def do_external_mode(args):
     """This function starts obfsproxy's external-mode functionality."""
@@ -100,9 +125,46 @@ def do_external_mode(args):
     # Run setup() method.
     run_transport_setup(pt_config, args.name)
 
-    launch_transport.launch_transport_listener(args.name, args.listen_addr, args.mode, args.dest, pt_config, args.ext_cookie_file)
-    log.info("Launched '%s' listener at '%s:%s' for transport '%s'." % \
-                 (args.mode, log.safe_addr_str(args.listen_addr[0]), args.listen_addr[1], args.name))
+    if args.workers > 1:
+        supervisor = workers.WorkerSupervisor(args.workers,
+                                              {'argv': sys.argv[1:],
+                                               'transport': args.name,
+                                               'role': args.mode,
+                                               'bindaddr': args.listen_addr,
+                                               'remote_addrport': args.dest,
+                                               'ext_or_cookie_file': args.ext_cookie_file,
+                                               'state_location': args.data_dir,
+                                               'server_transport_options': None,
+                                               'obfsproxy_mode': 'external'})
+        listen_addr = supervisor.start()
+        log.info("Launched %d '%s' workers at '%s:%s' for transport '%s'." % \
+                     (args.workers, args.mode, log.safe_addr_str(listen_addr[0]), listen_addr[1], args.name))
+    else:
+        launch_transport.launch_transport_listener(args.name, args.listen_addr, args.mode, args.dest, pt_config, args.ext_cookie_file)
+        log.info("Launched '%s' listener at '%s:%s' for transport '%s'." % \
+                     (args.mode, log.safe_addr_str(args.listen_addr[0]), args.listen_addr[1], args.name))
+    reactor.run()
+
+def do_worker_mode(spec):
+    """This function runs a worker of the multi-process server mode."""
+
+    from twisted.internet import reactor
+
+    pt_config = transport_config.TransportConfig()
+    pt_config.setStateLocation(spec['state_location'])
+    pt_config.setListenerMode(spec['role'])
+    pt_config.setObfsproxyMode(spec['obfsproxy_mode'])
+    if spec['server_transport_options']:
+        pt_config.setServerTransportOptions(spec['server_transport_options'])
+
+    run_transport_setup(pt_config, spec['transport'])
+
+    launch_transport.launch_transport_listener(spec['transport'], spec['bindaddr'], spec['role'],
+                                               spec['remote_addrport'], pt_config,
+                                               spec['ext_or_cookie_file'], reuse_port=True)
+    log.info("Worker listening at '%s:%s' for transport '%s'." % \
+                 (log.safe_addr_str(spec['bindaddr'][0]), spec['bindaddr'][1], spec['transport']))
+    workers.start_reporting()
     reactor.run()
 
 def consider_cli_args(args):
@@ -125,6 +187,17 @@ def consider_cli_args(args):
         # managed proxies without a logfile must not log at all.
         log.disable_logs()
 
+    if args.workers < 1:
+        log.error("The number of workers must be positive.")
+        sys.exit(1)
+    elif (args.workers > 1) and (args.name != 'managed') and (args.mode not in ('server', 'ext_server')):
+        log.error("Multiple workers are only supported by servers.")
+        sys.exit(1)
+
+    if args.dh_pool_depth < 0 or args.dh_pool_refill < 0:
+        log.error("The depth and refill interval of the UniformDH keypair pool must not be negative.")
+        sys.exit(1)
+
     if args.proxy:
         # CLI proxy is only supported in external mode.
         if args.name == 'managed':
@@ -143,11 +216,17 @@ def consider_cli_args(args):
             log.error("Failed to parse proxy specifier: %s", e)
             sys.exit(1)
 
+def set_up_dh_pool(args):
+    """
+    Set up the pool of UniformDH keypairs. It is started by the setup() of
+    the transports that use it (obfs3 and ScrambleSuit).
+    """
+    if args.dh_pool_depth > 0:
+        dh_pool.new(args.dh_pool_depth, args.dh_pool_refill)
+
 def run_transport_setup(pt_config, transport_name):
     """Run the setup() method for our transports."""
-    for transport, transport_class in transports.transports.items():
-        if transport == transport_name:
-            transport_class['base'].setup(pt_config)
+    transports.get_transport_class(transport_name, 'base').setup(pt_config)
 
 def pyobfsproxy():
     """Actual pyobfsproxy entry-point."""
@@ -166,24 +245,36 @@ def pyobfsproxy():
     log.debug('argv: ' + str(sys.argv))
     log.debug('args: ' + str(args))
 
+    # Pass parsed arguments to the appropriate transports so that
+    # they can initialize and setup themselves. Exit if the
+    # provided arguments were corrupted.
+    if (args.name != 'managed'):
+        try:
+            args.validation_function(args)
+        except ValueError, err:
+            log.error(err)
+            sys.exit(1)
+
+    # Workers report their stats to the supervisor, which does the
+    # heartbeat for all of them.
+    worker_spec = workers.get_worker_spec()
+    if worker_spec:
+        set_up_dh_pool(args)
+        do_worker_mode(worker_spec)
+        return
+
+    # With multiple workers, the supervisor does not handshake.
+    if args.workers == 1:
+        set_up_dh_pool(args)
+
     # Fire up our heartbeat.
     l = task.LoopingCall(heartbeat.heartbeat.talk)
     l.start(3600.0, now=False)  # do heartbeat every hour
 
     # Initiate obfsproxy.
     if (args.name == 'managed'):
-        do_managed_mode()
+        do_managed_mode(args.workers)
     else:
-        # Pass parsed arguments to the appropriate transports so that
-        # they can initialize and setup themselves. Exit if the
-        # provided arguments were corrupted.
-
-        try:
-            args.validation_function(args)
-        except ValueError, err:
-            log.error(err)
-            sys.exit(1)
-
         do_external_mode(args)
 
 def run():
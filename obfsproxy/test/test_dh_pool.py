@@ -0,0 +1,79 @@
+import twisted.trial.unittest
+from twisted.internet import defer, task
+
+import obfsproxy.common.workerpool as workerpool
+import obfsproxy.transports.dh_pool as dh_pool
+import obfsproxy.transports.obfs3_dh as obfs3_dh
+
+class testKeyPool(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pool = dh_pool.KeyPool(3, 0.5, _reactor=self.clock)
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_invalid_args(self):
+        self.assertRaises(ValueError, dh_pool.KeyPool, 0, 1)
+        self.assertRaises(ValueError, dh_pool.KeyPool, 1, -1)
+
+    def test_fills_at_refill_rate(self):
+        self.pool.start()
+        self.assertEqual(len(self.pool.keys), 0)
+        self.clock.advance(0.5)
+        self.assertEqual(len(self.pool.keys), 1)
+        self.clock.pump([0.5] * 5)
+        self.assertEqual(len(self.pool.keys), 3)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_take_refills(self):
+        self.pool.start()
+        self.clock.pump([0.5] * 3)
+        udh = self.pool.take()
+        self.assertTrue(isinstance(udh, obfs3_dh.UniformDH))
+        self.assertEqual(len(self.pool.keys), 2)
+        self.clock.advance(0.5)
+        self.assertEqual(len(self.pool.keys), 3)
+
+    def test_keys_are_not_reused(self):
+        self.pool.start()
+        self.clock.pump([0.5] * 3)
+        keys = [self.pool.take() for _ in range(3)]
+        self.assertEqual(len(set(udh.get_public() for udh in keys)), 3)
+        self.assertEqual(self.pool.take(), None)
+        self.assertEqual((self.pool.hits, self.pool.misses), (3, 1))
+
+    def test_stop(self):
+        self.pool.start()
+        self.clock.pump([0.5] * 2)
+        self.pool.stop()
+        self.assertEqual(len(self.pool.keys), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(self.pool.take(), None)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_retries_when_worker_pool_is_full(self):
+        def full_pool(f, *args):
+            return defer.fail(workerpool.PoolFullError())
+        self.patch(workerpool, 'run', full_pool)
+        self.pool.start()
+        self.clock.advance(0.5)
+        self.assertEqual(len(self.pool.keys), 0)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+class testDefaultKeyPool(twisted.trial.unittest.TestCase):
+    def tearDown(self):
+        dh_pool.reset()
+
+    def test_new_keypair_without_pool(self):
+        self.assertEqual(dh_pool.take(), None)
+        self.assertTrue(isinstance(dh_pool.new_keypair(), obfs3_dh.UniformDH))
+
+    def test_new_keypair_from_pool(self):
+        pool = dh_pool.new(2, 0)
+        pool.reactor = task.Clock()
+        dh_pool.start()
+        pool.reactor.advance(0)
+        udh = pool.keys[0]
+        self.assertIs(dh_pool.new_keypair(), udh)
+        self.assertRaises(RuntimeError, dh_pool.new)
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+import twisted.trial.unittest
+from twisted.internet import task
+
+import obfsproxy.common.hmac_sha256 as hmac_sha256
+import obfsproxy.network.extended_orport as extended_orport
+
+COOKIE = "A" * extended_orport.AUTH_COOKIE_LEN
+
+class testAuthCookie(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "extended_orport_auth_cookie")
+        self.auth_cookie = extended_orport.AuthCookie(self.path, 1, _reactor=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_cookie(self, cookie, header=extended_orport.AUTH_COOKIE_HEADER):
+        # Like Tor, write a new file and move it over the old one.
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header + cookie)
+        os.rename(tmp_path, self.path)
+
+    def assertCookie(self, cookie):
+        self.assertEqual(hmac_sha256.hmac_sha256_digest(self.auth_cookie.get(), "msg"),
+                         hmac_sha256.hmac_sha256_digest(cookie, "msg"))
+
+    def test_reads_cookie(self):
+        self.write_cookie(COOKIE)
+        self.assertCookie(COOKIE)
+
+    def test_missing_file(self):
+        self.assertRaises(extended_orport.CouldNotReadCookie, self.auth_cookie.get)
+
+    def test_corrupted_file(self):
+        self.write_cookie(COOKIE, header="X" * extended_orport.AUTH_COOKIE_HEADER_LEN)
+        self.assertRaises(extended_orport.CouldNotReadCookie, self.auth_cookie.get)
+        self.write_cookie(COOKIE[1:])
+        self.assertRaises(extended_orport.CouldNotReadCookie, self.auth_cookie.get)
+
+    def test_checks_file_once_per_interval(self):
+        self.write_cookie(COOKIE)
+        self.assertCookie(COOKIE)
+
+        self.write_cookie("B" * extended_orport.AUTH_COOKIE_LEN)
+        self.clock.advance(0.5)
+        self.assertCookie(COOKIE)
+        self.clock.advance(0.5)
+        self.assertCookie("B" * extended_orport.AUTH_COOKIE_LEN)
+
+    def test_does_not_read_unchanged_file(self):
+        self.write_cookie(COOKIE)
+        cookie_hmac = self.auth_cookie.get()
+        self.clock.advance(1)
+        self.assertIs(self.auth_cookie.get(), cookie_hmac)
+
+    def test_removed_file(self):
+        self.write_cookie(COOKIE)
+        self.auth_cookie.get()
+        os.remove(self.path)
+        self.clock.advance(1)
+        self.assertRaises(extended_orport.CouldNotReadCookie, self.auth_cookie.get)
+
+    def test_read_at_factory_start(self):
+        self.write_cookie(COOKIE)
+        factory = extended_orport.ExtORPortServerFactory(("127.0.0.1", 1), self.path,
+                                                         "dummy", None, None)
+        self.assertEqual(factory.auth_cookie.cookie_hmac, None)
+        factory.startFactory()
+        self.assertNotEqual(factory.auth_cookie.cookie_hmac, None)
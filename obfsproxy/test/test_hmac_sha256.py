@@ -0,0 +1,28 @@
+import twisted.trial.unittest
+
+import obfsproxy.common.hmac_sha256 as hmac_sha256
+
+class testHMAC_SHA256_RFC4231(twisted.trial.unittest.TestCase):
+    # RFC 4231, test case 2.
+    key = "Jefe"
+    msg = "what do ya want for nothing?"
+    mac = ("5bdcc146bf60754e6a042426089575c7"
+           "5a003f089d2739839dec58b964ec3843").decode('hex')
+
+    def test_digest(self):
+        self.assertEqual(hmac_sha256.hmac_sha256_digest(self.key, self.msg), self.mac)
+
+    def test_keyed_digest(self):
+        keyed = hmac_sha256.KeyedHMAC(self.key)
+        self.assertEqual(keyed.digest(self.msg), self.mac)
+        # The keyed object can be used again.
+        self.assertEqual(keyed.digest(self.msg), self.mac)
+        self.assertEqual(hmac_sha256.hmac_sha256_digest(keyed, self.msg), self.mac)
+
+    def test_with_prefix(self):
+        keyed = hmac_sha256.KeyedHMAC(self.key)
+        prefixed = keyed.with_prefix(self.msg[:10])
+        self.assertEqual(prefixed.digest(self.msg[10:]), self.mac)
+        self.assertEqual(prefixed.digest(self.msg[10:]), self.mac)
+        # The original object is left alone.
+        self.assertEqual(keyed.digest(self.msg), self.mac)
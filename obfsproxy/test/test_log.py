@@ -0,0 +1,71 @@
+import logging
+import threading
+import time
+import unittest
+
+import twisted.trial.unittest
+
+import obfsproxy.common.log as obfs_log
+
+class BlockingHandler(logging.Handler):
+    """Collects records, blocking until 'unblocked' is set."""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.unblocked = threading.Event()
+
+    def emit(self, record):
+        self.unblocked.wait()
+        self.records.append(record)
+
+def make_record(level, msg):
+    return logging.LogRecord('test', level, __file__, 0, msg, (), None)
+
+class testAsyncLogHandler(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.target = BlockingHandler()
+
+    def tearDown(self):
+        self.target.unblocked.set()
+        self.handler.close()
+
+    def fill(self, records):
+        for level, msg in records:
+            self.handler.handle(make_record(level, msg))
+
+    def test_records_are_written_in_order(self):
+        self.handler = obfs_log.AsyncLogHandler(self.target, capacity=10)
+        self.target.unblocked.set()
+        self.fill([(logging.DEBUG, 'a'), (logging.WARNING, 'b'), (logging.INFO, 'c')])
+        self.handler.flush()
+        self.assertEqual([r.msg for r in self.target.records], ['a', 'b', 'c'])
+        self.assertEqual(self.handler.get_stats(),
+                         {'queued': 0, 'dropped': 0, 'written': 3})
+
+    def test_lowest_severity_is_dropped_first(self):
+        self.handler = obfs_log.AsyncLogHandler(self.target, capacity=3)
+        # The sink thread takes the first record and blocks on it.
+        self.fill([(logging.ERROR, 'blocked')])
+        while self.handler.queued:
+            time.sleep(0.001)
+        self.fill([(logging.INFO, 'i1'), (logging.DEBUG, 'd1'), (logging.DEBUG, 'd2'),
+                   (logging.WARNING, 'w1'), (logging.WARNING, 'w2'),
+                   (logging.DEBUG, 'd3')])
+        stats = self.handler.get_stats()
+        self.assertEqual(stats['queued'], 3)
+        self.assertEqual(stats['dropped'], 3)
+        self.target.unblocked.set()
+        self.handler.flush()
+        self.assertEqual([r.msg for r in self.target.records],
+                         ['blocked', 'i1', 'w1', 'w2'])
+
+    def test_close_writes_queued_records(self):
+        self.handler = obfs_log.AsyncLogHandler(self.target)
+        self.fill([(logging.INFO, str(i)) for i in range(100)])
+        self.target.unblocked.set()
+        self.handler.close()
+        self.assertEqual(len(self.target.records), 100)
+        self.assertFalse(self.handler.thread.is_alive())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+import twisted.trial.unittest
+from twisted.internet.address import IPv4Address
+from twisted.test import proto_helpers
+
+import obfsproxy.network.network as network
+from obfsproxy.transports.dummy import DummyTransport
+
+class testFlowControl(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        addr = IPv4Address('TCP', '127.0.0.1', 0)
+        self.circuit = network.Circuit(DummyTransport())
+        self.downstream = network.StaticDestinationProtocol(self.circuit, 'server', addr)
+        self.upstream = network.StaticDestinationProtocol(self.circuit, 'server', addr)
+        # The first connection of a server circuit is the downstream one.
+        for conn in (self.downstream, self.upstream):
+            conn.makeConnection(proto_helpers.StringTransport())
+
+    def tearDown(self):
+        for call in network.reactor.getDelayedCalls():
+            call.cancel()
+
+    def test_connections_are_producers_of_each_other(self):
+        self.assertIs(self.downstream.transport.producer, self.upstream.pauser)
+        self.assertIs(self.upstream.transport.producer, self.downstream.pauser)
+
+    def test_full_downstream_pauses_upstream(self):
+        self.upstream.pauser.pauseProducing()
+        self.assertTrue(self.circuit.isDownstreamFull())
+        self.assertEqual(self.upstream.transport.producerState, 'paused')
+        self.upstream.pauser.resumeProducing()
+        self.assertFalse(self.circuit.isDownstreamFull())
+        self.assertEqual(self.upstream.transport.producerState, 'producing')
+
+    def test_reading_resumes_when_all_reasons_are_gone(self):
+        self.circuit.pauseUpstream()
+        self.upstream.pauser.pauseProducing()
+        self.circuit.resumeUpstream()
+        self.assertEqual(self.upstream.transport.producerState, 'paused')
+        self.upstream.pauser.resumeProducing()
+        self.assertEqual(self.upstream.transport.producerState, 'producing')
+
+    def test_resume_without_pause(self):
+        self.circuit.resumeUpstream()
+        self.assertEqual(self.upstream.transport.producerState, 'producing')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+import obfsproxy.pyobfsproxy as pyobfsproxy
+import obfsproxy.transports.transports as transports
+import twisted.trial.unittest
+
+class testTransportRegistry(twisted.trial.unittest.TestCase):
+    def test_all_transports_resolve(self):
+        for name in transports.transports:
+            base = transports.get_transport_class(name, 'base')
+            self.assertTrue(issubclass(transports.get_transport_class(name, 'client'), base))
+            self.assertTrue(issubclass(transports.get_transport_class(name, 'server'), base))
+
+    def test_equivalent_roles(self):
+        self.assertIs(transports.get_transport_class('obfs3', 'socks'),
+                      transports.get_transport_class('obfs3', 'client'))
+        self.assertIs(transports.get_transport_class('obfs3', 'ext_server'),
+                      transports.get_transport_class('obfs3', 'server'))
+
+    def test_unknown_transport(self):
+        self.assertRaises(transports.TransportNotFound,
+                          transports.get_transport_class, 'foo', 'client')
+        self.assertRaises(transports.TransportNotFound,
+                          transports.get_transport_class, 'obfs3', 'foo')
+
+class testCLIParsing(twisted.trial.unittest.TestCase):
+    def test_requested_transport_arguments(self):
+        argv = ['b64', '--dest', '127.0.0.1:1', 'client', '127.0.0.1:0']
+        args = pyobfsproxy.set_up_cli_parsing(argv).parse_args(argv)
+        self.assertEqual(args.name, 'b64')
+        self.assertEqual(args.dest, ('127.0.0.1', 1))
+        self.assertTrue(callable(args.validation_function))
+
+    def test_managed_mode(self):
+        args = pyobfsproxy.set_up_cli_parsing(['managed']).parse_args(['managed'])
+        self.assertEqual(args.name, 'managed')
+
+if __name__ == '__main__':
+    unittest.main()
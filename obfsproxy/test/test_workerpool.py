@@ -0,0 +1,99 @@
+import threading
+
+import twisted.trial.unittest
+from twisted.internet import defer
+
+import obfsproxy.common.workerpool as workerpool
+
+class FakeReactor(object):
+    """Runs the callbacks of worker threads in the worker threads."""
+    def __init__(self):
+        self.triggers = []
+
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+    def addSystemEventTrigger(self, phase, event, f):
+        self.triggers.append((phase, event, f))
+
+class testWorkerPool(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.pool = workerpool.WorkerPool(1, 1, _reactor=self.reactor)
+        self.unblocked = threading.Event()
+        self.results = []
+
+    def tearDown(self):
+        self.unblocked.set()
+        self.pool.stop()
+
+    def blocking_job(self, value):
+        self.unblocked.wait(10)
+        return value
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, workerpool.WorkerPool, 0, 1)
+        self.assertRaises(ValueError, workerpool.WorkerPool, 1, -1)
+
+    def test_runs_jobs(self):
+        self.unblocked.set()
+        for value in range(2):
+            self.pool.run(self.blocking_job, value).addCallback(self.results.append)
+        # Joins the threads once the queue is empty.
+        self.pool.stop()
+        self.assertEqual(self.results, [0, 1])
+        self.assertEqual(self.pool.pending, 0)
+
+    def test_rejects_jobs_when_full(self):
+        # One job runs, one waits and the third one does not fit.
+        for value in range(2):
+            self.pool.run(self.blocking_job, value).addCallback(self.results.append)
+        self.assertTrue(self.pool.is_full())
+
+        d = self.pool.run(self.blocking_job, 2)
+        self.assertFailure(d, workerpool.PoolFullError)
+        self.assertEqual(self.pool.rejected, 1)
+
+        self.unblocked.set()
+        self.pool.stop()
+        self.assertEqual(self.results, [0, 1])
+        self.assertFalse(self.pool.is_full())
+        return d
+
+    def test_errors_are_passed_on(self):
+        d = self.pool.run(lambda: 1 / 0)
+        self.pool.stop()
+        self.assertEqual(self.pool.pending, 0)
+        return self.assertFailure(d, ZeroDivisionError)
+
+    def test_cancelled_jobs_are_counted(self):
+        d = self.pool.run(self.blocking_job, 0)
+        d.cancel()
+        self.assertFailure(d, defer.CancelledError)
+        self.assertEqual(self.pool.pending, 1)
+        self.unblocked.set()
+        self.pool.stop()
+        self.assertEqual(self.pool.pending, 0)
+        return d
+
+    def test_stops_at_shutdown(self):
+        self.pool.run(lambda: None)
+        self.assertEqual([(phase, event) for phase, event, _ in self.reactor.triggers],
+                         [('during', 'shutdown')])
+
+class testDefaultPool(twisted.trial.unittest.TestCase):
+    def tearDown(self):
+        workerpool.reset()
+
+    def test_runs_inline_without_pool(self):
+        results = []
+        workerpool.run(lambda x: x + 1, 1).addCallback(results.append)
+        self.assertEqual(results, [2])
+
+    def test_singleton(self):
+        pool = workerpool.new(3, 5)
+        self.assertIs(workerpool.get(), pool)
+        self.assertEqual((pool.size, pool.queue_limit), (3, 5))
+        self.assertRaises(RuntimeError, workerpool.new)
+        workerpool.reset()
+        self.assertIsNone(workerpool.get())
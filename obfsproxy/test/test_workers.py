@@ -0,0 +1,168 @@
+import ast
+import signal
+import unittest
+
+import twisted.trial.unittest
+from twisted.internet import task
+from twisted.python import failure
+
+import obfsproxy.common.heartbeat as heartbeat
+import obfsproxy.network.workers as workers
+
+class FakeProcessTransport(object):
+    def __init__(self, pid):
+        self.pid = pid
+        self.signals = []
+        self.stdin_closed = False
+
+    def signalProcess(self, signum):
+        self.signals.append(signum)
+
+    def closeStdin(self):
+        self.stdin_closed = True
+
+class FakeReactor(task.Clock):
+    """A clock that records the processes it is asked to spawn."""
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.spawned = []
+        self.child_fds = []
+
+    def spawnProcess(self, proto, executable, args, env, childFDs):
+        proto.transport = FakeProcessTransport(len(self.spawned))
+        self.spawned.append((proto, args, env))
+        self.child_fds.append(childFDs)
+        return proto.transport
+
+    def addSystemEventTrigger(self, phase, event, f):
+        pass
+
+class testReusePort(twisted.trial.unittest.TestCase):
+    def test_sockets_share_address(self):
+        first = workers.reuseport_socket('127.0.0.1', 0)
+        port = first.getsockname()[1]
+        second = workers.reuseport_socket('127.0.0.1', port)
+        try:
+            first.listen(1)
+            second.listen(1)
+            self.assertEqual(second.getsockname()[1], port)
+        finally:
+            first.close()
+            second.close()
+
+class testWorkerStats(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        heartbeat.heartbeat.reset_stats()
+
+    def tearDown(self):
+        heartbeat.heartbeat.reset_stats()
+
+    def test_stats_roundtrip(self):
+        heartbeat.heartbeat.register_connection('127.0.0.1')
+        heartbeat.heartbeat.register_connection('::1')
+        stats = workers.decode_stats(workers.encode_stats())
+        self.assertEqual(stats['connections'], 2)
+        self.assertEqual(stats['unique_ips'],
+                         set([heartbeat.get_integer_from_ip_str('127.0.0.1'),
+                              heartbeat.get_integer_from_ip_str('::1')]))
+        # Reported stats are not reported again.
+        self.assertEqual(heartbeat.heartbeat.n_connections, 0)
+
+    def test_supervisor_merges_stats(self):
+        heartbeat.heartbeat.register_connection('10.0.0.1')
+        line = workers.encode_stats()
+        supervisor = workers.WorkerSupervisor(1, {'argv': [], 'bindaddr': ('127.0.0.1', 0)},
+                                              _reactor=FakeReactor())
+        worker = workers.WorkerProcessProtocol(supervisor, 0)
+        worker.childDataReceived(workers.STATS_FD, line[:5])
+        self.assertEqual(heartbeat.heartbeat.n_connections, 0)
+        worker.childDataReceived(workers.STATS_FD, line[5:] + '\n')
+        worker.childDataReceived(workers.STATS_FD, line + '\n')
+        self.assertEqual(heartbeat.heartbeat.n_connections, 2)
+        self.assertEqual(len(heartbeat.heartbeat.unique_ips), 1)
+
+class testWorkerSupervisor(twisted.trial.unittest.TestCase):
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.supervisor = workers.WorkerSupervisor(3, {'argv': ['dummy'],
+                                                       'bindaddr': ('127.0.0.1', 0)},
+                                                   _reactor=self.reactor)
+        self.host, self.port = self.supervisor.start()
+
+    def tearDown(self):
+        self.supervisor.stop()
+
+    def end_worker(self, index):
+        worker = self.supervisor.workers[index]
+        worker.processEnded(failure.Failure(Exception("crash")))
+        return worker
+
+    def test_workers_get_spec(self):
+        self.assertEqual(len(self.reactor.spawned), 3)
+        proto, args, env = self.reactor.spawned[0]
+        self.assertEqual(args[-1], 'dummy')
+        spec = ast.literal_eval(env[workers.WORKER_SPEC_ENV])
+        self.assertEqual(spec['bindaddr'], (self.host, self.port))
+        self.assertNotEqual(self.port, 0)
+
+    def test_workers_do_not_inherit_stdout(self):
+        # In managed mode our stdout talks the managed-proxy protocol.
+        for child_fds in self.reactor.child_fds:
+            self.assertEqual(child_fds[1], 'r')
+            self.assertEqual(child_fds[workers.STATS_FD], 'r')
+
+    def test_worker_stdout_is_logged(self):
+        logged = []
+        self.patch(workers.log, 'warning', logged.append)
+        worker = self.supervisor.workers[0]
+        worker.childDataReceived(1, 'first line\nsec')
+        worker.childDataReceived(1, 'ond line\n')
+        self.assertEqual(logged, ['Worker 0: first line', 'Worker 0: second line'])
+
+    def test_crashed_worker_is_restarted(self):
+        self.end_worker(1)
+        self.assertEqual(len(self.supervisor.workers), 2)
+        self.reactor.advance(workers.RESTART_DELAY)
+        self.assertEqual(len(self.reactor.spawned), 4)
+        self.assertEqual(sorted(self.supervisor.workers.keys()), [0, 1, 2])
+        self.assertEqual(self.supervisor.restarts, 1)
+
+    def test_restart_delay_backs_off(self):
+        delay = workers.RESTART_DELAY
+        for _ in xrange(10):
+            self.end_worker(1)
+            self.reactor.advance(delay - 0.1)
+            self.assertNotIn(1, self.supervisor.workers)
+            self.reactor.advance(0.1)
+            self.assertIn(1, self.supervisor.workers)
+            delay = min(2 * delay, workers.MAX_RESTART_DELAY)
+        self.assertEqual(delay, workers.MAX_RESTART_DELAY)
+
+        # Other workers are not affected.
+        self.end_worker(2)
+        self.reactor.advance(workers.RESTART_DELAY)
+        self.assertIn(2, self.supervisor.workers)
+
+        # A worker that ran for a while is restarted quickly again.
+        self.reactor.advance(workers.STABLE_WORKER_TIME)
+        self.end_worker(1)
+        self.reactor.advance(workers.RESTART_DELAY)
+        self.assertIn(1, self.supervisor.workers)
+
+    def test_no_restart_when_stopping(self):
+        self.supervisor.stop()
+        for proto, _, _ in self.reactor.spawned:
+            self.assertTrue(proto.transport.stdin_closed)
+        self.end_worker(0)
+        self.reactor.advance(workers.RESTART_DELAY)
+        self.assertEqual(len(self.reactor.spawned), 3)
+
+    def test_hung_worker_is_killed(self):
+        worker = self.supervisor.workers[2]
+        worker.last_seen -= workers.HEARTBEAT_TIMEOUT + 1
+        self.supervisor.check_heartbeats()
+        self.assertEqual(worker.transport.signals, [signal.SIGKILL])
+        self.assertEqual(self.supervisor.workers[0].transport.signals, [])
+
+if __name__ == '__main__':
+    unittest.main()
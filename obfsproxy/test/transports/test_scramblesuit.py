@@ -1,14 +1,22 @@
 import unittest
 
 import os
+import time
+import random
+import yaml
 import base64
+import cPickle
 import shutil
 import tempfile
 
 import Crypto.Hash.SHA256
 import Crypto.Hash.HMAC
 
+from twisted.internet.address import IPv4Address
+
 import obfsproxy.common.log as logging
+import obfsproxy.common.serialize as pack
+import obfsproxy.common.workerpool as workerpool
 import obfsproxy.network.buffer as obfs_buf
 import obfsproxy.common.transport_config as transport_config
 import obfsproxy.transports.base as base
@@ -24,6 +32,7 @@ import obfsproxy.transports.scramblesuit.state as state
 import obfsproxy.transports.scramblesuit.ticket as ticket
 import obfsproxy.transports.scramblesuit.packetmorpher as packetmorpher
 import obfsproxy.transports.scramblesuit.probdist as probdist
+import obfsproxy.transports.scramblesuit.replay as replay
 
 
 # Disable all logging as it would yield plenty of warning and error
@@ -132,6 +141,17 @@ class CryptoTest( unittest.TestCase ):
         self.failUnless(len(mycrypto.HMAC_SHA256_128("x" * \
                         const.SHARED_SECRET_LENGTH, "test")) == 16)
 
+    def test7_keyedHMAC( self ):
+        key = "x" * const.SHARED_SECRET_LENGTH
+        keyed = mycrypto.keyedHMAC(key)
+        expected = Crypto.Hash.HMAC.new(key, "test",
+                                        Crypto.Hash.SHA256).digest()[:16]
+
+        self.failUnless(mycrypto.HMAC_SHA256_128(key, "test") == expected)
+        self.failUnless(mycrypto.HMAC_SHA256_128(keyed, "test") == expected)
+        self.failUnless(mycrypto.HMAC_SHA256_128(keyed.with_prefix("te"),
+                                                 "st") == expected)
+
 
 class UniformDHTest( unittest.TestCase ):
 
@@ -194,6 +214,48 @@ class UniformDHTest( unittest.TestCase ):
             else:
                 self.assertTrue(udh.extractPublicKey(buf))
 
+    def test5_deferPublicKey( self ):
+        # Without a worker pool, the computation is done right away.
+        client = uniformdh.new("A" * const.SHARED_SECRET_LENGTH, False)
+        results = []
+
+        d = client.deferHandshake()
+        d.addCallback(results.append)
+        clientHandshake = results.pop()
+
+        d = self.udh.deferPublicKey(obfs_buf.Buffer(clientHandshake),
+                                    results.append)
+        d.addCallback(results.append)
+        (serverKey, ok) = results
+        self.failUnless(ok == True)
+        self.failUnless(len(serverKey) == const.MASTER_KEY_LENGTH)
+
+        serverHandshake = self.udh.createHandshake()
+        d = client.deferPublicKey(obfs_buf.Buffer(serverHandshake),
+                                  results.append)
+        self.failUnless(results[-1] == serverKey)
+
+    def test6_deferInvalidPublicKey( self ):
+        self.failUnless(self.udh.deferPublicKey(obfs_buf.Buffer("A" * 2000),
+                                                lambda x: x) is None)
+
+        # The HMAC is valid but the public key is corrupted.
+        def corrupted( udh, remotePublicKey ):
+            raise base.PluggableTransportError("Corrupted public key.")
+
+        realComputeMasterKey = uniformdh.computeMasterKey
+        uniformdh.computeMasterKey = corrupted
+        try:
+            client = uniformdh.new("A" * const.SHARED_SECRET_LENGTH, False)
+            errors = []
+            d = self.udh.deferPublicKey(obfs_buf.Buffer(
+                                        client.createHandshake()), lambda x: x)
+            d.addErrback(errors.append)
+        finally:
+            uniformdh.computeMasterKey = realComputeMasterKey
+
+        self.failUnless(errors[0].check(base.PluggableTransportError))
+
 
 class UtilTest( unittest.TestCase ):
 
@@ -251,9 +313,11 @@ class StateTest( unittest.TestCase ):
     def setUp( self ):
         const.STATE_LOCATION = tempfile.mkdtemp()
         self.stateFile = os.path.join(const.STATE_LOCATION, const.SERVER_STATE_FILE)
+        self.journalFile = os.path.join(const.STATE_LOCATION, const.SERVER_JOURNAL_FILE)
         self.state = state.State()
 
     def tearDown( self ):
+        self.state.commitJournal()
         try:
             shutil.rmtree(const.STATE_LOCATION)
         except OSError:
@@ -292,8 +356,123 @@ class StateTest( unittest.TestCase ):
 
         __builtin__.open = real_open
 
+    def test5_journal( self ):
+        key = "A" * const.HMAC_SHA256_128_LENGTH
+        self.state.genState()
+        snapshotId = state.getFileId(self.stateFile)
+        self.state.registerKey(key)
+        self.state.commitJournal()
+
+        # The key is appended to the journal, the snapshot is left alone.
+        self.assertEqual(state.getFileId(self.stateFile), snapshotId)
+        self.assertEqual(os.path.getsize(self.journalFile),
+                         state.RECORD_HEADER.size + len(key))
+
+        # Another process gets the key from the journal.
+        other = state.load()
+        self.failIf(other is self.state)
+        self.failUnless(other.isReplayed(key))
+
+    def test6_sharedState( self ):
+        self.state.genState()
+        other = state.load()
+        self.failUnless(state.load() is other)
+
+        key = "B" * const.HMAC_SHA256_128_LENGTH
+        self.state.registerKey(key)
+        self.failIf(other.isReplayed(key))
+        self.state.commitJournal()
+        other.refresh()
+        self.failUnless(other.isReplayed(key))
+
+        # Keys are merged when another process rewrites the snapshot.
+        otherKey = "C" * const.HMAC_SHA256_128_LENGTH
+        other.registerKey(otherKey)
+        other.commitJournal()
+        self.state.writeState()
+        self.assertEqual(os.path.getsize(self.journalFile), 0)
+        other.refresh()
+        self.failUnless(other.isReplayed(key))
+        self.failUnless(other.isReplayed(otherKey))
+
+    def test7_compaction( self ):
+        compactionSize = const.JOURNAL_COMPACTION_SIZE
+        const.JOURNAL_COMPACTION_SIZE = 100
+        try:
+            self.state.genState()
+            other = state.load()
+            keys = [chr(i) * const.HMAC_SHA256_128_LENGTH for i in xrange(5)]
+            for key in keys:
+                self.state.registerKey(key)
+            self.state.commitJournal()
+        finally:
+            const.JOURNAL_COMPACTION_SIZE = compactionSize
+
+        self.assertEqual(os.path.getsize(self.journalFile), 0)
+        other.refresh()
+        for key in keys:
+            self.failUnless(other.isReplayed(key))
+
+class FakeTime( object ):
+    def __init__( self, now ):
+        self.now = now
+
+    def time( self ):
+        return self.now
+
+class ReplayTest( unittest.TestCase ):
+    def setUp( self ):
+        self.realTime = replay.time
+        replay.time = FakeTime(1000000)
+        self.tracker = replay.Tracker()
+
+    def tearDown( self ):
+        replay.time = self.realTime
+
+    def test1_addElement( self ):
+        self.tracker.addElement("A")
+        self.failUnless(self.tracker.isPresent("A"))
+        self.failIf(self.tracker.isPresent("B"))
+        self.assertRaises(LookupError, self.tracker.addElement, "A")
+
+    def test2_prune( self ):
+        self.tracker.addElement("A")
+        self.tracker.addElement("B")
+        replay.time.now += 10
+        self.tracker.addElement("C")
+        self.assertEqual(len(self.tracker.buckets), 2)
+
+        replay.time.now += const.EPOCH_GRANULARITY - 9
+        self.failIf(self.tracker.isPresent("A"))
+        self.failIf(self.tracker.isPresent("B"))
+        self.failUnless(self.tracker.isPresent("C"))
+        self.assertEqual(len(self.tracker.buckets), 1)
+
+        replay.time.now += 10
+        self.failIf(self.tracker.isPresent("C"))
+        self.assertEqual(self.tracker.table, {})
+
+    def test3_clockGoesBackwards( self ):
+        self.tracker.addElement("A")
+        replay.time.now -= 10
+        self.tracker.addElement("B")
+        self.assertEqual(len(self.tracker.buckets), 1)
+        replay.time.now += const.EPOCH_GRANULARITY + 11
+        self.failIf(self.tracker.isPresent("B"))
+
+    def test4_unpickleOldTracker( self ):
+        # Trackers pickled before the buckets only have a table.
+        old = replay.Tracker.__new__(replay.Tracker)
+        old.table = {"A": 1000000 - const.EPOCH_GRANULARITY - 1,
+                     "B": 1000000}
+        tracker = cPickle.loads(cPickle.dumps(old))
+        self.assertEqual(len(tracker.buckets), 2)
+        self.failIf(tracker.isPresent("A"))
+        self.failUnless(tracker.isPresent("B"))
+
 class MockArgs( object ):
     uniformDHSecret = sharedSecret = ext_cookie_file = dest = None
+    cryptoWorkers = cryptoQueueLimit = None
     mode = 'socks'
 
 
@@ -316,6 +495,9 @@ class ScrambleSuitTransportTest( unittest.TestCase ):
         self.statefile = tempfile.mkdtemp()
 
     def tearDown( self ):
+        workerpool.reset()
+        self.suit.cryptoWorkers = const.CRYPTO_WORKERS
+        self.suit.cryptoQueueLimit = const.CRYPTO_QUEUE_LIMIT
         try:
             shutil.rmtree(self.statefile)
         except OSError:
@@ -351,6 +533,23 @@ class ScrambleSuitTransportTest( unittest.TestCase ):
         self.failUnless("password" in options)
         self.failUnless(options["password"] == "3X5BIA2MIHLZ55UV4VAEGKZIQPPZ4QT3")
 
+    def test4_cryptoPool( self ):
+        self.args.uniformDHSecret = self.validSecret
+        self.args.cryptoWorkers = 3
+        self.args.cryptoQueueLimit = 7
+        self.suit.validate_external_mode_cli(self.args)
+
+        transCfg = transport_config.TransportConfig()
+        transCfg.setStateLocation(self.statefile)
+        self.suit.setup(transCfg)
+
+        pool = workerpool.get()
+        self.failUnless((pool.size, pool.queue_limit) == (3, 7))
+
+        self.args.cryptoWorkers = 0
+        with self.assertRaises( base.PluggableTransportError ):
+            self.suit.validate_external_mode_cli(self.args)
+
 class MessageTest( unittest.TestCase ):
 
     def test1_createProtocolMessages( self ):
@@ -389,6 +588,71 @@ class MessageTest( unittest.TestCase ):
         self.assertRaises(base.PluggableTransportError,
                           message.ProtocolMessage, "1", paddingLen=const.MPU)
 
+    def newCrypters( self ):
+        sendCrypter = mycrypto.PayloadCrypter()
+        sendCrypter.setSessionKey("A" * 32, "B" * 8)
+        recvCrypter = mycrypto.PayloadCrypter()
+        recvCrypter.setSessionKey("A" * 32, "B" * 8)
+        return (sendCrypter, recvCrypter)
+
+    def test5_MessageExtractor( self ):
+        (sendCrypter, recvCrypter) = self.newCrypters()
+        hmacKey = "C" * 32
+
+        payloads = ["X" * const.MPU, "", "Y" * 100, "Z"]
+        msgs = [message.new(payloads[0]),
+                message.new(payloads[1], paddingLen=50),
+                message.new(payloads[2], flags=const.FLAG_NEW_TICKET),
+                message.new(payloads[3])]
+        wire = "".join([msg.encryptAndHMAC(sendCrypter, hmacKey)
+                        for msg in msgs])
+
+        # Feed the messages in chunks which split headers and bodies.
+        extractor = message.MessageExtractor()
+        extracted = []
+        for i in xrange(0, len(wire), 7):
+            extracted += extractor.extract(wire[i:i + 7], recvCrypter,
+                                           mycrypto.keyedHMAC(hmacKey))
+
+        self.failUnless([msg.payload for msg in extracted] == payloads)
+        self.failUnless([msg.flags for msg in extracted] ==
+                        [msg.flags for msg in msgs])
+        self.failUnless(len(extractor.recvBuf) == 0)
+
+    def test6_MessageExtractorInvalidHMAC( self ):
+        (sendCrypter, recvCrypter) = self.newCrypters()
+        wire = message.new("test").encryptAndHMAC(sendCrypter, "C" * 32)
+        wire = wire[:-1] + chr(ord(wire[-1]) ^ 1)
+
+        extractor = message.MessageExtractor()
+        self.assertRaises(base.PluggableTransportError, extractor.extract,
+                          wire, recvCrypter, "C" * 32)
+
+    def test7_encryptAndHMACMessages( self ):
+        (batchCrypter, msgCrypter) = self.newCrypters()
+        hmacKey = "C" * 32
+
+        msgs = message.createProtocolMessages("X" * (const.MPU * 2 + 10))
+        msgs += [message.new("", paddingLen=100),
+                 message.new("seed", flags=const.FLAG_PRNG_SEED)]
+        self.failUnless(len(msgs) == 5)
+
+        # One batch must equal the messages encrypted one after another.
+        expected = ""
+        for msg in msgs:
+            encrypted = msgCrypter.encrypt(pack.htons(msg.totalLen) +
+                                           pack.htons(msg.payloadLen) +
+                                           chr(msg.flags) + msg.payload +
+                                           (msg.totalLen - msg.payloadLen) *
+                                           "\0")
+            expected += mycrypto.HMAC_SHA256_128(hmacKey, encrypted) + \
+                        encrypted
+
+        blurb = message.encryptAndHMACMessages(msgs, batchCrypter,
+                                               mycrypto.keyedHMAC(hmacKey))
+        self.failUnless(blurb == expected)
+        self.failUnless(len(blurb) == sum([len(msg) for msg in msgs]))
+
 class TicketTest( unittest.TestCase ):
     def setUp( self ):
         const.STATE_LOCATION = tempfile.mkdtemp()
@@ -397,6 +661,7 @@ class TicketTest( unittest.TestCase ):
         self.state.genState()
 
     def tearDown( self ):
+        self.state.commitJournal()
         try:
             shutil.rmtree(const.STATE_LOCATION)
         except OSError:
@@ -430,6 +695,56 @@ class TicketTest( unittest.TestCase ):
             else:
                 self.assertTrue(ss.receiveTicket(buf))
 
+class TicketStoreTest( unittest.TestCase ):
+    def setUp( self ):
+        const.STATE_LOCATION = tempfile.mkdtemp() + '/'
+        self.bridge = IPv4Address('TCP', '127.0.0.1', 5555)
+        self.masterKey = "K" * const.MASTER_KEY_LENGTH
+        self.ticket = "T" * const.TICKET_LENGTH
+
+    def tearDown( self ):
+        try:
+            shutil.rmtree(const.STATE_LOCATION)
+        except OSError:
+            pass
+
+    def test1_storeAndRedeem( self ):
+        self.assertEqual(ticket.findStoredTicket(self.bridge), None)
+        ticket.storeNewTicket(self.masterKey, self.ticket, self.bridge)
+        self.assertEqual(ticket.findStoredTicket(self.bridge),
+                         (self.masterKey, self.ticket))
+        # Tickets can only be redeemed once.
+        self.assertEqual(ticket.findStoredTicket(self.bridge), None)
+
+    def test2_overwrite( self ):
+        ticket.storeNewTicket(self.masterKey, self.ticket, self.bridge)
+        newTicket = "U" * const.TICKET_LENGTH
+        ticket.storeNewTicket(self.masterKey, newTicket, self.bridge)
+        other = IPv4Address('TCP', '127.0.0.2', 5555)
+        ticket.storeNewTicket(self.masterKey, self.ticket, other)
+        self.assertEqual(ticket.findStoredTicket(self.bridge),
+                         (self.masterKey, newTicket))
+        self.assertEqual(ticket.findStoredTicket(other),
+                         (self.masterKey, self.ticket))
+
+    def test3_expired( self ):
+        db = ticket.openTicketStore()
+        with db:
+            db.execute("INSERT INTO tickets VALUES (?, ?, ?, ?)",
+                       (str(self.bridge), 0, self.masterKey, self.ticket))
+        self.assertEqual(ticket.findStoredTicket(self.bridge), None)
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM tickets").fetchone(),
+                         (0,))
+
+    def test4_importTicketFile( self ):
+        ticketFile = const.STATE_LOCATION + const.CLIENT_TICKET_FILE
+        tickets = {str(self.bridge): [int(time.time()), self.masterKey,
+                                      self.ticket]}
+        util.writeToFile(yaml.dump(tickets), ticketFile)
+        self.assertEqual(ticket.findStoredTicket(self.bridge),
+                         (self.masterKey, self.ticket))
+        self.failIf(os.path.exists(ticketFile))
+
 class PacketMorpher( unittest.TestCase ):
 
     def test1_calcPadding( self ):
@@ -464,5 +779,41 @@ class PacketMorpher( unittest.TestCase ):
                             const.HDR_LENGTH)
 
 
+
+class ProbDistTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.random = probdist.random.random
+
+    def tearDown( self ):
+        probdist.random.random = self.random
+
+    def linearSample( self, dist, rand ):
+        for cumulProb, singleton in dist.sampleList:
+            if rand <= cumulProb:
+                return singleton
+        return dist.sampleList[-1][1]
+
+    def test1_randomSample( self ):
+        # Binary search must pick the same bin as a linear walk.
+        for seed in xrange(20):
+            dist = probdist.new(lambda: random.randint(0, 10000), seed=seed)
+            rands = [cumulProb for cumulProb, _ in dist.sampleList] + \
+                    [0.0, 1.0, 0.5, 0.999999]
+            for rand in rands:
+                probdist.random.random = lambda: rand
+                self.failUnless(dist.randomSample() ==
+                                self.linearSample(dist, rand))
+
+    def test2_unpickleOldDist( self ):
+        dist = probdist.new(lambda: random.randint(0, 10000), seed=1)
+        del dist.cumulProbs
+        del dist.singletons
+
+        dist = cPickle.loads(cPickle.dumps(dist))
+        probdist.random.random = lambda: 1.0
+        self.failUnless(dist.randomSample() == dist.sampleList[-1][1])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+# WFPadTools imports
+from obfsproxy.transports.wfpadtools import budget
+from obfsproxy.transports.wfpadtools import const
+
+
+class PaddingBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.budget = budget.PaddingBudget(1000, 2000)
+
+    def test_consume_within_burst(self):
+        self.assertTrue(self.budget.consume(1500))
+        self.assertEqual(self.budget.getStats()['spentBytes'], 1500)
+
+    def test_consume_over_burst_is_skipped(self):
+        self.assertTrue(self.budget.consume(1500))
+        self.assertFalse(self.budget.consume(1500))
+        stats = self.budget.getStats()
+        self.assertEqual(stats['skippedBytes'], 1500)
+        self.assertEqual(stats['skippedMessages'], 1)
+
+    def test_refill_is_capped_by_burst(self):
+        self.budget.consume(2000)
+        self.budget.lastRefill -= 10
+        self.assertEqual(self.budget.level(), 1.0)
+
+    def test_watermarks(self):
+        self.budget.consume(2000 * (1 - const.BUDGET_LOW_WATERMARK) + 1)
+        self.assertTrue(self.budget.isLow())
+        self.assertFalse(self.budget.isRecovered())
+        self.budget.lastRefill -= 10
+        self.assertFalse(self.budget.isLow())
+        self.assertTrue(self.budget.isRecovered())
+
+    def test_singleton(self):
+        budget.reset()
+        self.assertIsNone(budget.get())
+        b = budget.new(100)
+        self.assertIs(budget.get(), b)
+        self.assertEqual(b.burst, 100)
+        self.assertRaises(RuntimeError, budget.new, 100)
+        budget.reset()
+
+
+if __name__ == "__main__":
+    unittest.main()
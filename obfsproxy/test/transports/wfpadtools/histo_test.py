@@ -41,6 +41,11 @@ class HistogramClassTestCase(unittest.TestCase):
         self.assert_uniform(100.0213)
         self.assert_uniform(const.INF_LABEL)
 
+    def test_default_uniform_histograms_are_shared(self):
+        self.assertIs(histo.uniform(INF_LABEL), histo.uniform(INF_LABEL))
+        self.assertIs(histo.uniform(0), histo.uniform(0))
+        self.assertIsNot(histo.uniform(0.5), histo.uniform(0.5))
+
     def test_mean_of_histogram(self):
         h = histo.new(TEST_DICTIONARY, interpolate=False)
         self.assert_mean(h, 0.3)
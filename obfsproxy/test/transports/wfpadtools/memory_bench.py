@@ -0,0 +1,47 @@
+"""Benchmark the memory used by idle wfpad circuits.
+
+It instantiates `NUM_CIRCUITS` server transports, as a bridge does when it
+accepts circuits that then stay idle, and reports the increase of the
+resident set size per circuit.
+
+Usage: python -m obfsproxy.test.transports.wfpadtools.memory_bench [N]
+"""
+import gc
+import sys
+
+import psutil
+
+from obfsproxy.common import transport_config
+from obfsproxy.transports.wfpadtools.wfpad import WFPadServer
+
+
+NUM_CIRCUITS = 10000
+
+
+def rss():
+    """Return the resident set size of this process in bytes."""
+    return psutil.Process().memory_info().rss
+
+
+def bench(num_circuits=NUM_CIRCUITS):
+    pt_config = transport_config.TransportConfig()
+    pt_config.setListenerMode("server")
+    pt_config.setObfsproxyMode("external")
+    WFPadServer.setup(pt_config)
+
+    # Warm up so that module-level state is not accounted to circuits
+    circuits = [WFPadServer()]
+    gc.collect()
+    rss_before = rss()
+    circuits += [WFPadServer() for _ in xrange(num_circuits)]
+    gc.collect()
+    rss_after = rss()
+    per_circuit = (rss_after - rss_before) / float(num_circuits)
+    print "Idle circuits: %d" % num_circuits
+    print "RSS increase: %.1f MiB" % ((rss_after - rss_before) / 1024.0 ** 2)
+    print "RSS per idle circuit: %.0f bytes" % per_circuit
+    return per_circuit
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else NUM_CIRCUITS)
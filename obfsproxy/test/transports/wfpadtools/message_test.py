@@ -43,6 +43,18 @@ class WFPadMessageFactoryTest(unittest.TestCase):
                         "No more than one message for control without args "
                         "was created.")
 
+    def test_ignore_frame_is_cached(self):
+        frame = self.msgFactory.getIgnoreFrame(const.MPU)
+        self.assertEqual(frame, str(self.msgFactory.newIgnore(const.MPU)))
+        self.assertIs(frame, self.msgFactory.getIgnoreFrame(const.MPU))
+
+    def test_ignore_frame_cache_is_bounded(self):
+        for length in xrange(const.IGNORE_FRAME_CACHE_SIZE + 10):
+            self.msgFactory.getIgnoreFrame(length)
+        frames = msg.WFPadMessageFactory._ignoreFrames
+        self.assertEqual(len(frames), const.IGNORE_FRAME_CACHE_SIZE)
+        self.assertNotIn(0, frames)
+
     def test_uniform_length(self):
         # Test payload is padded to specified length
         testData = "a message padded to MPU"
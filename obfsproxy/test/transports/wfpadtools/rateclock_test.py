@@ -0,0 +1,102 @@
+import unittest
+
+# WFPadTools imports
+from obfsproxy.transports.wfpadtools import const
+from obfsproxy.transports.wfpadtools.rateclock import ConstantRateClock
+
+
+class FakeTime(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, ms):
+        self.now += ms / const.SCALE
+
+
+class ConstantRateClockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.time = FakeTime()
+
+    def clock(self, period=10, policy=const.RATE_CATCHUP_BURST, maxCatchup=4):
+        return ConstantRateClock(period, policy, maxCatchup, _time=self.time)
+
+    def test_first_sample_is_one_period(self):
+        self.assertAlmostEqual(self.clock().randomSample(), 10)
+
+    def test_late_callbacks_do_not_drift(self):
+        clock = self.clock()
+        clock.randomSample()
+        # Each callback fires 3 ms late: the next delay is shortened
+        for slot in xrange(1, 6):
+            self.time.advance(clock.randomSample() + 3)
+            clock.tick()
+            self.assertAlmostEqual(clock.randomSample(), 7)
+        self.assertAlmostEqual(self.time.now, 1000.0 + 0.053)
+
+    def test_sample_does_not_consume_slot(self):
+        clock = self.clock()
+        clock.randomSample()
+        self.time.advance(4)
+        self.assertAlmostEqual(clock.randomSample(), 6)
+        self.assertAlmostEqual(clock.randomSample(), 6)
+
+    def test_burst_catchup(self):
+        clock = self.clock()
+        clock.randomSample()
+        # Three slots are missed (and the fourth is due)
+        self.time.advance(41)
+        sent = 0
+        while clock.randomSample() == 0:
+            clock.tick()
+            sent += 1
+        self.assertEqual(sent, 4)
+        self.assertEqual(clock.skipped, 0)
+        self.assertAlmostEqual(clock.randomSample(), 9)
+
+    def test_burst_catchup_is_bounded(self):
+        clock = self.clock()
+        clock.randomSample()
+        self.time.advance(101)
+        self.assertEqual(clock.randomSample(), 0)
+        clock.tick()
+        self.assertEqual(clock.skipped, 9)
+        self.assertAlmostEqual(clock.randomSample(), 9)
+
+    def test_skip_catchup(self):
+        clock = self.clock(policy=const.RATE_CATCHUP_SKIP)
+        clock.randomSample()
+        self.time.advance(41)
+        self.assertEqual(clock.randomSample(), 0)
+        clock.tick()
+        self.assertEqual(clock.skipped, 3)
+        self.assertAlmostEqual(clock.randomSample(), 9)
+
+    def test_ahead_of_schedule_resyncs(self):
+        clock = self.clock()
+        clock.randomSample()
+        for _ in xrange(5):
+            clock.tick()
+        self.assertAlmostEqual(clock.randomSample(), 10)
+
+    def test_set_period_keeps_last_deadline(self):
+        clock = self.clock()
+        clock.randomSample()
+        self.time.advance(10)
+        clock.tick()
+        clock.setPeriod(20)
+        self.assertAlmostEqual(clock.randomSample(), 20)
+
+    def test_zero_period(self):
+        self.assertEqual(self.clock(period=0).randomSample(), 0)
+
+    def test_invalid_policy(self):
+        self.assertRaises(ValueError, ConstantRateClock, 10, 'wait')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import time
+from random import uniform
+from twisted.trial import unittest
+
+from obfsproxy.test.transports.wfpadtools.twisted.twisted_tester import TransportTestCase
+from obfsproxy.transports.wfpadtools import const
+from obfsproxy.transports.wfpadtools.specific.bwdiff import IAT_LABELS
+
+
+# Number of upstream reads per period, including empty periods
+PERIODS = [3, 0, 5, 1, 0, 0, 8, 2, 4, 0, 6]
+
+
+def unbounded_differentials(periods, period):
+    """Compute the differentials like the previous implementation, which
+    kept the reads of all the periods of the session.
+    """
+    diffs, lengths = [], []
+    for num_reads in periods:
+        if num_reads > 0:
+            lengths.append([const.MTU] * num_reads)
+        if len(lengths) > 1:
+            bw0 = sum(lengths[-2]) / period
+            bw1 = sum(lengths[-1]) / period
+            diffs.append((bw1 - bw0) / period)
+    return diffs
+
+
+class BWDiffEstimationTestCase(TransportTestCase, unittest.TestCase):
+    transport = 'bwdiff'
+    args = []
+
+    def setUp(self):
+        TransportTestCase.setUp(self)
+        self.pt_server.initBwEstimation()
+        self.pt_server.session.startTime = time.time() - 1
+
+    def feed_periods(self, periods):
+        ts = 0
+        for num_reads in periods:
+            for _ in xrange(num_reads):
+                ts += uniform(0, 2)
+                self.pt_server.addUpstreamSample(ts, const.MTU)
+            self.pt_server.getBwDifferential()
+
+    def test_iat_window_is_bounded(self):
+        self.patch(const, 'BWDIFF_IAT_WINDOW', 10)
+        self.feed_periods(PERIODS)
+        iats = self.pt_server._iats
+        histo = self.pt_server._iatHisto
+        self.assertEqual(len(iats), 10)
+        self.assertEqual(sum(histo.hist.values()), 10)
+        self.assertEqual(sorted(histo.hist.keys()), sorted(IAT_LABELS))
+
+        # The histogram holds exactly the IATs in the window.
+        expected = dict.fromkeys(IAT_LABELS, 0)
+        for iat in iats:
+            expected[histo.getLabelFromFloat(iat)] += 1
+        self.assertEqual(histo.hist, expected)
+
+    def test_period_ring_is_bounded(self):
+        self.feed_periods(PERIODS)
+        self.assertEqual(list(self.pt_server._periodsBytes),
+                         [const.MTU * 4, const.MTU * 6])
+        self.assertEqual(self.pt_server._periodBytes, 0)
+
+    def test_differential_matches_unbounded_computation(self):
+        self.pt_server._period = 10
+        self.pt_server._threshold = 1
+        self.feed_periods(PERIODS)
+        expected = unbounded_differentials(PERIODS, self.pt_server._period)
+        self.assertEqual(list(self.pt_server.session.bw_diffs), expected)
+        # The last differential is above the threshold: padding follows
+        # the IATs of the upstream reads.
+        self.assertTrue(abs(expected[-1]) > self.pt_server._threshold)
+        self.assertIs(self.pt_server._burstHistoProbdist['snd'],
+                      self.pt_server._iatHisto)
+        self.assertIs(self.pt_server._gapHistoProbdist['snd'],
+                      self.pt_server._iatHisto)
+
+    def test_no_padding_below_threshold(self):
+        self.pt_server._period = 10
+        self.pt_server._threshold = 1000
+        self.feed_periods(PERIODS)
+        self.assertEqual(self.pt_server._burstHistoProbdist['snd'].randomSample(),
+                         const.INF_LABEL)
+
+    def test_differentials_are_bounded(self):
+        self.patch(const, 'BWDIFF_MAX_DIFFS', 5)
+        self.pt_server.session._bw_diffs = None
+        self.pt_server._period = 10
+        self.feed_periods(PERIODS * 2)
+        expected = unbounded_differentials(PERIODS * 2, self.pt_server._period)
+        self.assertEqual(list(self.pt_server.session.bw_diffs), expected[-5:])
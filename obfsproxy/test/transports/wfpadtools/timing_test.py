@@ -0,0 +1,66 @@
+from __future__ import absolute_import
+
+import time
+import unittest
+
+from twisted.internet import task
+
+# WFPadTools imports
+from obfsproxy.transports.wfpadtools import common, timing
+
+
+class TimerStatsTest(unittest.TestCase):
+
+    def test_stats(self):
+        stats = timing.TimerStats()
+        self.assertEqual(stats.getStats(), {'count': 0})
+        for lateness in xrange(1, 101):
+            stats.add(lateness)
+        result = stats.getStats()
+        self.assertEqual(result['count'], 100)
+        self.assertEqual(result['mean'], 50.5)
+        self.assertEqual(result['max'], 100)
+        self.assertAlmostEqual(result['median'], 50.5, delta=2)
+        self.assertAlmostEqual(result['p99'], 99, delta=2)
+
+
+class TimingMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        timing.reset()
+        self.monitor = timing.new()
+
+    def tearDown(self):
+        timing.reset()
+
+    def test_timed_records_lateness(self):
+        calls = []
+        fn = self.monitor.timed(('Test', 'data'), 0, calls.append)
+        time.sleep(0.01)
+        fn(1)
+        self.assertEqual(calls, [1])
+        stats = self.monitor.getStats()['Test.data']
+        self.assertEqual(stats['count'], 1)
+        self.assertGreaterEqual(stats['max'], 10)
+
+    def test_defer_later_records_timers_with_key(self):
+        clock = task.Clock()
+        original = common.reactor
+        common.reactor = clock
+        try:
+            common.deferLater(10, lambda: None, timer=('Test', 'burst'))
+            common.deferLater(10, lambda: None)
+            clock.advance(0.01)
+        finally:
+            common.reactor = original
+        self.assertEqual(self.monitor.getStats().keys(), ['Test.burst'])
+
+    def test_singleton(self):
+        self.assertIs(timing.get(), self.monitor)
+        self.assertRaises(RuntimeError, timing.new)
+        timing.reset()
+        self.assertIsNone(timing.get())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,8 +3,10 @@ from twisted.internet.base import DelayedCall
 from twisted.trial import unittest
 
 from obfsproxy.test.transports.wfpadtools.twisted import primitives_tester as pt
-from obfsproxy.transports.wfpadtools import const
+from obfsproxy.transports.wfpadtools import budget, const
+from obfsproxy.transports.wfpadtools.histo import uniform
 from obfsproxy.transports.wfpadtools.message import isData, isPadding
+from obfsproxy.transports.wfpadtools.specific.adaptive import AdaptiveTransport
 from obfsproxy.transports.wfpadtools.util import genutil as gu
 from obfsproxy.transports.wfpadtools.util import mathutil   
 
@@ -44,6 +46,142 @@ class AppHintTestCase(pt.WFPadPrimitiveTestCase, unittest.TestCase):
         self.assertTrue(self.pt_server._visiting)
 
 
+class ProcessMessagesTestCase(pt.WFPadPrimitiveTestCase, unittest.TestCase):
+    def test_control_message_splits_a_read(self):
+        factory = self.pt_client._msgFactory
+        sess_id = gu.hash_text(str(randint(1, 10)) + str(gu.timestamp()))
+        wire = str(factory.new("first")) + factory.getIgnoreFrame(100)
+        wire += "".join(str(msg) for msg in factory.encapsulate(
+            opcode=const.OP_APP_HINT, args=[sess_id, True]))
+        wire += str(factory.new("second"))
+
+        events = []
+        upstream = self.pt_server.circuit.upstream
+        upstream.write = events.append
+        upstream.writeSequence = lambda payloads: events.append("".join(payloads))
+        on_session_starts = self.pt_server.onSessionStarts
+        def session_starts(sess_id):
+            events.append("session")
+            on_session_starts(sess_id)
+        self.pt_server.onSessionStarts = session_starts
+
+        old_session = self.pt_server.session
+        self.pt_server.processMessages(wire)
+        new_session = self.pt_server.session
+
+        self.assertEqual(events, ["first", "session", "second"])
+        self.assertIsNot(new_session, old_session)
+        # Data and padding before the hint belong to the old session...
+        self.assertEqual(old_session.numMessages['rcv'], 2)
+        self.assertEqual(old_session.dataMessages['rcv'], 1)
+        self.assertEqual(old_session.dataBytes['rcv'], len("first"))
+        self.assertEqual([flags for _, flags, _, _, _ in old_session.history],
+                         [const.FLAG_DATA, const.FLAG_PADDING])
+        # ...and the hint and what follows it to the new one.
+        self.assertEqual(new_session.numMessages['rcv'], 2)
+        self.assertEqual(new_session.dataMessages['rcv'], 1)
+        self.assertEqual(new_session.dataBytes['rcv'], len("second"))
+        self.assertEqual([flags for _, flags, _, _, _ in new_session.history],
+                         [const.FLAG_CONTROL, const.FLAG_PADDING, const.FLAG_DATA])
+
+
+class SessionEndTestCase(pt.SessionPrimitiveTestCase, unittest.TestCase):
+    def test_session_ends_when_buffer_is_drained(self):
+        self.pt_client._buffer.write("pending data")
+        self.pt_client.onSessionEnds(self.sess_id)
+        self.assertTrue(self.pt_client.isVisiting())
+        self.pt_client.flushBuffer()
+        self.assertFalse(self.pt_client.isVisiting())
+
+    def test_client_waits_for_server_end_padding(self):
+        self.pt_client.session.is_peer_padding = True
+        self.pt_client._waitServerStopPadding()
+        self.assertTrue(self.pt_client.session.is_peer_padding)
+        self.pt_client.relayEndPadding()
+        self.assertFalse(self.pt_client.session.is_peer_padding)
+        self.assertFalse(self.pt_client.session._peerStopPaddingWaiters)
+
+
+    def test_new_session_keeps_waiting_for_server_end_padding(self):
+        notified = []
+        self.patch(self.pt_client._shim, 'notifyEndPadding',
+                   lambda: notified.append(True))
+        self.pt_client.session.is_peer_padding = True
+        self.pt_client._waitServerStopPadding()
+        self.pt_client.onSessionStarts(self.sess_id)
+        self.assertEqual(notified, [])
+        self.pt_client.relayEndPadding()
+        self.assertEqual(notified, [True])
+
+    def test_new_session_keeps_waiting_for_buffer_drained(self):
+        self.pt_client._buffer.write("pending data")
+        d = self.pt_client.session.whenBufferDrained()
+        self.pt_client.onSessionStarts(self.sess_id)
+        self.assertFalse(d.called)
+        self.pt_client.flushBuffer()
+        self.assertTrue(d.called)
+
+
+class BurstFlushTestCase(pt.SessionPrimitiveTestCase, unittest.TestCase):
+    def test_zero_delay_burst_is_flushed_in_one_write(self):
+        num_msgs = 5
+        self.advance_delayed_calls()
+        num_writes = len(self.dump)
+        data_msgs = self.pt_server.session.dataMessages['rcv']
+        self.pt_client._buffer.write("a" * const.MPU * num_msgs)
+        self.pt_client.flushBuffer()
+        self.assertEqual(len(self.pt_client._buffer), 0)
+        self.assertEqual(len(self.dump), num_writes + 1)
+        self.assertEqual(self.pt_server.session.dataMessages['rcv'],
+                         data_msgs + num_msgs)
+
+
+class CoalesceTestCase(pt.SessionPrimitiveTestCase, unittest.TestCase):
+    def test_small_reads_are_coalesced_in_one_message(self):
+        self.advance_delayed_calls()
+        self.pt_client._coalesceWindow = 10
+        data_msgs = self.pt_server.session.dataMessages['rcv']
+        for _ in xrange(2):
+            self.send_str(self.pt_client, "a" * const.TOR_CELL_SIZE)
+        self.assertEqual(self.pt_server.session.dataMessages['rcv'], data_msgs)
+        self.advance_next_delayed_call()
+        self.assertEqual(self.pt_server.session.dataMessages['rcv'], data_msgs + 1)
+        self.assertEqual(self.pt_server.session.dataBytes['rcv'],
+                         2 * const.TOR_CELL_SIZE)
+
+    def test_full_message_is_not_delayed(self):
+        self.advance_delayed_calls()
+        self.pt_client._coalesceWindow = 10
+        self.send_str(self.pt_client, "a" * const.TOR_CELL_SIZE)
+        self.send_str(self.pt_client, "a" * const.MPU)
+        self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), self.clock.seconds())
+
+
+class BackpressureTestCase(pt.SessionPrimitiveTestCase, unittest.TestCase):
+    def test_full_buffer_pauses_upstream(self):
+        self.advance_delayed_calls()
+        self.pt_client._bufferHighWatermark = 2 * const.MPU
+        self.pt_client._bufferLowWatermark = const.MPU
+        self.pt_client._delayDataProbdist = uniform(1000)
+        upstream = self.pt_client.circuit.upstream.transport
+        self.send_str(self.pt_client, "a" * 3 * const.MPU)
+        self.assertEqual(upstream.producerState, 'paused')
+        self.advance_next_delayed_call()
+        self.assertEqual(upstream.producerState, 'paused')
+        self.advance_next_delayed_call()
+        self.assertEqual(upstream.producerState, 'producing')
+
+    def test_padding_is_dropped_when_downstream_is_full(self):
+        self.advance_delayed_calls()
+        total_msgs = self.pt_server.session.numMessages['rcv']
+        self.pt_client.circuit.upstream.pauser.pauseProducing()
+        self.pt_client.sendIgnore()
+        self.assertEqual(self.pt_server.session.numMessages['rcv'], total_msgs)
+        self.pt_client.circuit.upstream.pauser.resumeProducing()
+        self.pt_client.sendIgnore()
+        self.assertEqual(self.pt_server.session.numMessages['rcv'], total_msgs + 1)
+
+
 class BurstHistogramTestCase(pt.SessionPrimitiveTestCase, unittest.TestCase):
     primitive = 'relayBurstHistogram'
 
@@ -166,6 +304,115 @@ class GapHistogramTestCase(pt.SessionPrimitiveTestCase, unittest.TestCase):
         self.assertLess(tokens, n_tokens)
 
 
+class PaddingBudgetTestCase(pt.SessionPrimitiveTestCase, unittest.TestCase):
+    """The budget refills at 1 byte/sec: it does not refill during a test."""
+
+    def setUp(self):
+        pt.SessionPrimitiveTestCase.setUp(self)
+        self.budget = budget.new(1, 10 * const.MPU)
+
+    def tearDown(self):
+        try:
+            pt.SessionPrimitiveTestCase.tearDown(self)
+        finally:
+            budget.reset()
+
+    def exhaust_budget(self):
+        """Bring the budget below its low watermark."""
+        self.budget.consume(self.budget.tokens - const.MPU)
+
+    def recover_budget(self):
+        self.budget.lastRefill -= self.budget.burst
+
+    def test_padding_is_dropped_when_budget_is_exhausted(self):
+        self.budget.consume(self.budget.tokens - 2 * const.MPU)
+        total_msgs = self.pt_server.session.numMessages['rcv']
+        for _ in xrange(3):
+            self.pt_client.sendIgnore(const.MPU)
+        self.assertEqual(self.pt_server.session.numMessages['rcv'], total_msgs + 2)
+        self.assertEqual(self.budget.skippedMessages, 1)
+        self.assertEqual(self.budget.skippedBytes, const.MPU)
+
+    def test_data_is_never_charged(self):
+        self.exhaust_budget()
+        spent = self.budget.spentBytes
+        data_msgs = self.pt_server.session.dataMessages['rcv']
+        self.pt_client.sendDataMessage("a" * 100, const.MPU - 100)
+        self.assertEqual(self.pt_server.session.dataMessages['rcv'], data_msgs + 1)
+        self.assertEqual(self.budget.spentBytes, spent)
+        self.assertEqual(self.budget.skippedMessages, 0)
+
+    def test_hooks_fire_once_per_crossing(self):
+        calls = []
+        self.patch(self.pt_client, 'onPaddingBudgetLow', lambda: calls.append('low'))
+        self.patch(self.pt_client, 'onPaddingBudgetRecovered',
+                   lambda: calls.append('recovered'))
+        self.exhaust_budget()
+        for _ in xrange(3):
+            self.pt_client.sendIgnore(const.MPU)
+        self.assertEqual(calls, ['low'])
+        self.assertTrue(self.pt_client._budgetDegraded)
+        self.assertEqual(self.budget.degradedCircuits, 1)
+
+        self.recover_budget()
+        for _ in xrange(3):
+            self.pt_client.sendIgnore(const.MPU)
+        self.assertEqual(calls, ['low', 'recovered'])
+        self.assertFalse(self.pt_client._budgetDegraded)
+        self.assertEqual(self.budget.degradedCircuits, 0)
+
+
+class BuFLOPaddingBudgetTestCase(PaddingBudgetTestCase):
+    transport = 'buflo'
+
+    def test_degraded_buflo_pads_less(self):
+        self.pt_client._mintime = 2000
+        period = self.pt_client._period
+        self.assertEqual(self.pt_client.getMintime(), 2000)
+        self.assertIs(self.pt_client._gapHistoProbdist['snd'], self.pt_client._rateClock)
+
+        self.exhaust_budget()
+        self.pt_client.sendIgnore(const.MPU)
+        self.assertEqual(self.pt_client.getMintime(), 2000 / const.BUDGET_DEGRADE_FACTOR)
+        for when in ('burst', 'gap'):
+            probdist = getattr(self.pt_client, '_%sHistoProbdist' % when)['snd']
+            self.assertEqual(probdist.randomSample(), period * const.BUDGET_DEGRADE_FACTOR)
+
+        self.recover_budget()
+        self.pt_client.sendIgnore(const.MPU)
+        self.assertEqual(self.pt_client.getMintime(), 2000)
+        self.assertIs(self.pt_client._burstHistoProbdist['snd'], self.pt_client._rateClock)
+        self.assertIs(self.pt_client._gapHistoProbdist['snd'], self.pt_client._rateClock)
+
+
+class AdaptivePaddingBudgetTestCase(PaddingBudgetTestCase):
+    transport = 'adaptive'
+
+    def setUp(self):
+        # Histograms as loaded from --histo-file: pad after 10 seconds.
+        histo = {'histo': {10000: 1}}
+        self.patch(AdaptiveTransport, '_histograms',
+                   {'burst': {'snd': histo, 'rcv': histo},
+                    'gap': {'snd': histo, 'rcv': histo}})
+        PaddingBudgetTestCase.setUp(self)
+
+    def test_degraded_adaptive_skips_gap_padding(self):
+        self.pt_client._gapHistoProbdist['snd'] = uniform(1000)
+        self.pt_client.timeout('snd')
+        gap = self.pt_client._deferGap['snd']
+        self.assertFalse(gap.called)
+
+        self.exhaust_budget()
+        self.pt_client.sendIgnore(const.MPU)
+        self.assertTrue(gap.called)
+        self.assertEqual(self.pt_client.timeout('snd'), None)
+        self.assertIs(self.pt_client._deferGap['snd'], gap)
+
+        self.recover_budget()
+        self.pt_client.sendIgnore(const.MPU)
+        self.assertEqual(self.pt_client.timeout('snd'), 1000)
+
+
 class TotalPadTestCase(pt.SessionPrimitiveTestCase, unittest.TestCase):
 
     def test_stop_condition_with_msgs(self):
@@ -30,11 +30,12 @@ class TransportTestCase(object):
     """
 
     def setUp(self):
-        """Set the reactor's callLater to our clock's callLater function
+        """Set the reactor's callLater and seconds to our clock's functions
         and build the protocols.
         """
         self.clock = Clock()
         reactor.callLater = self.clock.callLater
+        reactor.seconds = self.clock.seconds
         self.dump = []
         self.proto_client = self._build_protocol(const.CLIENT)
         self.proto_server = self._build_protocol(const.SERVER)
@@ -169,4 +170,5 @@ class TransportTestCase(object):
         self._lose_protocol_connection(self.proto_client)
         self._lose_protocol_connection(self.proto_server)
         self.advance_delayed_calls()
+        del reactor.seconds
 
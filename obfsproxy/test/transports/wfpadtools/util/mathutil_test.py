@@ -1,3 +1,4 @@
+import random
 import unittest
 
 # WFPadTools imports
@@ -61,6 +62,29 @@ class MathUtilTest(STTest):
         self.should_raise("Closest power of two should not raise.",
                           mu.closest_power_of_two, n)
 
+    def test_p2_median_with_few_samples_is_exact(self):
+        est = mu.P2Quantile()
+        self.assertIsNone(est.value())
+        for x in [5, 1, 3]:
+            est.add(x)
+        self.assertEqual(est.value(), 3)
+
+    def test_p2_median_approximates_median(self):
+        samples = [random.expovariate(0.1) for _ in xrange(10000)]
+        est = mu.P2Quantile()
+        for x in samples:
+            est.add(x)
+        exp_median = mu.median(samples)
+        self.assertAlmostEqual(est.value() / exp_median, 1.0, 1)
+
+    def test_p2_reset(self):
+        est = mu.P2Quantile()
+        for x in xrange(100):
+            est.add(x)
+        est.reset()
+        self.assertEqual(len(est), 0)
+        self.assertIsNone(est.value())
+
 
 if __name__ == "__main__":
     unittest.main()
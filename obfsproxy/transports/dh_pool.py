@@ -0,0 +1,136 @@
+"""
+Pool of precomputed UniformDH keypairs.
+
+Creating a UniformDH keypair costs a 1536-bit modular exponentiation. obfs3
+and ScrambleSuit need a fresh keypair for every connection, so the pool
+keeps up to 'depth' keypairs ready and creates a new one every
+'refill_interval' seconds while it is not full. Keypairs are created in the
+worker pool if one is set up (see obfsproxy.common.workerpool), and in the
+reactor thread otherwise, outside the handshake of any connection.
+
+Every keypair is handed out once: reusing a private key would link the
+handshakes of different connections.
+
+The pool is set up with new() and starts filling when a transport that
+uses it calls start() in its setup().
+"""
+
+import collections
+
+from twisted.internet import reactor
+
+import obfsproxy.common.log as logging
+import obfsproxy.common.workerpool as workerpool
+import obfsproxy.transports.obfs3_dh as obfs3_dh
+
+log = logging.get_obfslogger()
+
+# Default number of keypairs kept ready.
+DEFAULT_DEPTH = 8
+
+# Default number of seconds between the creation of two keypairs.
+DEFAULT_REFILL_INTERVAL = 0.1
+
+class KeyPool(object):
+    """Keeps up to 'depth' UniformDH keypairs ready."""
+
+    def __init__(self, depth=DEFAULT_DEPTH,
+                 refill_interval=DEFAULT_REFILL_INTERVAL, _reactor=reactor):
+        if depth < 1:
+            raise ValueError("The depth of the keypair pool must be positive.")
+        if refill_interval < 0:
+            raise ValueError("The refill interval must not be negative.")
+        self.depth = depth
+        self.refill_interval = refill_interval
+        self.reactor = _reactor
+        self.keys = collections.deque()
+        self.refill_call = None
+        # A keypair is being created.
+        self.refilling = False
+        self.stopped = False
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        self.stopped = False
+        self.schedule_refill()
+
+    def stop(self):
+        self.stopped = True
+        if self.refill_call is not None and self.refill_call.active():
+            self.refill_call.cancel()
+        self.refill_call = None
+        self.keys.clear()
+
+    def take(self):
+        """Return a ready keypair, or None if the pool is empty."""
+        try:
+            udh = self.keys.popleft()
+            self.hits += 1
+        except IndexError:
+            udh = None
+            self.misses += 1
+        self.schedule_refill()
+        return udh
+
+    def schedule_refill(self):
+        if self.stopped or self.refilling or self.refill_call is not None:
+            return
+        if len(self.keys) < self.depth:
+            self.refill_call = self.reactor.callLater(self.refill_interval,
+                                                      self.refill)
+
+    def refill(self):
+        self.refill_call = None
+        self.refilling = True
+        d = workerpool.run(obfs3_dh.UniformDH)
+        d.addCallbacks(self._key_created, self._refill_failed)
+
+    def _key_created(self, udh):
+        self.refilling = False
+        if not self.stopped:
+            self.keys.append(udh)
+        self.schedule_refill()
+
+    def _refill_failed(self, failure):
+        # E.g. the worker pool is busy with handshakes: try again later.
+        log.debug("Could not create a UniformDH keypair: %s" %
+                  failure.getErrorMessage())
+        self.refilling = False
+        self.schedule_refill()
+
+_instance = None
+
+def new(depth=DEFAULT_DEPTH, refill_interval=DEFAULT_REFILL_INTERVAL):
+    global _instance
+    if _instance:
+        raise RuntimeError('Keypair pool already set')
+    _instance = KeyPool(depth, refill_interval)
+    return _instance
+
+def get():
+    return _instance
+
+def reset():
+    global _instance
+    if _instance:
+        _instance.stop()
+    _instance = None
+
+def start():
+    """Start filling the pool, if one was set up."""
+    if _instance is not None:
+        _instance.start()
+
+def take():
+    """Return a precomputed keypair, or None if there is none."""
+    if _instance is None:
+        return None
+    return _instance.take()
+
+def new_keypair():
+    """Return a precomputed keypair, or a fresh one if there is none."""
+    udh = take()
+    if udh is None:
+        udh = obfs3_dh.UniformDH()
+    return udh
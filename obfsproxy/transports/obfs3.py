@@ -9,7 +9,7 @@ import random
 
 import obfsproxy.common.aes as aes
 import obfsproxy.transports.base as base
-import obfsproxy.transports.obfs3_dh as obfs3_dh
+import obfsproxy.transports.dh_pool as dh_pool
 import obfsproxy.common.log as logging
 import obfsproxy.common.hmac_sha256 as hmac_sha256
 import obfsproxy.common.rand as rand
@@ -41,11 +41,13 @@ class Obfs3Transport(base.BaseTransport):
         # Our state.
         self.state = ST_WAIT_FOR_KEY
 
-        # Uniform-DH object
-        self.dh = obfs3_dh.UniformDH()
+        # Uniform-DH object, precomputed if possible.
+        self.dh = dh_pool.new_keypair()
 
         # DH shared secret
         self.shared_secret = None
+        # HMAC-SHA256 keyed with the shared secret.
+        self.shared_secret_hmac = None
 
         # Bytes of padding scanned so far.
         self.scanned_padding = 0
@@ -71,6 +73,11 @@ class Obfs3Transport(base.BaseTransport):
         self.recv_magic_const = None
         self.we_are_initiator = None
 
+    @classmethod
+    def setup(cls, pt_config):
+        """Start precomputing UniformDH keypairs."""
+        dh_pool.start()
+
     def circuitConnected(self):
         """
         Do the obfs3 handshake:
@@ -162,6 +169,7 @@ class Obfs3Transport(base.BaseTransport):
         """
 
         self.shared_secret = shared_secret
+        self.shared_secret_hmac = hmac_sha256.KeyedHMAC(shared_secret)
         log_prefix = "obfs3:_read_handshake_post_dh()"
         log.debug("Got public key: %s.\nGot shared secret: %s" %
                   (repr(other_pubkey), repr(self.shared_secret)))
@@ -169,14 +177,13 @@ class Obfs3Transport(base.BaseTransport):
         # Set up our crypto.
         self.send_crypto = self._derive_crypto(self.send_keytype)
         self.recv_crypto = self._derive_crypto(self.recv_keytype)
-        self.other_magic_value = hmac_sha256.hmac_sha256_digest(self.shared_secret,
-                                                                self.recv_magic_const)
+        self.other_magic_value = self.shared_secret_hmac.digest(self.recv_magic_const)
 
         # Send our magic value to the remote end and append the queued outgoing data.
         # Padding is prepended so that the server does not just send the 32-byte magic
         # in a single TCP segment.
         padding_length = random.randint(0, MAX_PADDING/2)
-        magic = hmac_sha256.hmac_sha256_digest(self.shared_secret, self.send_magic_const)
+        magic = self.shared_secret_hmac.digest(self.send_magic_const)
         message = rand.random_bytes(padding_length) + magic + self.send_crypto.crypt(self.queued_data)
         self.queued_data = ''
 
@@ -220,7 +227,7 @@ class Obfs3Transport(base.BaseTransport):
         """
         Derive and return an obfs3 key using the pad string in 'pad_string'.
         """
-        secret = hmac_sha256.hmac_sha256_digest(self.shared_secret, pad_string)
+        secret = self.shared_secret_hmac.digest(pad_string)
         return aes.AES_CTR_128(secret[:KEYLEN], secret[KEYLEN:],
                                counter_wraparound=True)
 
@@ -87,6 +87,14 @@ PRNG_SEED_LENGTH = 32
 # File which holds the server's state information.
 SERVER_STATE_FILE = "server_state.cpickle"
 
+# File to which the keys added to the replay table are appended between two
+# snapshots of the server's state.
+SERVER_JOURNAL_FILE = "server_state.journal"
+
+# Size of the journal in bytes above which it is compacted, i.e., the
+# server's state is snapshotted and the journal emptied.
+JOURNAL_COMPACTION_SIZE = 2 ** 20
+
 # Life time of session tickets in seconds.
 SESSION_TICKET_LIFETIME = KEY_ROTATION_TIME
 
@@ -102,10 +110,26 @@ SHARED_SECRET_LENGTH = 20
 ST_WAIT_FOR_AUTH = 0
 ST_AUTH_FAILED = 1
 ST_CONNECTED = 2
+# The UniformDH handshake is being computed by the worker pool.
+ST_WAIT_FOR_CRYPTO = 3
+
+# Number of threads computing UniformDH handshakes.
+CRYPTO_WORKERS = 2
 
-# File which holds the client's session tickets.
+# Number of handshakes which may wait for a free thread.  Connections whose
+# handshake does not fit into the queue are closed.
+CRYPTO_QUEUE_LIMIT = 64
+
+# YAML file with session tickets which are imported into the client's ticket
+# store.
 CLIENT_TICKET_FILE = "session_ticket.yaml"
 
+# SQLite database which holds the client's session tickets.
+CLIENT_TICKET_DB = "session_tickets.sqlite"
+
+# Seconds to wait for other processes to release the ticket store.
+TICKET_DB_TIMEOUT = 10
+
 # Static validation string embedded in all tickets.  Must be a multiple of 16
 # bytes due to AES' block size.
 TICKET_IDENTIFIER = "ScrambleSuitTicket"
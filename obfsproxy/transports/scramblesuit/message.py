@@ -26,18 +26,55 @@ def createProtocolMessages( data, flags=const.FLAG_PAYLOAD ):
     """
 
     messages = []
+    offset = 0
 
-    while len(data) > const.MPU:
-        messages.append(ProtocolMessage(data[:const.MPU], flags=flags))
-        data = data[const.MPU:]
+    while (len(data) - offset) > const.MPU:
+        messages.append(ProtocolMessage(data[offset:offset + const.MPU],
+                                        flags=flags))
+        offset += const.MPU
 
-    messages.append(ProtocolMessage(data, flags=flags))
+    messages.append(ProtocolMessage(data[offset:], flags=flags))
 
     log.debug("Created %d protocol messages." % len(messages))
 
     return messages
 
 
+def encryptAndHMACMessages( messages, crypter, hmacKey ):
+    """
+    Encrypt and authenticate the given protocol `messages' in one batch.
+
+    AES-CTR is a stream cipher, so the headers and bodies of all messages are
+    encrypted by a single call to `crypter'.  The messages are then laid out
+    in a buffer of the final size, each one preceded by its HMAC-SHA256-128
+    which is computed using `hmacKey'.  The result is the same as joining the
+    output of `encryptAndHMAC' for every message.
+    """
+
+    plaintext = []
+    for msg in messages:
+        plaintext += [pack.htons(msg.totalLen), pack.htons(msg.payloadLen),
+                      chr(msg.flags), msg.payload,
+                      (msg.totalLen - msg.payloadLen) * '\0']
+
+    encrypted = memoryview(crypter.encrypt("".join(plaintext)))
+
+    blurb = bytearray(len(encrypted) +
+                      len(messages) * const.HMAC_SHA256_128_LENGTH)
+    src = dst = 0
+    for msg in messages:
+        end = src + len(msg) - const.HMAC_SHA256_128_LENGTH
+        hmacEnd = dst + const.HMAC_SHA256_128_LENGTH
+
+        blurb[dst:hmacEnd] = mycrypto.HMAC_SHA256_128(hmacKey,
+                                                      encrypted[src:end])
+        dst = hmacEnd + (end - src)
+        blurb[hmacEnd:dst] = encrypted[src:end]
+        src = end
+
+    return str(blurb)
+
+
 def getFlagNames( flags ):
     """
     Return the flag name encoded in the integer `flags' as string.
@@ -123,14 +160,7 @@ class ProtocolMessage( object ):
         HMAC-SHA256-128 is returned and ready to be sent over the wire.
         """
 
-        encrypted = crypter.encrypt(pack.htons(self.totalLen) +
-                                    pack.htons(self.payloadLen) +
-                                    chr(self.flags) + self.payload +
-                                    (self.totalLen - self.payloadLen) * '\0')
-
-        hmac = mycrypto.HMAC_SHA256_128(hmacKey, encrypted)
-
-        return hmac + encrypted
+        return encryptAndHMACMessages([self], crypter, hmacKey)
 
     def addPadding( self, paddingLen ):
         """
@@ -172,7 +202,7 @@ class MessageExtractor( object ):
         Initialise a new MessageExtractor object.
         """
 
-        self.recvBuf = ""
+        self.recvBuf = bytearray()
         self.totalLen = None
         self.payloadLen = None
         self.flags = None
@@ -185,42 +215,58 @@ class MessageExtractor( object ):
         and authenticated using `hmacKey'.  The payload is then returned as
         unencrypted protocol messages.  In case of invalid headers or HMACs, an
         exception is raised.
+
+        Messages are processed in place at increasing offsets of the receive
+        buffer which is compacted once, after all complete messages are
+        extracted.
         """
 
         self.recvBuf += data
+        recvBuf = self.recvBuf
+        offset = 0
         msgs = []
 
         # Keep trying to unpack as long as there is at least a header.
-        while len(self.recvBuf) >= const.HDR_LENGTH:
+        while (len(recvBuf) - offset) >= const.HDR_LENGTH:
 
-            # If necessary, extract the header fields.
+            # If necessary, decrypt and extract the header fields.  PyCrypto
+            # only takes strings or buffer objects rather than memoryviews.
             if self.totalLen == self.payloadLen == self.flags == None:
-                self.totalLen = pack.ntohs(aes.decrypt(self.recvBuf[16:18]))
-                self.payloadLen = pack.ntohs(aes.decrypt(self.recvBuf[18:20]))
-                self.flags = ord(aes.decrypt(self.recvBuf[20]))
+                header = aes.decrypt(buffer(recvBuf,
+                                     offset + const.HMAC_SHA256_128_LENGTH,
+                                     const.HDR_LENGTH -
+                                     const.HMAC_SHA256_128_LENGTH))
+                self.totalLen = pack.ntohs(header[0:2])
+                self.payloadLen = pack.ntohs(header[2:4])
+                self.flags = ord(header[4])
 
                 if not isSane(self.totalLen, self.payloadLen, self.flags):
                     raise base.PluggableTransportError("Invalid header.")
 
             # Parts of the message are still on the wire; waiting.
-            if (len(self.recvBuf) - const.HDR_LENGTH) < self.totalLen:
+            end = offset + const.HDR_LENGTH + self.totalLen
+            if len(recvBuf) < end:
                 break
 
-            rcvdHMAC = self.recvBuf[0:const.HMAC_SHA256_128_LENGTH]
-            vrfyHMAC = mycrypto.HMAC_SHA256_128(hmacKey,
-                              self.recvBuf[const.HMAC_SHA256_128_LENGTH:
-                              (self.totalLen + const.HDR_LENGTH)])
+            rcvdHMAC = str(recvBuf[offset:
+                                   offset + const.HMAC_SHA256_128_LENGTH])
+            vrfyHMAC = mycrypto.HMAC_SHA256_128(hmacKey, memoryview(recvBuf)[
+                              offset + const.HMAC_SHA256_128_LENGTH:end])
 
             if rcvdHMAC != vrfyHMAC:
                 raise base.PluggableTransportError("Invalid message HMAC.")
 
-            # Decrypt the message and remove it from the input buffer.
-            extracted = aes.decrypt(self.recvBuf[const.HDR_LENGTH:
-                         (self.totalLen + const.HDR_LENGTH)])[:self.payloadLen]
+            # Decrypt the message.
+            extracted = aes.decrypt(buffer(recvBuf, offset + const.HDR_LENGTH,
+                                           self.totalLen))[:self.payloadLen]
             msgs.append(ProtocolMessage(payload=extracted, flags=self.flags))
-            self.recvBuf = self.recvBuf[const.HDR_LENGTH + self.totalLen:]
+            offset = end
 
             # Protocol message processed; now reset length fields.
             self.totalLen = self.payloadLen = self.flags = None
 
+        # Remove the processed messages from the input buffer.
+        if offset:
+            del recvBuf[:offset]
+
         return msgs
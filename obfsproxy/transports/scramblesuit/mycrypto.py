@@ -11,6 +11,7 @@ import Crypto.Util.Counter
 import Crypto.Cipher.AES
 
 import obfsproxy.transports.base as base
+import obfsproxy.common.hmac_sha256 as hmac_sha256
 import obfsproxy.common.log as logging
 
 import math
@@ -80,14 +81,29 @@ class HKDF_SHA256( object ):
 def HMAC_SHA256_128( key, msg ):
     """
     Return the HMAC-SHA256-128 of the given `msg' authenticated by `key'.
-    """
 
-    assert(len(key) >= const.SHARED_SECRET_LENGTH)
+    The argument `key' is either a key or a keyed HMAC object as returned by
+    `keyedHMAC'.  The latter is faster if a key authenticates many messages.
+    """
 
-    h = Crypto.Hash.HMAC.new(key, msg, Crypto.Hash.SHA256)
+    if not isinstance(key, hmac_sha256.KeyedHMAC):
+        key = keyedHMAC(key)
 
     # Return HMAC truncated to 128 out of 256 bits.
-    return h.digest()[:16]
+    return key.digest(msg)[:16]
+
+
+def keyedHMAC( key ):
+    """
+    Return a keyed HMAC-SHA256 object for the given `key'.
+
+    The object hashes the key only once and can be passed to
+    `HMAC_SHA256_128' instead of `key'.
+    """
+
+    assert(len(key) >= const.SHARED_SECRET_LENGTH)
+
+    return hmac_sha256.KeyedHMAC(key)
 
 
 def strongRandom( size ):
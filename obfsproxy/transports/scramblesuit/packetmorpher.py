@@ -45,6 +45,14 @@ class PacketMorpher( object ):
         Based on the burst's size, return a ready-to-send padding blurb.
         """
 
+        return message.encryptAndHMACMessages(self.getPaddingMessages(dataLen),
+                                              sendCrypter, sendHMAC)
+
+    def getPaddingMessages( self, dataLen ):
+        """
+        Based on the burst's size, return the protocol messages padding it.
+        """
+
         padLen = self.calcPadding(dataLen)
 
         assert const.HDR_LENGTH <= padLen < (const.MTU + const.HDR_LENGTH), \
@@ -58,9 +66,7 @@ class PacketMorpher( object ):
         else:
             padMsgs = [message.new("", paddingLen=padLen - const.HDR_LENGTH)]
 
-        blurbs = [msg.encryptAndHMAC(sendCrypter, sendHMAC) for msg in padMsgs]
-
-        return "".join(blurbs)
+        return padMsgs
 
     def calcPadding( self, dataLen ):
         """
@@ -7,6 +7,8 @@ distributions.  Random samples can then be drawn from these distributions.
 
 import random
 
+from bisect import bisect_left
+
 import const
 
 import obfsproxy.common.log as logging
@@ -34,8 +36,35 @@ class RandProbDist:
 
         self.sampleList = []
         self.dist = self.genDistribution(genSingleton)
+        self.prepareSampling()
         self.dumpDistribution()
 
+    def __setstate__( self, state ):
+        """
+        Restore a pickled distribution.
+
+        Distributions pickled by older versions lack the lookup lists which
+        are then rebuilt.
+        """
+
+        self.__dict__.update(state)
+        if not hasattr(self, "cumulProbs"):
+            self.prepareSampling()
+
+    def prepareSampling( self ):
+        """
+        Split `sampleList' into sorted cumulative probabilities and their
+        singletons so that samples can be drawn using binary search.
+
+        Random numbers above the largest cumulative probability map to the
+        last singleton, which is therefore appended once more.
+        """
+
+        self.cumulProbs = [cumulProb for cumulProb, _ in self.sampleList]
+        self.singletons = [singleton for _, singleton in self.sampleList]
+        if self.singletons:
+            self.singletons.append(self.singletons[-1])
+
     def genDistribution( self, genSingleton ):
         """
         Generate a discrete probability distribution.
@@ -82,17 +111,14 @@ class RandProbDist:
     def randomSample( self ):
         """
         Draw and return a random sample from the probability distribution.
+
+        The sample is the singleton of the first bin whose cumulative
+        probability is not below a uniform random number.
         """
 
         assert len(self.sampleList) > 0
 
-        rand = random.random()
-
-        for cumulProb, singleton in self.sampleList:
-            if rand <= cumulProb:
-                return singleton
-
-        return self.sampleList[-1][1]
+        return self.singletons[bisect_left(self.cumulProbs, random.random())]
 
 # Alias class name in order to provide a more intuitive API.
 new = RandProbDist
@@ -5,9 +5,14 @@ The replay protection mechanism is based on a dictionary which caches
 previously observed keys.  New keys can be added to the dictionary and existing
 ones can be queried.  A pruning mechanism deletes expired keys from the
 dictionary.
+
+Keys are also kept in buckets ordered by the second in which they were added,
+so that pruning only visits the buckets which expired instead of the entire
+dictionary.
 """
 
 import time
+import collections
 
 import const
 
@@ -32,16 +37,60 @@ class Tracker( object ):
 
         self.table = dict()
 
-    def addElement( self, element ):
+        # Buckets of the elements added in the same second, ordered by that
+        # second.
+        self.buckets = collections.deque()
+
+    def __setstate__( self, state ):
+        """
+        Restore a pickled `Tracker' object, building its buckets if it was
+        pickled by a version which did not have them.
+        """
+
+        self.__dict__.update(state)
+
+        if "buckets" not in state:
+            self.buckets = collections.deque()
+            for element, timestamp in sorted(self.table.iteritems(),
+                                             key=lambda item: item[1]):
+                self._addToBucket(element, timestamp)
+
+    def _addToBucket( self, element, timestamp ):
+        """
+        Add `element' to the bucket of the given Unix `timestamp'.
+
+        If the clock went backwards, the element is added to the newest bucket
+        so that it expires later rather than earlier.
+        """
+
+        if self.buckets and self.buckets[-1][0] >= timestamp:
+            self.buckets[-1][1].append(element)
+        else:
+            self.buckets.append((timestamp, [element]))
+
+    def addElement( self, element, timestamp=None ):
         """
         Add the given `element' to the lookup table.
+
+        The element is added with the given Unix `timestamp', which defaults
+        to the current time.
         """
 
         if self.isPresent(element):
             raise LookupError("Element already present in table.")
 
-        # The key is a HMAC and the value is the current Unix timestamp.
-        self.table[element] = int(time.time())
+        # The key is a HMAC and the value is the Unix timestamp.
+        if timestamp is None:
+            timestamp = int(time.time())
+        self.table[element] = timestamp
+        self._addToBucket(element, timestamp)
+
+    def isExpired( self, timestamp ):
+        """
+        Return `True' if elements added at the Unix `timestamp' are expired.
+        """
+
+        return (int(time.time()) - timestamp) > const.EPOCH_GRANULARITY
 
     def isPresent( self, element ):
         """
@@ -55,8 +104,7 @@ class Tracker( object ):
                   len(self.table))
 
         # Prune the replay table before looking up the given `element'.  This
-        # could be done more efficiently, e.g. by pruning every n minutes and
-        # only checking the timestamp of this particular element.
+        # only visits the buckets which expired.
         self.prune()
 
         return (element in self.table)
@@ -69,17 +117,8 @@ class Tracker( object ):
         being removed from the lookup table.
         """
 
-        log.debug("Pruning the replay table.")
-
-        deleteList = []
-        now = int(time.time())
-
-        for element in self.table.iterkeys():
-            if (now - self.table[element]) > const.EPOCH_GRANULARITY:
-                deleteList.append(element)
-
-        # We can't delete from a dictionary while iterating over it; therefore
-        # this construct.
-        for elem in deleteList:
-            log.debug("Deleting expired element.")
-            del self.table[elem]
+        while self.buckets and self.isExpired(self.buckets[0][0]):
+            _, elements = self.buckets.popleft()
+            log.debug("Deleting %d expired element(s)." % len(elements))
+            for elem in elements:
+                self.table.pop(elem, None)
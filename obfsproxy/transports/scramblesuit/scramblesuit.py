@@ -6,10 +6,12 @@ transport protocol is available here:
 http://www.cs.kau.se/philwint/scramblesuit/
 """
 
-from twisted.internet import reactor
+from twisted.internet import defer, reactor
 
 import obfsproxy.transports.base as base
 import obfsproxy.common.log as logging
+import obfsproxy.common.workerpool as workerpool
+import obfsproxy.transports.dh_pool as dh_pool
 
 import random
 import base64
@@ -46,6 +48,10 @@ class ScrambleSuitTransport( base.BaseTransport ):
     modules.
     """
 
+    # Size and queue limit of the pool computing UniformDH handshakes.
+    cryptoWorkers = const.CRYPTO_WORKERS
+    cryptoQueueLimit = const.CRYPTO_QUEUE_LIMIT
+
     def __init__( self ):
         """
         Initialise a ScrambleSuitTransport object.
@@ -89,6 +95,10 @@ class ScrambleSuitTransport( base.BaseTransport ):
         # decrypted but not yet authenticated.
         self.decryptedTicket = False
 
+        # Deferred of the UniformDH computation which is run by the worker
+        # pool, if any.
+        self.cryptoCall = None
+
         # If we are in external mode we should already have a shared
         # secret set up because of validate_external_mode_cli().
         if self.weAreExternal:
@@ -150,6 +160,14 @@ class ScrambleSuitTransport( base.BaseTransport ):
 
             state.writeServerPassword(cls.uniformDHSecret)
 
+        # UniformDH is computed outside the reactor thread so that a flood of
+        # handshakes does not stall the forwarding of data.
+        if workerpool.get() is None:
+            workerpool.new(cls.cryptoWorkers, cls.cryptoQueueLimit)
+
+        # Start precomputing UniformDH keypairs.
+        dh_pool.start()
+
     @classmethod
     def get_public_server_options( cls, transportOptions ):
         """
@@ -205,6 +223,11 @@ class ScrambleSuitTransport( base.BaseTransport ):
             self.sendCrypter, self.recvCrypter = self.recvCrypter, \
                                                  self.sendCrypter
 
+        # Every protocol message is authenticated, so the HMAC keys are
+        # hashed only once.
+        self.sendKeyedHMAC = mycrypto.keyedHMAC(self.sendHMAC)
+        self.recvKeyedHMAC = mycrypto.keyedHMAC(self.recvHMAC)
+
     def circuitConnected( self ):
         """
         Initiate a ScrambleSuit handshake.
@@ -244,7 +267,83 @@ class ScrambleSuitTransport( base.BaseTransport ):
                 self.circuit.close()
                 return
             log.debug("No session ticket to redeem.  Running UniformDH.")
-            self.circuit.downstream.write(self.uniformdh.createHandshake())
+            self.cryptoCall = self.uniformdh.deferHandshake()
+            self.cryptoCall.addCallback(self.sendHandshake)
+            self.cryptoCall.addErrback(self.cryptoFailed)
+
+    def sendHandshake( self, handshakeMsg ):
+        """
+        Send the client's UniformDH handshake once its key is generated.
+        """
+
+        self.cryptoCall = None
+        self.circuit.downstream.write(handshakeMsg)
+
+    def receivePublicKey( self, data ):
+        """
+        Extract the remote UniformDH public key and compute the master key.
+
+        If the public key is authenticated, the master key is computed by the
+        worker pool and `True' is returned.  Meanwhile, incoming data is left
+        in `data'.  Once the master key is known, the handshake is finished
+        and the buffered data is processed.
+        """
+
+        if self.weAreServer:
+            d = self.uniformdh.deferPublicKey(data, self.deriveSecrets,
+                                              self.srvState)
+            callback = self.finishServerHandshake
+        else:
+            d = self.uniformdh.deferPublicKey(data, self.deriveSecrets)
+            callback = self.finishClientHandshake
+
+        if d is None:
+            return False
+
+        log.debug("Switching to state ST_WAIT_FOR_CRYPTO.")
+        self.protoState = const.ST_WAIT_FOR_CRYPTO
+
+        self.cryptoCall = d
+        d.addCallback(self.cryptoDone, callback, data)
+        d.addErrback(self.cryptoFailed)
+
+        return True
+
+    def cryptoDone( self, _, callback, data ):
+        """
+        Finish the UniformDH handshake and process the data received so far.
+        """
+
+        self.cryptoCall = None
+        callback()
+        self.receivedDownstream(data)
+
+    def cryptoFailed( self, failure ):
+        """
+        Close the circuit if the UniformDH handshake could not be computed.
+        """
+
+        self.cryptoCall = None
+
+        # The circuit is gone already.
+        if failure.check(defer.CancelledError):
+            return
+
+        if failure.check(workerpool.PoolFullError):
+            log.warning("Too many pending UniformDH handshakes.  Closing "
+                        "connection.")
+        else:
+            log.warning("UniformDH handshake failed: %s" %
+                        failure.getErrorMessage())
+        self.circuit.close()
+
+    def circuitDestroyed( self, reason, side ):
+        """
+        Abandon a pending UniformDH computation.
+        """
+
+        if self.cryptoCall is not None:
+            self.cryptoCall.cancel()
 
     def sendRemote( self, data, flags=const.FLAG_PAYLOAD ):
         """
@@ -260,12 +359,13 @@ class ScrambleSuitTransport( base.BaseTransport ):
 
         # Wrap the application's data in ScrambleSuit protocol messages.
         messages = message.createProtocolMessages(data, flags=flags)
-        blurb = "".join([msg.encryptAndHMAC(self.sendCrypter,
-                        self.sendHMAC) for msg in messages])
 
         # Flush data chunk for chunk to obfuscate inter-arrival times.
         if const.USE_IAT_OBFUSCATION:
 
+            blurb = message.encryptAndHMACMessages(messages, self.sendCrypter,
+                                                   self.sendKeyedHMAC)
+
             if len(self.choppingBuf) == 0:
                 self.choppingBuf.write(blurb)
                 reactor.callLater(self.iatMorpher.randomSample(),
@@ -274,11 +374,13 @@ class ScrambleSuitTransport( base.BaseTransport ):
                 # flushPieces() is still busy processing the chopping buffer.
                 self.choppingBuf.write(blurb)
 
+        # The padding only depends on the burst's length, so it is encrypted
+        # and authenticated in the same batch as the data.
         else:
-            padBlurb = self.pktMorpher.getPadding(self.sendCrypter,
-                                                  self.sendHMAC,
-                                                  len(blurb))
-            self.circuit.downstream.write(blurb + padBlurb)
+            messages += self.pktMorpher.getPaddingMessages(
+                            sum([len(msg) for msg in messages]))
+            self.circuit.downstream.write(message.encryptAndHMACMessages(
+                messages, self.sendCrypter, self.sendKeyedHMAC))
 
     def flushPieces( self ):
         """
@@ -300,7 +402,7 @@ class ScrambleSuitTransport( base.BaseTransport ):
         else:
             blurb = self.choppingBuf.read()
             padBlurb = self.pktMorpher.getPadding(self.sendCrypter,
-                                                  self.sendHMAC,
+                                                  self.sendKeyedHMAC,
                                                   len(blurb))
             self.circuit.downstream.write(blurb + padBlurb)
             return
@@ -321,7 +423,8 @@ class ScrambleSuitTransport( base.BaseTransport ):
             return
 
         # Try to extract protocol messages from the encrypted blurb.
-        msgs  = self.protoMsg.extract(data, self.recvCrypter, self.recvHMAC)
+        msgs  = self.protoMsg.extract(data, self.recvCrypter,
+                                      self.recvKeyedHMAC)
         if (msgs is None) or (len(msgs) == 0):
             return
 
@@ -404,7 +507,7 @@ class ScrambleSuitTransport( base.BaseTransport ):
                 return False
 
         # First, find the mark to efficiently locate the HMAC.
-        mark = mycrypto.HMAC_SHA256_128(self.recvHMAC,
+        mark = mycrypto.HMAC_SHA256_128(self.recvKeyedHMAC,
                                         potentialTicket[:const.TICKET_LENGTH])
 
         index = util.locateMark(mark, potentialTicket)
@@ -415,13 +518,14 @@ class ScrambleSuitTransport( base.BaseTransport ):
         existingHMAC = potentialTicket[index + const.MARK_LENGTH:
                                        index + const.MARK_LENGTH +
                                        const.HMAC_SHA256_128_LENGTH]
+        # The HMACs of all epochs share the prefix which is hashed only once.
+        prefixHMAC = self.recvKeyedHMAC.with_prefix(potentialTicket[0:index +
+                                                    const.MARK_LENGTH])
         authenticated = False
         for epoch in util.expandedEpoch():
-            myHMAC = mycrypto.HMAC_SHA256_128(self.recvHMAC,
-                                              potentialTicket[0:index + \
-                                              const.MARK_LENGTH] + epoch)
+            myHMAC = mycrypto.HMAC_SHA256_128(prefixHMAC, epoch)
 
-            if util.isValidHMAC(myHMAC, existingHMAC, self.recvHMAC):
+            if util.isValidHMAC(myHMAC, existingHMAC, self.recvKeyedHMAC):
                 authenticated = True
                 break
 
@@ -512,23 +616,10 @@ class ScrambleSuitTransport( base.BaseTransport ):
 
                 self.sendTicketAndSeed()
 
-            # Second, interpret the data as a UniformDH handshake.
-            elif self.uniformdh.receivePublicKey(data, self.deriveSecrets,
-                    self.srvState):
-                # Now send the server's UniformDH public key to the client.
-                handshakeMsg = self.uniformdh.createHandshake(srvState=
-                                                              self.srvState)
-
-                log.debug("Sending %d bytes of UniformDH handshake and "
-                          "session ticket." % len(handshakeMsg))
-
-                self.circuit.downstream.write(handshakeMsg)
-                log.debug("UniformDH authentication succeeded.")
-
-                log.debug("Switching to state ST_CONNECTED.")
-                self.protoState = const.ST_CONNECTED
-
-                self.sendTicketAndSeed()
+            # Second, interpret the data as a UniformDH handshake.  It is
+            # finished once the worker pool is done with it.
+            elif self.receivePublicKey(data):
+                return
 
             elif len(data) > const.MAX_HANDSHAKE_LENGTH:
                 self.protoState = const.ST_AUTH_FAILED
@@ -546,20 +637,46 @@ class ScrambleSuitTransport( base.BaseTransport ):
 
         elif self.weAreClient and (self.protoState == const.ST_WAIT_FOR_AUTH):
 
-            if not self.uniformdh.receivePublicKey(data, self.deriveSecrets):
+            if not self.receivePublicKey(data):
                 log.debug("Unable to finish UniformDH handshake just yet.")
-                return
-
-            log.debug("UniformDH authentication succeeded.")
-
-            log.debug("Switching to state ST_CONNECTED.")
-            self.protoState = const.ST_CONNECTED
-            self.flushSendBuffer()
+            return
 
         if self.protoState == const.ST_CONNECTED:
 
             self.processMessages(data.read())
 
+    def finishServerHandshake( self ):
+        """
+        Reply to the client's UniformDH handshake.
+
+        The server's UniformDH public key is sent to the client, followed by
+        a new session ticket and the PRNG seed.
+        """
+
+        handshakeMsg = self.uniformdh.createHandshake(srvState=self.srvState)
+
+        log.debug("Sending %d bytes of UniformDH handshake and "
+                  "session ticket." % len(handshakeMsg))
+
+        self.circuit.downstream.write(handshakeMsg)
+        log.debug("UniformDH authentication succeeded.")
+
+        log.debug("Switching to state ST_CONNECTED.")
+        self.protoState = const.ST_CONNECTED
+
+        self.sendTicketAndSeed()
+
+    def finishClientHandshake( self ):
+        """
+        Flush the data buffered during the client's UniformDH handshake.
+        """
+
+        log.debug("UniformDH authentication succeeded.")
+
+        log.debug("Switching to state ST_CONNECTED.")
+        self.protoState = const.ST_CONNECTED
+        self.flushSendBuffer()
+
     @classmethod
     def register_external_mode_cli( cls, subparser ):
         """
@@ -582,6 +699,20 @@ class ScrambleSuitTransport( base.BaseTransport ):
                                action=ReadPassFile,
                                dest="uniformDHSecret")
 
+        subparser.add_argument("--crypto-workers",
+                               type=int,
+                               help="Number of threads computing UniformDH "
+                                    "handshakes (Default: %d)" %
+                                    const.CRYPTO_WORKERS,
+                               dest="cryptoWorkers")
+
+        subparser.add_argument("--crypto-queue",
+                               type=int,
+                               help="Number of UniformDH handshakes which "
+                                    "may wait for a thread (Default: %d)" %
+                                    const.CRYPTO_QUEUE_LIMIT,
+                               dest="cryptoQueueLimit")
+
         super(ScrambleSuitTransport, cls).register_external_mode_cli(subparser)
 
     @classmethod
@@ -619,6 +750,18 @@ class ScrambleSuitTransport( base.BaseTransport ):
             else:
                 cls.uniformDHSecret = uniformDHSecret
 
+        if args.cryptoWorkers is not None:
+            if args.cryptoWorkers < 1:
+                raise base.PluggableTransportError(
+                    "The number of crypto workers must be positive.")
+            cls.cryptoWorkers = args.cryptoWorkers
+
+        if args.cryptoQueueLimit is not None:
+            if args.cryptoQueueLimit < 0:
+                raise base.PluggableTransportError(
+                    "The crypto queue limit must not be negative.")
+            cls.cryptoQueueLimit = args.cryptoQueueLimit
+
     def handle_socks_args( self, args ):
         """
         Receive arguments `args' passed over a SOCKS connection.
@@ -5,14 +5,27 @@ The server possesses state information which should persist across runs.  This
 includes key material to encrypt and authenticate session tickets, replay
 tables and PRNG seeds.  This module provides methods to load, store and
 generate such state information.
+
+The state is stored in two files.  The snapshot holds the pickled state object
+and is only rewritten when the key material changes or when the journal gets
+compacted.  The keys added to the replay table in the meantime are appended to
+the journal, so that accepting a handshake does not re-pickle the whole state.
+Keys added within the same reactor iteration are committed in a single write.
+
+Several processes can share the state: the files are locked while they are
+read or written, and a process loading its state only reads the snapshot if
+another process rewrote it, and the journal records it did not read yet.
 """
 
 import os
 import sys
 import time
+import struct
 import cPickle
 import random
 
+from twisted.internet import reactor
+
 import const
 import replay
 import mycrypto
@@ -21,35 +34,77 @@ import base64
 
 import obfsproxy.common.log as logging
 
+try:
+    import fcntl
+except ImportError:
+    # The files cannot be locked, e.g., on Windows.
+    fcntl = None
+
 log = logging.get_obfslogger()
 
+# Header of the journal's records: the Unix timestamp at which a key was added
+# to the replay table and the length of the key which follows the header.
+RECORD_HEADER = struct.Struct("!IB")
+
+# The state objects loaded by this process, indexed by their snapshot file.
+_states = dict()
+
+def getStateFiles( ):
+    """
+    Return the paths of the server's state snapshot and journal.
+    """
+
+    return (os.path.join(const.STATE_LOCATION, const.SERVER_STATE_FILE),
+            os.path.join(const.STATE_LOCATION, const.SERVER_JOURNAL_FILE))
+
+def getFileId( path ):
+    """
+    Return a tuple which changes when the file at `path' is replaced or
+    `None' if the file does not exist.
+    """
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return (stat.st_ino, stat.st_size, stat.st_mtime)
+
 def load( ):
     """
     Load the server's state object from file.
 
     The server's state file is loaded and the state object returned.  If no
-    state file is found, a new one is created and returned.
+    state file is found, a new one is created and returned.  The state object
+    is loaded only once per process; later calls bring it up to date with the
+    changes made by other processes and return it.
     """
 
-    stateFile = os.path.join(const.STATE_LOCATION, const.SERVER_STATE_FILE)
+    stateFile, _ = getStateFiles()
+
+    stateObject = _states.get(stateFile)
+    if stateObject is None:
+        log.info("Attempting to load the server's state file from `%s'." %
+                 stateFile)
 
-    log.info("Attempting to load the server's state file from `%s'." %
-             stateFile)
+        if not os.path.exists(stateFile):
+            log.info("The server's state file does not exist (yet).")
+            stateObject = State()
+            stateObject.genState()
+            _states[stateFile] = stateObject
+            return stateObject
 
-    if not os.path.exists(stateFile):
-        log.info("The server's state file does not exist (yet).")
-        state = State()
-        state.genState()
-        return state
+        stateObject = State()
 
     try:
-        with open(stateFile, 'r') as fd:
-            stateObject = cPickle.load(fd)
-    except IOError as err:
+        stateObject.refresh()
+    except (IOError, cPickle.UnpicklingError, EOFError) as err:
         log.error("Error reading server state file from `%s': %s" %
                   (stateFile, err))
         sys.exit(1)
 
+    _states[stateFile] = stateObject
+
     return stateObject
 
 def writeServerPassword( password ):
@@ -86,6 +141,10 @@ class State( object ):
     provides methods to generate and write state information.
     """
 
+    # Attributes which are not part of the snapshot.
+    transientAttributes = ("pendingRecords", "commitCall", "snapshotId",
+                           "journalOffset")
+
     def __init__( self ):
         """
         Initialise a `State' object.
@@ -104,6 +163,38 @@ class State( object ):
         self.fallbackPassword = None
         self.closingThreshold = None
 
+        self.initJournal()
+
+    def initJournal( self ):
+        """
+        Initialise the attributes which track the journal.
+        """
+
+        # Journal records not written yet and the call which writes them.
+        self.pendingRecords = []
+        self.commitCall = None
+
+        # The snapshot this object was loaded from and how much of the journal
+        # written after it was read.
+        self.snapshotId = None
+        self.journalOffset = 0
+
+    def __getstate__( self ):
+        """
+        Return the attributes to pickle, leaving out the journal's.
+        """
+
+        return dict((name, value) for name, value in self.__dict__.iteritems()
+                    if name not in self.transientAttributes)
+
+    def __setstate__( self, stateDict ):
+        """
+        Restore a pickled `State' object.
+        """
+
+        self.__dict__.update(stateDict)
+        self.initJournal()
+
     def genState( self ):
         """
         Populate all the local variables with values.
@@ -170,24 +261,167 @@ class State( object ):
         log.debug("Adding a new HMAC to the replay table.")
         self.replayTracker.addElement(hmac)
 
-        # We must write the data to disk immediately so that other ScrambleSuit
-        # connections can share the same state.
-        self.writeState()
+        # The key is appended to the journal at the end of this reactor
+        # iteration, together with the other keys added in the meantime, so
+        # that other ScrambleSuit processes can share the same state.
+        self.pendingRecords.append(RECORD_HEADER.pack(
+            self.replayTracker.table[hmac], len(hmac)) + hmac)
+        if self.commitCall is None:
+            self.commitCall = reactor.callLater(0, self.commitJournal)
+
+    def openJournal( self, exclusive=False ):
+        """
+        Open the journal and lock it.
+
+        The lock is shared unless `exclusive' is `True'.  It is released when
+        the returned file is closed.
+        """
+
+        _, journalFile = getStateFiles()
+
+        journal = open(journalFile, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(journal.fileno(),
+                        fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+        return journal
+
+    def applyRecords( self, data ):
+        """
+        Add the keys in the journal records `data' to the replay table.
+
+        Keys which are already present or expired are ignored.  Return the
+        amount of bytes consumed, which excludes a trailing partial record.
+        """
+
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            timestamp, length = RECORD_HEADER.unpack_from(data, offset)
+            end = offset + RECORD_HEADER.size + length
+            if end > len(data):
+                break
+            hmac = data[offset + RECORD_HEADER.size:end]
+            offset = end
+
+            if self.replayTracker.isExpired(timestamp) or \
+                    hmac in self.replayTracker.table:
+                continue
+            self.replayTracker.addElement(hmac, timestamp)
+
+        return offset
+
+    def readJournal( self, journal, reloadSnapshot=True ):
+        """
+        Read the records added to the (locked) `journal' since we last read it.
+
+        If another process replaced the snapshot, the journal is read from its
+        start and, if `reloadSnapshot' is `True', the snapshot is loaded again.
+        """
+
+        stateFile, _ = getStateFiles()
+
+        snapshotId = getFileId(stateFile)
+        if snapshotId != self.snapshotId:
+            if reloadSnapshot:
+                log.debug("Loading the server's state snapshot.")
+                with open(stateFile, 'rb') as fd:
+                    snapshot = cPickle.load(fd)
+                self.__dict__.update(snapshot.__getstate__())
+                # Our keys which are not in the journal yet are not lost.
+                self.applyRecords(''.join(self.pendingRecords))
+            self.snapshotId = snapshotId
+            self.journalOffset = 0
+
+        journal.seek(self.journalOffset)
+        self.journalOffset += self.applyRecords(journal.read())
+
+    def refresh( self ):
+        """
+        Bring the state up to date with the changes made by other processes.
+        """
+
+        with self.openJournal() as journal:
+            self.readJournal(journal)
+
+    def commitJournal( self ):
+        """
+        Append the pending replay table keys to the journal.
+
+        The journal is compacted if it grew larger than
+        `const.JOURNAL_COMPACTION_SIZE'.
+        """
+
+        if self.commitCall is not None and self.commitCall.active():
+            self.commitCall.cancel()
+        self.commitCall = None
+
+        if not self.pendingRecords:
+            return
+
+        records = ''.join(self.pendingRecords)
+
+        try:
+            with self.openJournal(exclusive=True) as journal:
+                # Catch up with other processes before appending our records.
+                self.readJournal(journal)
+                journal.seek(0, os.SEEK_END)
+                journal.write(records)
+                journal.flush()
+                self.journalOffset = journal.tell()
+                self.pendingRecords = []
+
+                if self.journalOffset > const.JOURNAL_COMPACTION_SIZE:
+                    log.debug("Compacting the server's state journal.")
+                    self.writeSnapshot(journal)
+        except (IOError, cPickle.UnpicklingError, EOFError) as err:
+            log.error("Error writing state journal: %s" % err)
+            sys.exit(1)
+
+    def writeSnapshot( self, journal ):
+        """
+        Write the state object to the snapshot and empty the (locked) journal.
+
+        The snapshot is written to a temporary file first and then renamed, so
+        that other processes never read a partial snapshot.
+        """
+
+        stateFile, _ = getStateFiles()
+
+        self.replayTracker.prune()
+
+        tmpFile = stateFile + ".tmp"
+        with open(tmpFile, 'wb') as fd:
+            cPickle.dump(self, fd, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmpFile, stateFile)
+
+        journal.truncate(0)
+        self.snapshotId = getFileId(stateFile)
+        self.journalOffset = 0
 
     def writeState( self ):
         """
         Write the state object to a file using the `cPickle' module.
+
+        The keys added to the journal by other processes are merged first, as
+        they are no longer in the journal afterwards.
         """
 
-        stateFile = os.path.join(const.STATE_LOCATION, const.SERVER_STATE_FILE)
+        stateFile, _ = getStateFiles()
 
         log.debug("Writing server's state file to `%s'." %
                   stateFile)
 
         try:
-            with open(stateFile, 'w') as fd:
-                cPickle.dump(self, fd)
+            with self.openJournal(exclusive=True) as journal:
+                self.readJournal(journal, reloadSnapshot=False)
+                self.writeSnapshot(journal)
         except IOError as err:
             log.error("Error writing state file to `%s': %s" %
                       (stateFile, err))
             sys.exit(1)
+
+        # The pending keys are part of the snapshot.
+        self.pendingRecords = []
+        if self.commitCall is not None and self.commitCall.active():
+            self.commitCall.cancel()
+        self.commitCall = None
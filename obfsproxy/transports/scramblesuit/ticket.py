@@ -23,6 +23,7 @@ import const
 import yaml
 import struct
 import random
+import sqlite3
 import datetime
 
 from Crypto.Cipher import AES
@@ -38,6 +39,9 @@ import state
 
 log = logging.get_obfslogger()
 
+# Connections to the client's ticket stores, indexed by their file.
+_ticketStores = dict()
+
 
 def createTicketMessage( rawTicket, HMACKey ):
     """
@@ -81,66 +85,136 @@ def issueTicketAndKey( srvState ):
     return masterKey + newTicket
 
 
-def storeNewTicket( masterKey, ticket, bridge ):
+def importTicketFile( db ):
     """
-    Store a new session ticket and the according master key for future use.
+    Import the tickets of the YAML ticket file into the ticket store `db'.
 
-    This method is only called by clients.  The given data, `masterKey',
-    `ticket' and `bridge', is YAMLed and stored in the global ticket
-    dictionary.  If there already is a ticket for the given `bridge', it is
-    overwritten.
+    The YAML file was used by earlier versions and is still written by this
+    module's `__main__' to distribute tickets out-of-band.  The file is renamed
+    before it is read, so that only one process imports its tickets.
     """
 
-    assert len(masterKey) == const.MASTER_KEY_LENGTH
-    assert len(ticket) == const.TICKET_LENGTH
-
     ticketFile = const.STATE_LOCATION + const.CLIENT_TICKET_FILE
+    if not os.path.exists(ticketFile):
+        return
+
+    importFile = "%s.%d" % (ticketFile, os.getpid())
+    try:
+        os.rename(ticketFile, importFile)
+    except OSError:
+        # Another process is importing the file.
+        return
 
-    log.debug("Storing newly received ticket in `%s'." % ticketFile)
+    log.info("Importing tickets from `%s'." % ticketFile)
 
-    # Add a new (key, ticket) tuple with the given bridge as hash key.
+    content = util.readFromFile(importFile)
     tickets = dict()
-    content = util.readFromFile(ticketFile)
     if (content is not None) and (len(content) > 0):
         tickets = yaml.safe_load(content)
 
+    with db:
+        db.executemany("INSERT OR REPLACE INTO tickets VALUES (?, ?, ?, ?)",
+                       [(bridge, timestamp, sqlite3.Binary(masterKey),
+                         sqlite3.Binary(ticket)) for bridge, (timestamp,
+                         masterKey, ticket) in tickets.iteritems()])
+    os.remove(importFile)
+
+
+def openTicketStore( ):
+    """
+    Return a connection to the client's ticket store.
+
+    The store is an SQLite table indexed by bridge, so that storing and
+    redeeming a ticket only touches one row.  SQLite locks the database file,
+    so that the store can be shared by several processes.  Connections are
+    opened once per process.
+    """
+
+    dbFile = const.STATE_LOCATION + const.CLIENT_TICKET_DB
+
+    db = _ticketStores.get(dbFile)
+    if db is None:
+        log.debug("Opening ticket store `%s'." % dbFile)
+        db = sqlite3.connect(dbFile, timeout=const.TICKET_DB_TIMEOUT)
+        db.text_factory = str
+        # Write-ahead logging spares most of the disk syncs of a commit.
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        with db:
+            db.execute("CREATE TABLE IF NOT EXISTS tickets ("
+                       "bridge TEXT PRIMARY KEY, "
+                       "timestamp INTEGER NOT NULL, "
+                       "masterKey BLOB NOT NULL, "
+                       "ticket BLOB NOT NULL)")
+        _ticketStores[dbFile] = db
+
+    importTicketFile(db)
+
+    return db
+
+
+def storeNewTicket( masterKey, ticket, bridge ):
+    """
+    Store a new session ticket and the according master key for future use.
+
+    This method is only called by clients.  The given data, `masterKey',
+    `ticket' and `bridge', is stored in the ticket store.  If there already is
+    a ticket for the given `bridge', it is overwritten.
+    """
+
+    assert len(masterKey) == const.MASTER_KEY_LENGTH
+    assert len(ticket) == const.TICKET_LENGTH
+
+    log.debug("Storing newly received ticket.")
+
     # We also store a timestamp so we later know if our ticket already expired.
-    tickets[str(bridge)] = [int(time.time()), masterKey, ticket]
-    util.writeToFile(yaml.dump(tickets), ticketFile)
+    try:
+        db = openTicketStore()
+        with db:
+            db.execute("INSERT OR REPLACE INTO tickets VALUES (?, ?, ?, ?)",
+                       (str(bridge), int(time.time()),
+                        sqlite3.Binary(masterKey), sqlite3.Binary(ticket)))
+    except (sqlite3.Error, IOError, OSError) as err:
+        log.error("Error storing ticket: %s." % err)
 
 
 def findStoredTicket( bridge ):
     """
-    Retrieve a previously stored ticket from the ticket dictionary.
+    Retrieve a previously stored ticket from the ticket store.
 
-    The global ticket dictionary is loaded and the given `bridge' is used to
-    look up the ticket and the master key.  If the ticket dictionary does not
-    exist (yet) or the ticket data could not be found, `None' is returned.
+    The given `bridge' is used to look up the ticket and the master key, which
+    are removed from the store since they are about to be redeemed.  If the
+    ticket data could not be found or expired, `None' is returned.
     """
 
     assert bridge
 
-    ticketFile = const.STATE_LOCATION + const.CLIENT_TICKET_FILE
-
-    log.debug("Attempting to read master key and ticket from file `%s'." %
-              ticketFile)
+    log.debug("Attempting to read master key and ticket from the ticket "
+              "store.")
 
-    # Load the ticket hash table from file.
-    yamlBlurb = util.readFromFile(ticketFile)
-    if (yamlBlurb is None) or (len(yamlBlurb) == 0):
+    try:
+        db = openTicketStore()
+        with db:
+            # Take the write lock before reading so that no other process
+            # redeems the same ticket.
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT timestamp, masterKey, ticket FROM tickets "
+                             "WHERE bridge = ?", (str(bridge),)).fetchone()
+            if row is not None:
+                # We can remove the ticket now since we are about to redeem
+                # it.
+                log.debug("Deleting ticket since it is about to be redeemed.")
+                db.execute("DELETE FROM tickets WHERE bridge = ?",
+                           (str(bridge),))
+    except (sqlite3.Error, IOError, OSError) as err:
+        log.error("Error reading ticket: %s." % err)
         return None
-    tickets = yaml.safe_load(yamlBlurb)
 
-    try:
-        timestamp, masterKey, ticket = tickets[str(bridge)]
-    except KeyError:
+    if row is None:
         log.info("Found no ticket for bridge `%s'." % str(bridge))
         return None
 
-    # We can remove the ticket now since we are about to redeem it.
-    log.debug("Deleting ticket since it is about to be redeemed.")
-    del tickets[str(bridge)]
-    util.writeToFile(yaml.dump(tickets), ticketFile)
+    timestamp, masterKey, ticket = row
 
     # If our ticket is expired, we can't redeem it.
     ticketAge = int(time.time()) - timestamp
@@ -150,7 +224,7 @@ def findStoredTicket( bridge ):
                         (ticketAge - const.SESSION_TICKET_LIFETIME))))
         return None
 
-    return (masterKey, ticket)
+    return (str(masterKey), str(ticket))
 
 
 def checkKeys( srvState ):
@@ -11,15 +11,44 @@ import binascii
 
 import Crypto.Hash.SHA256
 
+from twisted.internet import defer
+
 import util
 import mycrypto
 
 import obfsproxy.transports.obfs3_dh as obfs3_dh
+import obfsproxy.transports.dh_pool as dh_pool
 import obfsproxy.transports.base as base
 import obfsproxy.common.log as logging
+import obfsproxy.common.workerpool as workerpool
 
 log = logging.get_obfslogger()
 
+def computeMasterKey( udh, remotePublicKey ):
+    """
+    Compute and return the master key shared with `remotePublicKey'.
+
+    The 4096-bit UniformDH secret of the local object `udh' and the given
+    public key is hashed to obtain the master key.
+    """
+
+    try:
+        uniformDHSecret = udh.get_secret(remotePublicKey)
+    except ValueError:
+        raise base.PluggableTransportError("Corrupted public key.")
+
+    return Crypto.Hash.SHA256.new(uniformDHSecret).digest()
+
+def createKeyAndMasterKey( remotePublicKey ):
+    """
+    Create a fresh UniformDH object and compute the master key shared with
+    `remotePublicKey'.  Both are returned as tuple.
+    """
+
+    udh = obfs3_dh.UniformDH()
+
+    return (udh, computeMasterKey(udh, remotePublicKey))
+
 class UniformDH( object ):
 
     """
@@ -40,6 +69,12 @@ class UniformDH( object ):
         # The shared UniformDH secret.
         self.sharedSecret = sharedSecret
 
+        # The shared secret as keyed HMAC object.  Clients in managed mode
+        # only learn the secret later and then create a new UniformDH object.
+        self.keyedSecret = None
+        if sharedSecret is not None:
+            self.keyedSecret = mycrypto.keyedHMAC(sharedSecret)
+
         # Cache a UniformDH public key until it's added to the replay table.
         self.remotePublicKey = None
 
@@ -73,22 +108,54 @@ class UniformDH( object ):
         if self.weAreServer:
             self.remotePublicKey = remotePublicKey
             # As server, we need a DH object; as client, we already have one.
-            self.udh = obfs3_dh.UniformDH()
+            self.udh = dh_pool.new_keypair()
 
         assert self.udh is not None
 
-        try:
-            uniformDHSecret = self.udh.get_secret(remotePublicKey)
-        except ValueError:
-            raise base.PluggableTransportError("Corrupted public key.")
+        # Session keys are now derived from the master key.
+        callback(computeMasterKey(self.udh, remotePublicKey))
 
-        # First, hash the 4096-bit UniformDH secret to obtain the master key.
-        masterKey = Crypto.Hash.SHA256.new(uniformDHSecret).digest()
+        return True
 
-        # Second, session keys are now derived from the master key.
-        callback(masterKey)
+    def deferPublicKey( self, data, callback, srvState=None ):
+        """
+        Like `receivePublicKey' but the UniformDH computation is run in the
+        worker pool.
+
+        The public key is extracted and authenticated right away.  If that
+        fails, `None' is returned.  Otherwise, a Deferred is returned which
+        fires with `True' after `callback' was invoked with the master secret.
+        The Deferred fails if the public key is corrupted or if the worker
+        pool is full.
+        """
 
-        return True
+        remotePublicKey = self.extractPublicKey(data, srvState)
+        if not remotePublicKey:
+            return None
+
+        def keysComputed( result ):
+            if self.weAreServer:
+                (self.udh, masterKey) = result
+            else:
+                masterKey = result
+            callback(masterKey)
+            return True
+
+        if self.weAreServer:
+            self.remotePublicKey = remotePublicKey
+            # Unless a precomputed DH object is available, the server's DH
+            # object is created in the worker as well.
+            udh = dh_pool.take()
+            if udh is None:
+                d = workerpool.run(createKeyAndMasterKey, remotePublicKey)
+            else:
+                d = workerpool.run(computeMasterKey, udh, remotePublicKey)
+                d.addCallback(lambda masterKey: (udh, masterKey))
+        else:
+            assert self.udh is not None
+            d = workerpool.run(computeMasterKey, self.udh, remotePublicKey)
+
+        return d.addCallback(keysComputed)
 
     def extractPublicKey( self, data, srvState=None ):
         """
@@ -114,7 +181,7 @@ class UniformDH( object ):
 
         # First, find the mark to efficiently locate the HMAC.
         publicKey = handshake[:const.PUBLIC_KEY_LENGTH]
-        mark = mycrypto.HMAC_SHA256_128(self.sharedSecret, publicKey)
+        mark = mycrypto.HMAC_SHA256_128(self.keyedSecret, publicKey)
 
         index = util.locateMark(mark, handshake)
         if not index:
@@ -125,12 +192,13 @@ class UniformDH( object ):
         existingHMAC = handshake[hmacStart:
                                  (hmacStart + const.HMAC_SHA256_128_LENGTH)]
 
+        # The HMACs of all epochs share the prefix which is hashed only once.
+        prefixHMAC = self.keyedSecret.with_prefix(handshake[0 : hmacStart])
         authenticated = False
         for epoch in util.expandedEpoch():
-            myHMAC = mycrypto.HMAC_SHA256_128(self.sharedSecret,
-                                              handshake[0 : hmacStart] + epoch)
+            myHMAC = mycrypto.HMAC_SHA256_128(prefixHMAC, epoch)
 
-            if util.isValidHMAC(myHMAC, existingHMAC, self.sharedSecret):
+            if util.isValidHMAC(myHMAC, existingHMAC, self.keyedSecret):
                 self.echoEpoch = epoch
                 authenticated = True
                 break
@@ -162,7 +230,7 @@ class UniformDH( object ):
 
         The returned handshake data includes the public key, pseudo-random
         padding, the mark and the HMAC.  If a UniformDH object has not been
-        initialised yet, a new instance is created.
+        initialised yet, a precomputed or new instance is used.
         """
 
         assert self.sharedSecret is not None
@@ -170,7 +238,7 @@ class UniformDH( object ):
         log.debug("Creating UniformDH handshake message.")
 
         if self.udh is None:
-            self.udh = obfs3_dh.UniformDH()
+            self.udh = dh_pool.new_keypair()
         publicKey = self.udh.get_public()
 
         assert (const.MAX_PADDING_LENGTH - const.PUBLIC_KEY_LENGTH) >= 0
@@ -183,7 +251,7 @@ class UniformDH( object ):
                                         const.PUBLIC_KEY_LENGTH))
 
         # Add a mark which enables efficient location of the HMAC.
-        mark = mycrypto.HMAC_SHA256_128(self.sharedSecret, publicKey)
+        mark = mycrypto.HMAC_SHA256_128(self.keyedSecret, publicKey)
 
         if self.echoEpoch is None:
             epoch = util.getEpoch()
@@ -192,7 +260,7 @@ class UniformDH( object ):
             log.debug("Echoing epoch rather than recreating it.")
 
         # Authenticate the handshake including the current approximate epoch.
-        mac = mycrypto.HMAC_SHA256_128(self.sharedSecret,
+        mac = mycrypto.HMAC_SHA256_128(self.keyedSecret,
                                        publicKey + padding + mark + epoch)
 
         if self.weAreServer and (srvState is not None):
@@ -202,5 +270,25 @@ class UniformDH( object ):
 
         return publicKey + padding + mark + mac
 
+    def deferHandshake( self, srvState=None ):
+        """
+        Like `createHandshake' but the UniformDH key is generated in the
+        worker pool unless a precomputed one is available.
+
+        A Deferred is returned which fires with the handshake.
+        """
+
+        if self.udh is None:
+            self.udh = dh_pool.take()
+
+        if self.udh is not None:
+            return defer.succeed(self.createHandshake(srvState))
+
+        def keyCreated( udh ):
+            self.udh = udh
+            return self.createHandshake(srvState)
+
+        return workerpool.run(obfs3_dh.UniformDH).addCallback(keyCreated)
+
 # Alias class name in order to provide a more intuitive API.
 new = UniformDH
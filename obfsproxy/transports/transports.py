@@ -1,26 +1,40 @@
-# XXX modulify transports and move this to a single import
-import obfsproxy.transports.dummy as dummy
-import obfsproxy.transports.b64 as b64
-import obfsproxy.transports.obfs2 as obfs2
-import obfsproxy.transports.obfs3 as obfs3
-import obfsproxy.transports.scramblesuit.scramblesuit as scramblesuit
-import obfsproxy.transports.wfpadtools.wfpad as wfpad
-from obfsproxy.transports.wfpadtools.specific import buflo, csbuflo, tamaraw,\
-    adaptive, bwdiff
-
-transports = { 'dummy' : {'base': dummy.DummyTransport, 'client' : dummy.DummyClient, 'server' : dummy.DummyServer },
-               'b64'   : {'base': b64.B64Transport, 'client' : b64.B64Client, 'server' : b64.B64Server },
-               'obfs2' : {'base': obfs2.Obfs2Transport, 'client' : obfs2.Obfs2Client, 'server' : obfs2.Obfs2Server },
-               'scramblesuit' : {'base':  scramblesuit.ScrambleSuitTransport,
-                                 'client':scramblesuit.ScrambleSuitClient,
-                                 'server':scramblesuit.ScrambleSuitServer },
-               'obfs3' : {'base': obfs3.Obfs3Transport, 'client' : obfs3.Obfs3Client, 'server' : obfs3.Obfs3Server },
-               'buflo' : {'base': buflo.BuFLOTransport, 'client' : buflo.BuFLOClient, 'server' : buflo.BuFLOServer },
-               'wfpad': {'base': wfpad.WFPadTransport, 'client': wfpad.WFPadClient, 'server': wfpad.WFPadServer},
-               'csbuflo': {'base': csbuflo.CSBuFLOTransport, 'client': csbuflo.CSBuFLOClient, 'server': csbuflo.CSBuFLOServer},
-               'tamaraw': {'base': tamaraw.TamarawTransport, 'client': tamaraw.TamarawClient, 'server': tamaraw.TamarawServer},
-               'bwdiff': {'base': bwdiff.BWDiffTransport, 'client': bwdiff.BWDiffClient, 'server': bwdiff.BWDiffServer},
-               'adaptive': {'base': adaptive.AdaptiveTransport, 'client': adaptive.AdaptiveClient, 'server': adaptive.AdaptiveServer} }
+"""
+Registry of the transports supported by obfsproxy.
+
+Transport modules pull in heavy dependencies (PyCrypto, yaml, psutil, ...),
+so the registry only maps transport names to the module that implements
+them and the prefix of their class names. A module is imported the first
+time one of its classes is requested.
+"""
+import importlib
+
+# name -> (module, class prefix). The classes of a transport are
+# <prefix>Transport, <prefix>Client and <prefix>Server.
+transports = { 'dummy' : ('obfsproxy.transports.dummy', 'Dummy'),
+               'b64'   : ('obfsproxy.transports.b64', 'B64'),
+               'obfs2' : ('obfsproxy.transports.obfs2', 'Obfs2'),
+               'scramblesuit' : ('obfsproxy.transports.scramblesuit.scramblesuit', 'ScrambleSuit'),
+               'obfs3' : ('obfsproxy.transports.obfs3', 'Obfs3'),
+               'buflo' : ('obfsproxy.transports.wfpadtools.specific.buflo', 'BuFLO'),
+               'wfpad': ('obfsproxy.transports.wfpadtools.wfpad', 'WFPad'),
+               'csbuflo': ('obfsproxy.transports.wfpadtools.specific.csbuflo', 'CSBuFLO'),
+               'tamaraw': ('obfsproxy.transports.wfpadtools.specific.tamaraw', 'Tamaraw'),
+               'bwdiff': ('obfsproxy.transports.wfpadtools.specific.bwdiff', 'BWDiff'),
+               'adaptive': ('obfsproxy.transports.wfpadtools.specific.adaptive', 'Adaptive') }
+
+_class_suffixes = { 'base' : 'Transport', 'client' : 'Client', 'server' : 'Server' }
+
+# Classes of the transports that have already been imported.
+_loaded = {}
+
+def _load_transport(name):
+    """Import the module of transport `name` and return its classes."""
+    if name not in _loaded:
+        module_name, prefix = transports[name]
+        module = importlib.import_module(module_name)
+        _loaded[name] = dict((role, getattr(module, prefix + suffix))
+                             for role, suffix in _class_suffixes.items())
+    return _loaded[name]
 
 def get_transport_class(name, role):
     # Rewrite equivalent roles.
@@ -30,10 +44,9 @@ def get_transport_class(name, role):
         role = 'server'
 
     # Find the correct class
-    if (name in transports) and (role in transports[name]):
-        return transports[name][role]
+    if (name in transports) and (role in _class_suffixes):
+        return _load_transport(name)[role]
     else:
         raise TransportNotFound
 
 class TransportNotFound(Exception): pass
-
@@ -0,0 +1,110 @@
+"""
+Provides a process-wide budget for the bandwidth spent in padding.
+
+All the wfpad circuits of an obfsproxy process share a token bucket that
+is refilled at `rate` bytes per second up to `burst` bytes. Padding
+messages are only sent if the bucket can afford them, data messages are
+never charged to it. When the bucket runs low, the transports are notified
+so that each countermeasure can degrade its padding in a defined way.
+"""
+import time
+
+import obfsproxy.common.log as logging
+from obfsproxy.transports.wfpadtools import const
+
+
+log = logging.get_obfslogger()
+
+
+class PaddingBudget(object):
+    """Token bucket that limits the padding bandwidth of the process."""
+
+    def __init__(self, rate, burst=None):
+        """Create a new budget of `rate` bytes/sec and `burst` bytes."""
+        if rate <= 0:
+            raise ValueError("The padding budget rate must be positive.")
+        self.rate = rate
+        self.burst = burst if burst else rate
+        self.tokens = float(self.burst)
+        self.lastRefill = time.time()
+
+        # Statistics exported by `getStats`
+        self.spentBytes = 0
+        self.spentMessages = 0
+        self.skippedBytes = 0
+        self.skippedMessages = 0
+        self.degradedCircuits = 0
+
+    def refill(self):
+        """Add the tokens accrued since the last refill."""
+        now = time.time()
+        elapsed = now - self.lastRefill
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.lastRefill = now
+
+    def level(self):
+        """Return the fraction of the burst that is currently available."""
+        self.refill()
+        return self.tokens / self.burst
+
+    def isLow(self):
+        """Return whether the budget is below the low watermark."""
+        return self.level() < const.BUDGET_LOW_WATERMARK
+
+    def isRecovered(self):
+        """Return whether the budget is above the high watermark."""
+        return self.level() >= const.BUDGET_HIGH_WATERMARK
+
+    def consume(self, nbytes):
+        """Charge `nbytes` of padding to the budget.
+
+        Return True if the budget could afford them. Otherwise, nothing is
+        charged, the padding is accounted as skipped and False is returned.
+        """
+        self.refill()
+        if self.tokens < nbytes:
+            self.skippedBytes += nbytes
+            self.skippedMessages += 1
+            return False
+        self.tokens -= nbytes
+        self.spentBytes += nbytes
+        self.spentMessages += 1
+        return True
+
+    def getStats(self):
+        """Return a dictionary with the state of the budget."""
+        self.refill()
+        return {'rate': self.rate,
+                'burst': self.burst,
+                'tokens': int(self.tokens),
+                'spentBytes': self.spentBytes,
+                'spentMessages': self.spentMessages,
+                'skippedBytes': self.skippedBytes,
+                'skippedMessages': self.skippedMessages,
+                'degradedCircuits': self.degradedCircuits}
+
+    def dumpStats(self):
+        """Log the state of the budget."""
+        log.info("[wfpad] Padding budget: %s", self.getStats())
+
+
+_instance = None
+
+
+def new(rate, burst=None):
+    global _instance
+    if _instance:
+        raise RuntimeError('Padding budget already set')
+    _instance = PaddingBudget(rate, burst)
+    return _instance
+
+
+def get():
+    global _instance
+    return _instance
+
+
+def reset():
+    global _instance
+    _instance = None
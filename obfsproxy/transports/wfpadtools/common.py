@@ -3,6 +3,7 @@ from twisted.internet.defer import CancelledError
 
 import obfsproxy.common.log as logging
 import obfsproxy.transports.wfpadtools.const as const
+from obfsproxy.transports.wfpadtools import timing
 from obfsproxy.transports.wfpadtools.util.mathutil import closest_power_of_two, closest_multiple
 
 
@@ -13,12 +14,17 @@ def deferLater(*args, **kargs):
     """Shortcut to twisted deferLater.
 
     It allows to call twisted deferLater and add callback and errback methods.
+    If the timing monitor is enabled, the lateness of timers given a `timer`
+    key is recorded.
     """
     delayms, fn = args[0], args[1]
     callback = None
     if 'cbk' in kargs:
         callback = kargs['cbk']
         del kargs['cbk']
+    timer = kargs.pop('timer', None)
+    if timer and timing.get():
+        fn = timing.get().timed(timer, delayms, fn)
     d = task.deferLater(reactor, delayms / const.SCALE, fn, *args[2:], **kargs)
     log.debug("[wfpad] - Defer call to %s after %sms delay."
               % (fn.__name__, delayms))
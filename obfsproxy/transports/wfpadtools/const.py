@@ -91,6 +91,44 @@ MAX_DELAY               = 262144
 INIT_RHO                = 0
 MAX_RHO                 = 10000
 
+# Maximum number of data messages flushed in a single burst when the sampled
+# data delay is zero (set to 1 to flush a single message per reactor call).
+MAX_BURST_MSGS          = 64
+
+# Maximum number of serialized ignore messages (one per length) cached
+IGNORE_FRAME_CACHE_SIZE = 16
+
+# Bytes of outgoing data buffered by wfpad above which we stop reading
+# from upstream and below which we resume reading.
+BUFFER_HIGH_WATERMARK   = 262144
+BUFFER_LOW_WATERMARK    = 65536
+
+# Interval (ms) of the timer that measures the event loop lag and interval
+# (ms) between dumps of the timer lateness statistics.
+TIMING_LAG_INTERVAL     = 100
+TIMING_DUMP_INTERVAL    = 60000
+
+# Catch-up policies of the constant-rate clock when it falls behind its
+# schedule: send the missed messages back to back or skip them. A clock
+# never bursts more than RATE_MAX_CATCHUP messages.
+RATE_CATCHUP_BURST      = 'burst'
+RATE_CATCHUP_SKIP       = 'skip'
+RATE_CATCHUP_POLICY     = RATE_CATCHUP_BURST
+RATE_MAX_CATCHUP        = 8
+
+# Padding budget: fraction of the burst under which padding is degraded
+# and fraction above which it is restored.
+BUDGET_LOW_WATERMARK    = 0.25
+BUDGET_HIGH_WATERMARK   = 0.75
+# Factor by which degraded countermeasures stretch their padding period
+# and shorten their minimum padding time.
+BUDGET_DEGRADE_FACTOR   = 2
+
+# Number of upstream inter-arrival times kept by BW differentials
+BWDIFF_IAT_WINDOW       = 1000
+# Number of bandwidth differentials kept in the session
+BWDIFF_MAX_DIFFS        = 1000
+
 # Default shim ports
 SHIM_PORT               = 4997
 SOCKS_PORT              = 4998
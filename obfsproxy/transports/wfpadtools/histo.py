@@ -16,8 +16,10 @@ import obfsproxy.transports.wfpadtools.const as ct
 log = logging.get_obfslogger()
 
 
-class Histogram:
+class Histogram(object):
     """Provides methods to generate and sample histograms of prob distributions."""
+    __slots__ = ('name', 'hist', 'inf', 'interpolate', 'removeTokens',
+                 'template', 'labels', 'n', 'decay_by')
 
     def __init__(self, hist, interpolate=True, removeTokens=False, decay_by=0, name=''):
         """Initialize an histogram.
@@ -300,7 +302,16 @@ class Histogram:
         return h
 
 
+# Uniform histograms that wfpad uses by default. They never change because
+# they do not remove tokens, so they are shared by all the circuits.
+_sharedUniform = {}
+
+
 def uniform(x):
+    if x in (0, INF_LABEL):
+        if x not in _sharedUniform:
+            _sharedUniform[x] = new({x: 1}, interpolate=False, removeTokens=False)
+        return _sharedUniform[x]
     return new({x: 1}, interpolate=False, removeTokens=False)
 
 
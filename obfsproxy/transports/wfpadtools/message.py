@@ -9,6 +9,7 @@ https://gitweb.torproject.org/pluggable-transports/obfsproxy.git/tree/obfsproxy/
 """
 import json
 import math
+from collections import OrderedDict
 
 import obfsproxy.common.log as logging
 import obfsproxy.transports.base as base
@@ -21,6 +22,8 @@ log = logging.get_obfslogger()
 
 class WFPadMessage(object):
     """Represents a WFPad protocol message."""
+    __slots__ = ('payload', 'payloadLen', 'totalLen', 'sndTime', 'rcvTime',
+                 'flags', 'opcode', 'argsLen', 'args')
 
     def __init__(self, payload='', paddingLen=0, flags=const.FLAG_DATA, opcode=None, args=""):
         self.payload = payload
@@ -61,7 +64,8 @@ class WFPadMessage(object):
         return msgLen
 
     def __eq__(self, other):
-        return (isinstance(other, self.__class__) and self.__dict__ == other.__dict__)
+        return (isinstance(other, self.__class__) and
+                all(getattr(self, a) == getattr(other, a) for a in self.__slots__))
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -84,6 +88,9 @@ def isLast(msg):
 
 
 class WFPadMessageFactory(object):
+    # Serialized ignore messages indexed by padding length. Frames are
+    # immutable strings, so the LRU cache is shared by all factories.
+    _ignoreFrames = OrderedDict()
 
     def new(self, payload="", paddingLen=0, flags=const.FLAG_DATA, opcode=None, args=""):
         """Create a new WFPad message."""
@@ -93,6 +100,21 @@ class WFPadMessageFactory(object):
         """Shortcut to create a new dummy message."""
         return self.new("", paddingLen, const.FLAG_PADDING)
 
+    def getIgnoreFrame(self, paddingLen):
+        """Return the serialized dummy message of length `paddingLen`.
+
+        Frames are cached so that countermeasures sending padding of
+        constant length do not rebuild the same message every time.
+        """
+        frames = WFPadMessageFactory._ignoreFrames
+        frame = frames.pop(paddingLen, None)
+        if frame is None:
+            frame = str(self.newIgnore(paddingLen))
+            if len(frames) >= const.IGNORE_FRAME_CACHE_SIZE:
+                frames.popitem(last=False)
+        frames[paddingLen] = frame
+        return frame
+
     def newControl(self, opcode, args="", payload="", paddingLen=0):
         """Shortcut to create a single control message."""
         if len(args) > const.MPU:
@@ -255,6 +277,9 @@ class WFPadMessageExtractor(object):
     depending on the flag we continue parsing the `opcode`, `args`
     and `payload` fields.
     """
+    __slots__ = ('totalLen', 'payloadLen', 'flags', 'opcode', 'argsLen',
+                 'recvBuf', 'args')
+
     def __init__(self):
         """Create a new WFPadMessageExtractor object."""
         self.totalLen = self.payloadLen = self.flags = self.opcode = None
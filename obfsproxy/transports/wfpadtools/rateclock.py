@@ -0,0 +1,100 @@
+"""
+Provides a drift-compensating clock for constant-rate padding.
+
+Constant-rate countermeasures (BuFLO, CS-BuFLO, Tamaraw) used to sample
+their delays from a uniform histogram, so each message was scheduled
+`period` ms after the callback of the previous one. The latency of the
+callbacks accumulated and, under load, the effective rate drifted below
+the configured one.
+
+The clock computes the deadline of each message from a fixed schedule
+(the time of the first slot plus k times the period), so that a late
+callback shortens the next delay instead of delaying all the following
+messages. When the clock falls behind, it catches up in a bounded way
+according to its policy:
+
+ - `const.RATE_CATCHUP_BURST`: the missed slots are sent back to back,
+   provided they are at most `const.RATE_MAX_CATCHUP`. Otherwise, the
+   clock is considered to have been idle and it skips them.
+ - `const.RATE_CATCHUP_SKIP`: the late message is sent right away and the
+   rest of the missed slots are skipped.
+
+The clock has the `randomSample` interface of the histograms, so it can be
+used as the delay distribution of data, burst and gap messages. A slot is
+only consumed when `tick` is called, i.e., when a message is sent at it.
+"""
+from twisted.internet import reactor
+
+from obfsproxy.transports.wfpadtools import const
+
+CATCHUP_POLICIES = (const.RATE_CATCHUP_BURST, const.RATE_CATCHUP_SKIP)
+
+
+class ConstantRateClock(object):
+    """Schedules messages every `period` ms on absolute deadlines."""
+    __slots__ = ('period', 'policy', 'maxCatchup', '_anchor', '_slot',
+                 '_time', 'skipped')
+
+    def __init__(self, period, policy=const.RATE_CATCHUP_POLICY,
+                 maxCatchup=const.RATE_MAX_CATCHUP, _time=None):
+        if policy not in CATCHUP_POLICIES:
+            raise ValueError("Invalid catch-up policy: %s" % policy)
+        self.period = period
+        self.policy = policy
+        self.maxCatchup = maxCatchup
+        # Deadlines are kept in the time of the reactor that runs the timers
+        self._time = _time or reactor.seconds
+        # Deadline (s) of the slot number zero and number of the next slot.
+        # The schedule starts with the first sample or tick.
+        self._anchor = None
+        self._slot = 1
+        # Number of slots skipped to catch up
+        self.skipped = 0
+
+    def _deadline(self):
+        return self._anchor + self._slot * self.period / const.SCALE
+
+    def resync(self, now=None):
+        """Restart the schedule: the next slot is one period from `now`."""
+        self._anchor = self._time() if now is None else now
+        self._slot = 1
+
+    def randomSample(self):
+        """Return the delay (ms) until the deadline of the next slot."""
+        if self.period <= 0:
+            return 0
+        now = self._time()
+        if self._anchor is None:
+            self.resync(now)
+        delay = (self._deadline() - now) * const.SCALE
+        if delay > self.period:
+            # Timers do not fire early, so we are only ahead of the
+            # schedule if messages were sent out of it: do not wait for
+            # the slots they took.
+            self.resync(now)
+            return self.period
+        if delay >= 0:
+            return delay
+        missed = int(-delay / self.period)
+        if self.policy == const.RATE_CATCHUP_SKIP or missed >= self.maxCatchup:
+            self.skipped += missed
+            self._slot += missed
+        return 0
+
+    def setPeriod(self, period):
+        """Change the period, keeping the deadline of the last slot."""
+        if self._anchor is not None:
+            self._anchor += (self._slot - 1) * self.period / const.SCALE
+            self._slot = 1
+        self.period = period
+
+    def tick(self):
+        """Consume the next slot: a message has been sent at it."""
+        if self._anchor is None:
+            self.resync()
+        else:
+            self._slot += 1
+
+    def removeToken(self, f, padding=True):
+        """Constant rates have no tokens."""
+        pass
@@ -1,18 +1,33 @@
 import time
+from collections import deque
 
 from twisted.internet.defer import Deferred
 
+from obfsproxy.transports.wfpadtools import const
+
 
 class Session(object):
     """Contains state and variables for the current session.
 
     A session is defines as a visit to a web page.
+
+    A bridge keeps a session for each of its (mostly idle) circuits, so
+    attributes are stored in slots and the state that is rarely used is
+    only created on first access.
     """
+    __slots__ = ('is_padding', '_stop_padding', 'history',
+                 'lastSndDownstreamTs', 'lastSndDataDownstreamTs',
+                 'lastRcvDownstreamTs', 'lastRcvDataDownstreamTs',
+                 'lastRcvUpstreamTs', 'consecPaddingMsgs',
+                 'dataBytes', 'totalBytes', 'numMessages', 'dataMessages',
+                 'totalPadding', 'startTime', 'is_peer_padding',
+                 'current_iat', '_bw_diffs',
+                 '_bufferDrainedWaiters', '_peerStopPaddingWaiters')
 
     def __init__(self):
         # Flag padding
         self.is_padding = False
-        self.stop_padding = Deferred()
+        self._stop_padding = None
 
         # Statistics to keep track of past messages
         # Used for debugging
@@ -46,4 +61,59 @@ class Session(object):
         self.current_iat = 0
 
         # bw differentials
-        self.bw_diffs = []
+        self._bw_diffs = None
+
+        # Deferreds waiting for the data buffer to be drained and
+        # for the peer to stop padding
+        self._bufferDrainedWaiters = None
+        self._peerStopPaddingWaiters = None
+
+    @property
+    def stop_padding(self):
+        """Deferred fired when padding stops."""
+        if self._stop_padding is None:
+            self._stop_padding = Deferred()
+        return self._stop_padding
+
+    @property
+    def bw_diffs(self):
+        """Bandwidth differentials of the session."""
+        if self._bw_diffs is None:
+            self._bw_diffs = deque(maxlen=const.BWDIFF_MAX_DIFFS)
+        return self._bw_diffs
+
+    def whenBufferDrained(self):
+        """Return a Deferred fired when the data buffer gets empty."""
+        d = Deferred()
+        if self._bufferDrainedWaiters is None:
+            self._bufferDrainedWaiters = []
+        self._bufferDrainedWaiters.append(d)
+        return d
+
+    def bufferDrained(self):
+        """Fire the Deferreds waiting for the data buffer to be drained."""
+        waiters, self._bufferDrainedWaiters = self._bufferDrainedWaiters, None
+        for d in waiters or ():
+            d.callback(True)
+
+    def takeWaiters(self, other):
+        """Take over the Deferreds waiting on the session `other`."""
+        self._bufferDrainedWaiters, other._bufferDrainedWaiters = \
+            other._bufferDrainedWaiters, None
+        self._peerStopPaddingWaiters, other._peerStopPaddingWaiters = \
+            other._peerStopPaddingWaiters, None
+
+    def whenPeerStopsPadding(self):
+        """Return a Deferred fired when the peer stops padding."""
+        d = Deferred()
+        if self._peerStopPaddingWaiters is None:
+            self._peerStopPaddingWaiters = []
+        self._peerStopPaddingWaiters.append(d)
+        return d
+
+    def peerStoppedPadding(self):
+        """Flag the peer has stopped padding and fire the waiting Deferreds."""
+        self.is_peer_padding = False
+        waiters, self._peerStopPaddingWaiters = self._peerStopPaddingWaiters, None
+        for d in waiters or ():
+            d.callback(True)
@@ -95,6 +95,15 @@ class AdaptiveTransport(WFPadTransport):
 
         WFPadTransport.onSessionStarts(self, sessId)
 
+    def onPaddingBudgetLow(self):
+        """Adaptive Padding skips gap padding and only pads bursts."""
+        self._skipGapPadding = True
+        self.cancelGap('snd')
+        self.cancelGap('rcv')
+
+    def onPaddingBudgetRecovered(self):
+        self._skipGapPadding = False
+
 
 class AdaptiveClient(AdaptiveTransport):
     """Extend the AdaptiveTransport class."""
@@ -29,9 +29,10 @@ class BuFLOTransport(WFPadTransport):
         # elapsed time has exceeded the minimum padding time.
         def stopConditionHandler(s):
             elapsed = s.getElapsed()
+            mintime = s.getMintime()
             log.debug("[buflo {}] - elapsed = {}, mintime = {}, visiting = {}"
-                      .format(self.end, elapsed, s._mintime, s.isVisiting()))
-            return elapsed > s._mintime and not s.isVisiting()
+                      .format(self.end, elapsed, mintime, s.isVisiting()))
+            return elapsed > mintime and not s.isVisiting()
         self.stopCondition = stopConditionHandler
 
     @classmethod
@@ -85,6 +86,19 @@ class BuFLOTransport(WFPadTransport):
         self.constantRatePaddingDistrib(self._period)
         WFPadTransport.onSessionStarts(self, sessId)
 
+    def getMintime(self):
+        """Return the minimum padding time, shortened if budget is low."""
+        if self._budgetDegraded and self._mintime > 0:
+            return self._mintime / const.BUDGET_DEGRADE_FACTOR
+        return self._mintime
+
+    def onPaddingBudgetLow(self):
+        """BuFLO lowers its padding rate and shortens its minimum time."""
+        self.paddingRateDistrib(self._period)
+
+    def onPaddingBudgetRecovered(self):
+        self.paddingRateDistrib(self._period)
+
 
 class BuFLOClient(BuFLOTransport):
 
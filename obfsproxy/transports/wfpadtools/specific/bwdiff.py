@@ -2,6 +2,7 @@
 This module implements the BW differentials adaptive countermeasure.
 """
 import time
+from collections import deque
 
 # WFPadTools imports
 import obfsproxy.common.log as logging
@@ -9,13 +10,15 @@ from obfsproxy.transports.wfpadtools import common as cm
 from obfsproxy.transports.wfpadtools import histo as hs
 from obfsproxy.transports.wfpadtools import const
 from obfsproxy.transports.wfpadtools.wfpad import WFPadTransport
-from obfsproxy.transports.wfpadtools.util import genutil as gu
 from obfsproxy.transports.wfpadtools.util import mathutil as mu
 
 
 # Logging
 log = logging.get_obfslogger()
 
+# Bins (in seconds) of the histogram of upstream inter-arrival times
+IAT_LABELS = hs.Histogram.create_exponential_bins(a=0, b=10, n=20) + [const.INF_LABEL]
+
 
 class BWDiffTransport(WFPadTransport):
     """Implementation of the CSBuFLO countermeasure.
@@ -93,31 +96,53 @@ class BWDiffTransport(WFPadTransport):
         if args.early:
             cls._early_termination = args.early
 
+    def initBwEstimation(self):
+        """Initialize the bounded state used to estimate the bandwidth.
+
+        We keep the bytes received from upstream in the current period and
+        a ring buffer with the byte counts of the last two non-empty
+        periods. The inter-arrival times of the last `BWDIFF_IAT_WINDOW`
+        upstream reads are binned in a histogram that is updated in place.
+        """
+        self._periodBytes = 0
+        self._periodsBytes = deque(maxlen=2)
+        self._lastUpstreamTs = None
+        self._iats = deque()
+        self._iatHisto = hs.new(dict.fromkeys(IAT_LABELS, 0))
+
+    def addUpstreamSample(self, ts, length):
+        """Account a read from upstream of `length` bytes at `ts`."""
+        self._periodBytes += length
+        if self._lastUpstreamTs is not None:
+            iat = min(ts - self._lastUpstreamTs, IAT_LABELS[-2])
+            self._iats.append(iat)
+            self._iatHisto.hist[self._iatHisto.getLabelFromFloat(iat)] += 1
+            if len(self._iats) > const.BWDIFF_IAT_WINDOW:
+                oldest = self._iats.popleft()
+                self._iatHisto.hist[self._iatHisto.getLabelFromFloat(oldest)] -= 1
+        self._lastUpstreamTs = ts
+
     def getBwDifferential(self):
-        self.iat_length_tuples = [l for l in self.iat_length_tuples if len(l) > 0]
-        if time.time() - self.session.startTime > 0.2 and len(self.iat_length_tuples) > 1:
-            lengths0 = [t[1] for t in self.iat_length_tuples[-2]]
-            lengths1 = [t[1] for t in self.iat_length_tuples[-1]]
-            bw0 = sum(lengths0) / self._period
-            bw1 = sum(lengths1) / self._period
+        if self._periodBytes > 0:
+            self._periodsBytes.append(self._periodBytes)
+            self._periodBytes = 0
+        if time.time() - self.session.startTime > 0.2 and len(self._periodsBytes) > 1:
+            bw0 = self._periodsBytes[0] / self._period
+            bw1 = self._periodsBytes[1] / self._period
             bw_diff = (bw1 - bw0) / self._period
             self.session.bw_diffs.append(bw_diff)
-            log.debug("[bwdiff %s] - bw diffs: %s", self.end, self.session.bw_diffs)
+            log.debug("[bwdiff %s] - bw diff: %s", self.end, bw_diff)
             log.debug("[bwdiff %s] -  abs bwdiff (%s) > threshold (%s)",
                       self.end, abs(bw_diff), self._threshold)
-            if abs(bw_diff) > self._threshold:
-                # we should sample uniformly from the passed iats
-                # convert self.iat_length_tuples to distribution
-                # and pass it to wfpad iat distribution as dict.
-                iats = gu.get_iats([t[0] for t in gu.flatten_list(self.iat_length_tuples)])
-                h = {iat: 1 for iat in iats}
-                self._burstHistoProbdist['snd'] = hs.new(h)
-                self._gapHistoProbdist['snd'] = hs.new(h)
+            if abs(bw_diff) > self._threshold and len(self._iats) > 0:
+                # we should sample uniformly from the passed iats, which
+                # are already binned in the iat histogram.
+                self._burstHistoProbdist['snd'] = self._iatHisto
+                self._gapHistoProbdist['snd'] = self._iatHisto
             else:
                 self._burstHistoProbdist['snd'] = hs.uniform(const.INF_LABEL)
                 self._gapHistoProbdist['snd'] = hs.uniform(const.INF_LABEL)
-        self.iat_length_tuples.append([])
-        log.debug("[bwdiff %s] A period has passed: %s", self.end, self.iat_length_tuples[-3:-1])
+        log.debug("[bwdiff %s] A period has passed: %s", self.end, list(self._periodsBytes))
         if self.isVisiting():
             log.debug("[bwdiff %s] Calling next period (visiting = %s, padding = %s)",
                       self.end, self.isVisiting(), self.session.is_padding)
@@ -138,11 +163,11 @@ class BWDiffTransport(WFPadTransport):
             def earlyTermination(self):
                 return not self.session.is_peer_padding or stopCond()
             self.stopCondition = earlyTermination
-        self.iat_length_tuples = [[]]
+        self.initBwEstimation()
         self.getBwDifferential()
 
     def getAverageTs(self):
-        avg_ts = mu.median(gu.get_iats([t[0] for t in gu.flatten_list(self.iat_length_tuples)]))
+        avg_ts = mu.median(self._iats)
         log.debug("[bwdiff - %s] Average ts in the session is: %s.",
                   self.end, avg_ts)
         return avg_ts
@@ -161,7 +186,7 @@ class BWDiffTransport(WFPadTransport):
             log.info("[bwdiff - client] - Padding stopped! Will notify server.")
 
     def whenReceivedUpstream(self, data):
-        self.iat_length_tuples[-1].append((time.time(), const.MTU))
+        self.addUpstreamSample(time.time(), const.MTU)
 
 
 class BWDiffClient(BWDiffTransport):
@@ -10,7 +10,6 @@ import obfsproxy.common.log as logging
 from obfsproxy.transports.wfpadtools import histo
 from obfsproxy.transports.wfpadtools import const
 from obfsproxy.transports.wfpadtools.wfpad import WFPadTransport
-from obfsproxy.transports.wfpadtools.util import genutil as gu
 from obfsproxy.transports.wfpadtools.util import mathutil as mu
 
 # Logging
@@ -26,7 +25,9 @@ class CSBuFLOTransport(WFPadTransport):
     """
     def __init__(self):
         super(CSBuFLOTransport, self).__init__()
-        self._rho_stats = [[]]
+        # Streaming median of the inter-arrival times within bursts
+        self._rho_stats = mu.P2Quantile()
+        self._rho_last_ts = None
         self._rho_star = self._initial_rho
         # Set constant length for messages
         self._lengthDataProbdist = histo.uniform(self._length)
@@ -109,7 +110,8 @@ class CSBuFLOTransport(WFPadTransport):
     def onSessionEnds(self, sessId):
         super(CSBuFLOTransport, self).onSessionEnds(sessId)
         # Reset rho stats
-        self._rho_stats = [[]]
+        self._rho_stats.reset()
+        self._rho_last_ts = None
         self._rho_star = self._initial_rho
 
     def onEndPadding(self):
@@ -118,8 +120,16 @@ class CSBuFLOTransport(WFPadTransport):
             self.sendControlMessage(const.OP_END_PADDING)
             log.info("[csbuflo - client] - Padding stopped! Will notify server.")
 
+    def onPaddingBudgetLow(self):
+        """CS-BuFLO lowers its padding rate."""
+        self.paddingRateDistrib(self._period)
+
+    def onPaddingBudgetRecovered(self):
+        self.paddingRateDistrib(self._period)
+
     def whenReceivedUpstream(self, data):
-        self._rho_stats.append([])
+        # A new burst starts, do not measure the time since the last one
+        self._rho_last_ts = None
         self.whenReceived()
 
     def whenReceivedDownstream(self, data):
@@ -148,7 +158,10 @@ class CSBuFLOTransport(WFPadTransport):
     def sendDataMessage(self, payload="", paddingLen=0):
         """Send data message."""
         super(CSBuFLOTransport, self).sendDataMessage(payload, paddingLen)
-        self._rho_stats[-1].append(time.time())
+        now = time.time()
+        if self._rho_last_ts is not None:
+            self._rho_stats.add((now - self._rho_last_ts) * const.SCALE)
+        self._rho_last_ts = now
         if self.crossed_threshold():
             self.update_transmission_rate()
         elif self._rho_star >= const.MAX_RHO:
@@ -156,14 +169,10 @@ class CSBuFLOTransport(WFPadTransport):
 
     def estimate_rho(self, rho_star):
         """Estimate new value of rho based on past network performance."""
-        #log.debug("[cs-buflo] rho stats: %s" % self._rho_stats)
-        time_intervals = gu.flatten_list([gu.apply_consecutive_elements(burst_list, lambda x, y: (y - x) * const.SCALE)
-                                          for burst_list in self._rho_stats])
-        #log.debug("[cs-buflo] Time intervals = %s", time_intervals)
-        if len(time_intervals) == 0:
+        median_interval = self._rho_stats.value()
+        if not median_interval or median_interval <= 0:
             return rho_star
-        else:
-            return math.pow(2, math.floor(math.log(mu.median(time_intervals), 2)))
+        return math.pow(2, math.floor(math.log(median_interval, 2)))
 
     def update_transmission_rate(self):
         """Transmission rate."""
@@ -69,6 +69,13 @@ class TamarawTransport(WFPadTransport):
         self.constantRatePaddingDistrib(self._period)
         self.relayBatchPad(sessId, self._batch, self._period)
 
+    def onPaddingBudgetLow(self):
+        """Tamaraw lowers its padding rate."""
+        self.paddingRateDistrib(self._period)
+
+    def onPaddingBudgetRecovered(self):
+        self.paddingRateDistrib(self._period)
+
 
 class TamarawClient(TamarawTransport):
     """Extend the TamarawTransport class."""
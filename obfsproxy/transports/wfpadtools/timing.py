@@ -0,0 +1,142 @@
+"""
+Provides instrumentation of the accuracy of wfpad timers.
+
+Website fingerprinting defenses rely on messages being sent when they were
+scheduled. The timing monitor records how late the data, burst and gap
+timers of each transport fire with respect to the requested delay, and
+the lag of the event loop, measured with a timer that fires every
+`const.TIMING_LAG_INTERVAL` ms. Lateness is kept in streaming statistics
+(count, mean, max and P^2 estimates of the median and the 99th
+percentile) and is periodically logged, so that it is possible to tell
+when a box is too loaded to keep the schedule of a defense.
+"""
+import time
+
+from twisted.internet import reactor
+
+import obfsproxy.common.log as logging
+from obfsproxy.transports.wfpadtools import const
+from obfsproxy.transports.wfpadtools.util import mathutil as mu
+
+
+log = logging.get_obfslogger()
+
+# Key of the event loop lag statistics
+LAG_KEY = ('reactor', 'lag')
+
+
+class TimerStats(object):
+    """Streaming statistics of the lateness (in ms) of a kind of timer."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.median = mu.P2Quantile(0.5)
+        self.p99 = mu.P2Quantile(0.99)
+
+    def add(self, lateness):
+        self.count += 1
+        self.total += lateness
+        if lateness > self.max:
+            self.max = lateness
+        self.median.add(lateness)
+        self.p99.add(lateness)
+
+    def getStats(self):
+        """Return a dictionary with the statistics (times in ms)."""
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count,
+                'mean': round(self.total / self.count, 3),
+                'median': round(self.median.value(), 3),
+                'p99': round(self.p99.value(), 3),
+                'max': round(self.max, 3)}
+
+
+class TimingMonitor(object):
+    """Records the lateness of timers and the lag of the event loop."""
+
+    def __init__(self, lagInterval=const.TIMING_LAG_INTERVAL,
+                 dumpInterval=const.TIMING_DUMP_INTERVAL):
+        self.lagInterval = lagInterval
+        self.dumpInterval = dumpInterval
+        self.stats = {}
+        self._lagCall = None
+        self._lagDeadline = None
+        self._lastDump = None
+
+    def record(self, key, lateness):
+        """Add the `lateness` (ms) of a timer of kind `key`."""
+        try:
+            self.stats[key].add(lateness)
+        except KeyError:
+            self.stats[key] = TimerStats()
+            self.stats[key].add(lateness)
+
+    def timed(self, key, delayms, fn):
+        """Return a wrapper of `fn` that records how late it is called."""
+        deadline = time.time() + delayms / const.SCALE
+
+        def timedFn(*args, **kwargs):
+            self.record(key, max(0, (time.time() - deadline) * const.SCALE))
+            return fn(*args, **kwargs)
+        timedFn.__name__ = fn.__name__
+        return timedFn
+
+    def start(self):
+        """Start measuring the lag of the event loop."""
+        if self._lagCall is None:
+            self._lastDump = time.time()
+            self._scheduleLagProbe()
+
+    def stop(self):
+        if self._lagCall is not None and self._lagCall.active():
+            self._lagCall.cancel()
+        self._lagCall = None
+
+    def _scheduleLagProbe(self):
+        self._lagDeadline = time.time() + self.lagInterval / const.SCALE
+        self._lagCall = reactor.callLater(self.lagInterval / const.SCALE,
+                                          self._lagProbe)
+
+    def _lagProbe(self):
+        now = time.time()
+        self.record(LAG_KEY, max(0, (now - self._lagDeadline) * const.SCALE))
+        if now - self._lastDump >= self.dumpInterval / const.SCALE:
+            self._lastDump = now
+            self.dumpStats()
+        self._scheduleLagProbe()
+
+    def getStats(self):
+        """Return a dictionary with the statistics of each kind of timer."""
+        return dict(("%s.%s" % key, stats.getStats())
+                    for key, stats in self.stats.iteritems())
+
+    def dumpStats(self):
+        """Log the timing statistics."""
+        log.info("[wfpad] Timer lateness (ms): %s", self.getStats())
+
+
+_instance = None
+
+
+def new(lagInterval=const.TIMING_LAG_INTERVAL,
+        dumpInterval=const.TIMING_DUMP_INTERVAL):
+    global _instance
+    if _instance:
+        raise RuntimeError('Timing monitor already set')
+    _instance = TimingMonitor(lagInterval, dumpInterval)
+    return _instance
+
+
+def get():
+    global _instance
+    return _instance
+
+
+def reset():
+    global _instance
+    if _instance:
+        _instance.stop()
+    _instance = None
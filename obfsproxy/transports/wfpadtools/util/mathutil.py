@@ -1,4 +1,5 @@
 import math
+from bisect import bisect_right, insort
 
 
 def closest_multiple(n, k, ceil=True):
@@ -34,3 +35,81 @@ def median(l):
 
 def mean(l):
     return float(sum(l))/len(l) if len(l) > 0 else float('nan')
+
+
+class P2Quantile(object):
+    """Streaming estimator of the `p` quantile of a sequence of samples.
+
+    Implements the P^2 algorithm by Jain and Chlamtac: "The P^2 algorithm
+    for dynamic calculation of quantiles and histograms without storing
+    observations". Each sample is added in O(1) time and the estimator
+    only keeps five markers in memory.
+    """
+
+    def __init__(self, p=0.5):
+        self.p = p
+        self.reset()
+
+    def reset(self):
+        """Forget all the samples added so far."""
+        p = self.p
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0]
+        self.increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def __len__(self):
+        return self.count
+
+    def add(self, x):
+        """Update the markers with the sample `x`."""
+        self.count += 1
+        q, n = self.heights, self.positions
+        if self.count <= 5:
+            insort(q, x)
+            return
+        # Find cell k such that q[k] <= x < q[k + 1] and adjust extremes
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect_right(q, x) - 1
+        for i in xrange(k + 1, 5):
+            n[i] += 1
+        for i in xrange(5):
+            self.desired[i] += self.increments[i]
+        # Adjust heights of the middle markers if necessary
+        for i in xrange(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or \
+                    (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = self._parabolic(i, d)
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = self._linear(i, d)
+                q[i] = qp
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / float(n[i + 1] - n[i - 1]) * \
+            ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / float(n[i + 1] - n[i]) +
+             (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / float(n[i] - n[i - 1]))
+
+    def _linear(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d * (q[i + d] - q[i]) / float(n[i + d] - n[i])
+
+    def value(self):
+        """Return the current estimate of the quantile."""
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            if self.p == 0.5:
+                return median(self.heights)
+            return self.heights[int(round(self.p * (self.count - 1)))]
+        return self.heights[2]
@@ -11,13 +11,13 @@ import socket
 import time
 
 import psutil
-from twisted.internet import reactor
 
 import obfsproxy.common.log as logging
 import obfsproxy.transports.wfpadtools.const as const
 from obfsproxy.transports.base import BaseTransport, PluggableTransportError
 from obfsproxy.transports.scramblesuit.fifobuf import Buffer
-from obfsproxy.transports.wfpadtools import histo, message as mes, message, socks_shim, wfpad_shim
+from obfsproxy.transports.wfpadtools import budget, histo, message as mes, message, socks_shim, timing, wfpad_shim
+from obfsproxy.transports.wfpadtools.rateclock import CATCHUP_POLICIES, ConstantRateClock
 from obfsproxy.transports.wfpadtools.common import deferLater
 from obfsproxy.transports.wfpadtools.kist import estimate_write_capacity
 from obfsproxy.transports.wfpadtools.primitives import PaddingPrimitivesInterface
@@ -27,6 +27,33 @@ from obfsproxy.transports.wfpadtools.session import Session
 log = logging.get_obfslogger()
 
 
+def _ignoreDelay(delay):
+    """Default callback of the burst and gap padding deferreds."""
+    pass
+
+
+def _alwaysStop(transport):
+    """Default condition to stop padding."""
+    return True
+
+
+def _noTotalPadding(transport):
+    """Default method to calculate the total padding."""
+    return None
+
+
+# The psutil process is the same for all circuits, so it is created once.
+_process = None
+
+
+def getProcess():
+    """Return the psutil process of this obfsproxy instance."""
+    global _process
+    if _process is None or _process.pid != os.getpid():
+        _process = psutil.Process(os.getpid())
+    return _process
+
+
 class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
     """Implements the base class for the WFPadTools transport.
 
@@ -34,6 +61,16 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
     different existing website fingerprinting countermeasures, and
     that can also be used to generate new ones.
     """
+    # Window (ms) to coalesce small upstream reads into full messages
+    _coalesceWindow = 0
+
+    # Buffered bytes above which we stop reading from upstream and
+    # below which we resume
+    _bufferHighWatermark = const.BUFFER_HIGH_WATERMARK
+    _bufferLowWatermark = const.BUFFER_LOW_WATERMARK
+
+    # What constant-rate padding does when it falls behind its schedule
+    _rateCatchup = const.RATE_CATCHUP_POLICY
 
     def __init__(self):
         """Initialize a WFPadTransport object."""
@@ -98,27 +135,38 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         self._gapHistoProbdist = {'rcv': histo.uniform(const.INF_LABEL),
                                   'snd': histo.uniform(const.INF_LABEL)}
 
+        # Clock of constant-rate padding, if it is enabled
+        self._rateClock = None
+
         # Initialize deferred events. The deferreds are called with the delay
         # sampled from the probability distributions above
         self._deferData = None
+        self._pendingWrites = None
+        self._coalescing = False
         self._deferBurst = {'rcv': None, 'snd': None}
         self._deferGap = {'rcv': None, 'snd': None}
 
         # Initialize deferred callbacks.
-        self._deferBurstCallback = {'rcv': lambda d: None,
-                                    'snd': lambda d: None}
-        self._deferGapCallback = {'rcv': lambda d: None,
-                                  'snd': lambda d: None}
+        self._deferBurstCallback = {'rcv': _ignoreDelay,
+                                    'snd': _ignoreDelay}
+        self._deferGapCallback = {'rcv': _ignoreDelay,
+                                  'snd': _ignoreDelay}
 
         # This method is evaluated to decide when to stop padding
-        self.stopCondition = lambda Self: True
+        self.stopCondition = _alwaysStop
 
         # method to calculate total padding
-        self.calculateTotalPadding = lambda Self: None
+        self.calculateTotalPadding = _noTotalPadding
 
-        # Get pid and process
+        # Whether padding is degraded because the padding budget runs low
+        self._budgetDegraded = False
+        self._skipGapPadding = False
+
+        # Whether reading from upstream is paused because the buffer is full
+        self._upstreamPaused = False
+
+        # Get pid, the process is shared by all circuits
         self.pid = os.getpid()
-        self.process = psutil.Process(self.pid)
         self.connections = []
         self.downstreamSocket = None
 
@@ -139,6 +187,43 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
                                type=str,
                                help="switch to enable logs for session.",
                                dest="session_logs")
+        subparser.add_argument("--padding-budget",
+                               required=False,
+                               type=str,
+                               help="Process-wide padding budget "
+                                    "(rate_bytes_per_sec,burst_bytes).",
+                               dest="padding_budget")
+        subparser.add_argument("--coalesce",
+                               required=False,
+                               type=float,
+                               help="Time window (ms) to coalesce small reads "
+                                    "from upstream into full messages when "
+                                    "data is not delayed (Default: 0, "
+                                    "only reads within a reactor tick).",
+                               dest="coalesce")
+        subparser.add_argument("--buffer-watermarks",
+                               required=False,
+                               type=str,
+                               help="Buffered bytes of outgoing data above "
+                                    "which reading from upstream is paused "
+                                    "and below which it is resumed "
+                                    "(high,low).",
+                               dest="buffer_watermarks")
+        subparser.add_argument("--timer-stats",
+                               action="store_true",
+                               default=False,
+                               help="Measure how late padding and data timers "
+                                    "fire and the event loop lag, and log "
+                                    "the statistics periodically.",
+                               dest="timer_stats")
+        subparser.add_argument("--catchup",
+                               required=False,
+                               choices=CATCHUP_POLICIES,
+                               help="What constant-rate padding does when "
+                                    "it falls behind its schedule: send the "
+                                    "missed messages in a burst or skip them "
+                                    "(Default: %s)." % const.RATE_CATCHUP_POLICY,
+                               dest="catchup")
         super(WFPadTransport, cls).register_external_mode_cli(subparser)
 
     @classmethod
@@ -158,6 +243,21 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         if args.shim:
             cls.shim_ports = map(int, args.shim.split(','))
             log.debug("[wfpad] Shim ports: %s", cls.shim_ports)
+        cls._coalesceWindow = args.coalesce if args.coalesce else 0
+        if args.buffer_watermarks:
+            high, low = map(int, args.buffer_watermarks.split(','))
+            if not 0 <= low <= high:
+                raise ValueError("Invalid buffer watermarks: %s"
+                                 % args.buffer_watermarks)
+            cls._bufferHighWatermark, cls._bufferLowWatermark = high, low
+        if args.catchup:
+            cls._rateCatchup = args.catchup
+        if args.timer_stats and not timing.get():
+            timing.new().start()
+            log.debug("[wfpad] Timer statistics enabled.")
+        if args.padding_budget and not budget.get():
+            budget.new(*map(int, args.padding_budget.split(',')))
+            log.debug("[wfpad] Padding budget: %s", args.padding_budget)
 
     @classmethod
     def setup(cls, transportConfig):
@@ -177,6 +277,8 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
             _shim = socks_shim.get()
             if _shim.isRegistered(self._sessionObserver):
                 _shim.deregisterObserver(self._sessionObserver)
+        if self._budgetDegraded and budget.get():
+            budget.get().degradedCircuits -= 1
 
     def circuitConnected(self):
         """Initiate handshake.
@@ -193,8 +295,9 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         # Get peer address
         self.peer_addr = self.circuit.downstream.peer_addr
         # Load sockets
-        if "test" not in self.process.name():
-            self.connections = self.process.get_connections()
+        process = getProcess()
+        if "test" not in process.name():
+            self.connections = process.get_connections()
             for pconn in self.connections:
                 if pconn.status == 'ESTABLISHED' and pconn.raddr[1] == self.peer_addr.port:
                     self.downstreamSocket = socket.fromfd(pconn.fd, pconn.family, pconn.type)
@@ -215,6 +318,25 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
             self._buffer.write(d)
             log.debug("[wfpad - %s] Buffered %d bytes of outgoing data.",
                       self.end, len(self._buffer))
+        self.checkBufferWatermarks()
+
+    def checkBufferWatermarks(self):
+        """Pause reading from upstream while the buffer is too large.
+
+        Reading is paused when the buffered data exceeds the high watermark
+        and resumed once flushes bring it below the low watermark.
+        """
+        bufLen = len(self._buffer)
+        if not self._upstreamPaused and bufLen > self._bufferHighWatermark:
+            self._upstreamPaused = True
+            log.debug("[wfpad - %s] %d bytes buffered, pausing upstream.",
+                      self.end, bufLen)
+            self.circuit.pauseUpstream()
+        elif self._upstreamPaused and bufLen <= self._bufferLowWatermark:
+            self._upstreamPaused = False
+            log.debug("[wfpad - %s] %d bytes buffered, resuming upstream.",
+                      self.end, bufLen)
+            self.circuit.resumeUpstream()
 
     def whenReceivedUpstream(self, data):
         """Template method for child WF defense transport."""
@@ -234,26 +356,14 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
 
     def sendDownstream(self, data):
         """Sends `data` downstream over the wire."""
-        if self.session.numMessages['snd'] > 2:
-            self.session.current_iat = time.time() - self.session.lastSndDataDownstreamTs
         if isinstance(data, str):
-            self.circuit.downstream.write(data)
+            self.updateCurrentIat()
+            self.writeDownstream(data)
         elif isinstance(data, mes.WFPadMessage):
             data.sndTime = time.time()
-            direction = const.OUT if self.weAreClient else const.IN
-            self.circuit.downstream.write(str(data))
+            self.writeDownstream(str(data))
             log.debug("[wfpad - %s] A new message (flag=%s) sent!", self.end, data.flags)
-            if not data.flags & const.FLAG_CONTROL:
-                self.session.numMessages['snd'] += 1
-                self.session.totalBytes['snd'] += data.totalLen
-                if data.flags & const.FLAG_DATA:
-                    self.session.dataMessages['snd'] += 1
-                    self.session.dataBytes['snd'] += len(data.payload)
-                    self.session.history.append((time.time(), const.FLAG_DATA, direction, data.totalLen, len(data.payload)))
-                if data.flags & const.FLAG_PADDING:
-                    self.session.history.append((time.time(), const.FLAG_PADDING, direction, data.totalLen, len(data.payload)))
-            else:
-                self.session.history.append((time.time(), const.FLAG_CONTROL, direction, data.totalLen, len(data.payload)))
+            self.accountSentMessage(data.flags, data.totalLen, len(data.payload))
             return [data]
         elif isinstance(data, list):
             listMsgs = []
@@ -265,26 +375,104 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         else:
             raise RuntimeError("Attempted to send non-string data.")
 
+    def updateCurrentIat(self):
+        if self.session.numMessages['snd'] > 2:
+            self.session.current_iat = time.time() - self.session.lastSndDataDownstreamTs
+
+    def accountSentMessage(self, flags, totalLen, payloadLen):
+        """Update the session statistics with a message sent downstream."""
+        self.updateCurrentIat()
+        now = time.time()
+        direction = const.OUT if self.weAreClient else const.IN
+        if not flags & const.FLAG_CONTROL:
+            self.session.numMessages['snd'] += 1
+            self.session.totalBytes['snd'] += totalLen
+            if flags & const.FLAG_DATA:
+                self.session.dataMessages['snd'] += 1
+                self.session.dataBytes['snd'] += payloadLen
+                self.session.history.append((now, const.FLAG_DATA, direction, totalLen, payloadLen))
+            if flags & const.FLAG_PADDING:
+                self.session.history.append((now, const.FLAG_PADDING, direction, totalLen, payloadLen))
+        else:
+            self.session.history.append((now, const.FLAG_CONTROL, direction, totalLen, payloadLen))
+
+    def writeDownstream(self, data):
+        """Write `data` to the downstream connection.
+
+        While a burst is being flushed, the data is queued and written
+        together with the rest of the burst.
+        """
+        if self._pendingWrites is not None:
+            self._pendingWrites.append(data)
+        else:
+            self.circuit.downstream.write(data)
+
     def sendIgnore(self, paddingLength=None):
         """Send padding message.
 
         By default we send ignores at MTU size. We also check whether
         the link is congested due to insufficient send socket buffer
         space, the TCP congestion window being full. In either case, we
-        don't send the padding message.
+        don't send the padding message. Padding is also dropped while
+        the write buffer of the downstream connection is full, so that
+        data is not queued behind it.
         """
         if not paddingLength:
             paddingLength = self._lengthDataProbdist.randomSample()
             if paddingLength == const.INF_LABEL:
                 paddingLength = const.MPU
+        if self.circuit.isDownstreamFull():
+            log.debug("[wfpad - %s] We dropped padding because the"
+                      " downstream buffer is full.", self.end)
+            return
         if self.downstreamSocket:
             cap = estimate_write_capacity(self.downstreamSocket)
             if cap < paddingLength:
                 log.debug("[wfpad - %s] We skipped sending padding because the"
                           " link was congested. The free space is %s", self.end, cap)
                 return
+        if not self.chargePaddingBudget(paddingLength):
+            log.debug("[wfpad - %s] We skipped sending padding because the"
+                      " padding budget is exhausted.", self.end)
+            return
         log.debug("[wfpad - %s] Sending ignore message.", self.end)
-        self.sendDownstream(self._msgFactory.newIgnore(paddingLength))
+        self.writeDownstream(self._msgFactory.getIgnoreFrame(paddingLength))
+        self.accountSentMessage(const.FLAG_PADDING, paddingLength, 0)
+
+    def chargePaddingBudget(self, paddingLength):
+        """Charge a padding message to the process-wide padding budget.
+
+        Return whether the budget can afford the message. Before that, we
+        notify the countermeasure if the budget crossed one of its watermarks
+        so that it degrades or restores its padding.
+        """
+        padBudget = budget.get()
+        if not padBudget:
+            return True
+        if not self._budgetDegraded and padBudget.isLow():
+            self._budgetDegraded = True
+            padBudget.degradedCircuits += 1
+            log.info("[wfpad - %s] Padding budget is low, degrading padding.", self.end)
+            self.onPaddingBudgetLow()
+        elif self._budgetDegraded and padBudget.isRecovered():
+            self._budgetDegraded = False
+            padBudget.degradedCircuits -= 1
+            log.info("[wfpad - %s] Padding budget recovered, restoring padding.", self.end)
+            self.onPaddingBudgetRecovered()
+        return padBudget.consume(paddingLength)
+
+    def onPaddingBudgetLow(self):
+        """Template method to degrade padding when the budget runs low.
+
+        By default, the padding messages that the budget cannot afford
+        are skipped. Child transports override it to lower their rate,
+        shorten their minimum padding time or skip gap padding.
+        """
+        pass
+
+    def onPaddingBudgetRecovered(self):
+        """Template method to restore padding when the budget recovers."""
+        pass
 
     def sendDataMessage(self, payload="", paddingLen=0):
         """Send data message."""
@@ -318,8 +506,9 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
 
         # Update delay according to elapsed time since last message
         # was sent. In case elapsed time is greater than current
-        # delay, we sent the data message as soon as possible.
-        if deferBurstCancelled or deferGapCancelled:
+        # delay, we sent the data message as soon as possible. The
+        # constant-rate clock already accounts for it.
+        if (deferBurstCancelled or deferGapCancelled) and not self._rateClock:
             elapsed = self.elapsedSinceLastMsg()
             newDelay = delay - elapsed
             delay = 0 if newDelay < 0 else newDelay
@@ -334,10 +523,22 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         self._buffer.write(data)
         log.debug("[wfpad - %s] Buffered %d bytes of outgoing data w/ delay %sms", self.end, len(self._buffer), delay)
 
+        # If data is not delayed but does not fill a message, wait for
+        # more data within the coalescing window. Once the buffer fills a
+        # message, a pending coalescing flush is brought forward.
+        if delay == 0 and self._coalesceWindow > 0:
+            if len(self._buffer) < const.MPU:
+                delay = self._coalesceWindow
+                if not self._deferData or self._deferData.called:
+                    self._coalescing = True
+            elif self._coalescing and self.cancelDeferrer(self._deferData):
+                self._coalescing = False
+
         # In case there is no scheduled flush of the buffer,
         # make a delayed call to the flushing method.
         if not self._deferData or (self._deferData and self._deferData.called):
-            self._deferData = deferLater(delay, self.flushBuffer)
+            self._deferData = deferLater(delay, self.flushBuffer,
+                                         timer=(self.__class__.__name__, 'data'))
             log.debug("[wfpad - %s] Delay buffer flush %s ms delay", self.end, delay)
 
     def elapsedSinceLastMsg(self):
@@ -356,17 +557,72 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         """Encapsulate data from buffer in messages and send over the link.
 
         In case the buffer is not empty, the buffer is flushed and we send
-        these data over the wire. When buffer is empty we decide whether we
+        these data over the wire. While the delay sampled for the next data
+        message is zero, we keep draining the buffer in the same call, as
+        long as the link has capacity for it, and the messages of the burst
+        are written together. When buffer is empty we decide whether we
         start padding.
         """
         dataLen = len(self._buffer)
         if dataLen <= 0:
             self.deferBurstPadding('snd')
             log.debug("[wfpad - %s] buffer is empty, pad `snd` burst.", self.end)
+            self.session.bufferDrained()
             return
         log.debug("[wfpad - %s] %s bytes of data found in buffer."
                   " Flushing buffer.", self.end, dataLen)
 
+        capacity = None
+        if self.downstreamSocket:
+            capacity = estimate_write_capacity(self.downstreamSocket)
+
+        # A flush at the end of a coalescing window sends the partial
+        # message it was waiting for.
+        coalesced, self._coalescing = self._coalescing, False
+
+        self._pendingWrites = []
+        try:
+            numMsgs, burstLen, dataDelay = 0, 0, 0
+            while len(self._buffer) > 0:
+                burstLen += self.flushMessage()
+                numMsgs += 1
+                if len(self._buffer) == 0:
+                    break
+                dataDelay = self._delayDataProbdist.randomSample()
+                if dataDelay > 0 or numMsgs >= const.MAX_BURST_MSGS:
+                    break
+                if capacity is not None and burstLen + const.MTU > capacity:
+                    break
+                if not coalesced and self._coalesceWindow > 0 \
+                        and len(self._buffer) < const.MPU:
+                    dataDelay = self._coalesceWindow
+                    self._coalescing = True
+                    break
+        finally:
+            writes, self._pendingWrites = self._pendingWrites, None
+            if writes:
+                self.circuit.downstream.write(''.join(writes))
+        log.debug("[wfpad - %s] Flushed %d data messages (%d bytes).",
+                  self.end, numMsgs, burstLen)
+
+        self.checkBufferWatermarks()
+
+        if len(self._buffer) > 0:
+            self._deferData = deferLater(dataDelay, self.flushBuffer,
+                                         timer=(self.__class__.__name__, 'data'))
+            log.debug("[wfpad - %s] data waiting in buffer, flushing again "
+                      "after delay of %s ms.", self.end, dataDelay)
+        else:  # If buffer is empty, generate padding messages.
+            self.deferBurstPadding('snd')
+            log.debug("[wfpad - %s] buffer is empty, pad `snd` burst.", self.end)
+            self.session.bufferDrained()
+
+    def flushMessage(self):
+        """Encapsulate data from buffer in one message and send it.
+
+        Return the length of the message on the wire.
+        """
+        dataLen = len(self._buffer)
         payloadLen = self._lengthDataProbdist.randomSample()
         # INF_LABEL = -1 means we don't pad packets (can be done in crypto layer)
         if payloadLen is const.INF_LABEL:
@@ -390,21 +646,16 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         log.debug("[wfpad - %s] Sent data message of length %d.", self.end, msgTotalLen)
 
         self.session.lastSndDataDownstreamTs = self.session.lastSndDownstreamTs = time.time()
-
-        if len(self._buffer) > 0:
-            dataDelay = self._delayDataProbdist.randomSample()
-            self._deferData = deferLater(dataDelay, self.flushBuffer)
-            log.debug("[wfpad - %s] data waiting in buffer, flushing again "
-                      "after delay of %s ms.", self.end, dataDelay)
-        else:  # If buffer is empty, generate padding messages.
-            self.deferBurstPadding('snd')
-            log.debug("[wfpad - %s] buffer is empty, pad `snd` burst.", self.end)
+        if self._rateClock:
+            self._rateClock.tick()
+        return msgTotalLen
 
     def processMessages(self, data):
         """Extract WFPad protocol messages.
 
         Data is written to the local application and padding messages are
-        filtered out.
+        filtered out. The payloads of consecutive messages are written
+        upstream at once, up to the next control message.
         """
         log.debug("[wfpad - %s] Parse protocol messages from stream.", self.end)
 
@@ -420,42 +671,76 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
             log.exception("[wfpad - %s] Exception extracting "
                           "messages from stream: %s", self.end, str(e))
 
-        self.session.lastRcvDownstreamTs = time.time()
+        now = time.time()
+        self.session.lastRcvDownstreamTs = now
         direction = const.IN if self.weAreClient else const.OUT
+        pending = []
         for msg in msgs:
             log.debug("[wfpad - %s] A new message has been parsed!", self.end)
-            msg.rcvTime = time.time()
+            msg.rcvTime = now
             if msg.flags & const.FLAG_CONTROL:
+                # The control message may start a new session: relay and
+                # account the messages received before it first.
+                self.relayReceivedMessages(pending, now)
+                pending = []
+
                 # Process control messages
                 payload = msg.payload
                 if len(payload) > 0:
                     self.circuit.upstream.write(payload)
                 self.receiveControlMessage(msg.opcode, msg.args)
-                self.session.history.append((time.time(), const.FLAG_CONTROL, direction, msg.totalLen, len(msg.payload)))
+                self.session.history.append((now, const.FLAG_CONTROL, direction, msg.totalLen, len(msg.payload)))
+            pending.append(msg)
+        self.relayReceivedMessages(pending, now)
+
+        if not msgs:
+            return msgs
 
-            self.deferBurstPadding('rcv')
-            self.session.numMessages['rcv'] += 1
-            self.session.totalBytes['rcv'] += msg.totalLen
-            log.debug("total bytes and total len of message: %s" % msg.totalLen)
+        # Restart the burst padding timer once for all received messages
+        self.deferBurstPadding('rcv')
+        return msgs
+
+    def relayReceivedMessages(self, msgs, now):
+        """Relay the payloads of `msgs` upstream in one write and update the
+        session statistics with them.
+        """
+        if not msgs:
+            return
+
+        direction = const.IN if self.weAreClient else const.OUT
+        payloads, history = [], []
+        totalBytes = dataBytes = dataMessages = 0
+        for msg in msgs:
+            totalBytes += msg.totalLen
 
             # Filter padding messages out.
             if msg.flags & const.FLAG_PADDING:
                 log.debug("[wfpad - %s] Padding message ignored.", self.end)
-                self.session.history.append((time.time(), const.FLAG_PADDING, direction, msg.totalLen, len(msg.payload)))
+                history.append((now, const.FLAG_PADDING, direction, msg.totalLen, len(msg.payload)))
 
             # Forward data to the application.
             elif msg.flags & const.FLAG_DATA:
                 log.debug("[wfpad - %s] Data flag detected, relaying upstream", self.end)
-                self.session.dataBytes['rcv'] += len(msg.payload)
-                self.session.dataMessages['rcv'] += 1
-                self.circuit.upstream.write(msg.payload)
-                self.session.lastRcvDataDownstreamTs = time.time()
-                self.session.history.append((time.time(), const.FLAG_DATA, direction, msg.totalLen, len(msg.payload)))
+                dataBytes += len(msg.payload)
+                dataMessages += 1
+                payloads.append(msg.payload)
+                history.append((now, const.FLAG_DATA, direction, msg.totalLen, len(msg.payload)))
 
             # Otherwise, flag not recognized
             else:
                 log.error("[wfpad - %s] Invalid message flags: %d.", self.end, msg.flags)
-        return msgs
+
+        # Relay all the payloads to the application at once
+        if payloads:
+            self.circuit.upstream.writeSequence(payloads)
+
+        self.session.numMessages['rcv'] += len(msgs)
+        self.session.totalBytes['rcv'] += totalBytes
+        self.session.dataBytes['rcv'] += dataBytes
+        self.session.dataMessages['rcv'] += dataMessages
+        if dataMessages > 0:
+            self.session.lastRcvDataDownstreamTs = now
+        self.session.history.extend(history)
 
     def deferBurstPadding(self, when):
         """Sample delay from corresponding distribution and wait for data.
@@ -469,6 +754,7 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
             self._deferBurst[when] = deferLater(burstDelay,
                                                 self.timeout,
                                                 when=when,
+                                                timer=(self.__class__.__name__, 'burst'),
                                                 cbk=self._deferBurstCallback[when])
 
     def is_channel_idle(self):
@@ -493,6 +779,10 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         if when is 'snd':
             self.session.consecPaddingMsgs += 1
             self.session.lastSndDownstreamTs = time.time()
+            self.tickRateClock()
+        if self._skipGapPadding:
+            log.debug("[wfpad - %s] Skip gap padding (padding budget is low).", self.end)
+            return
         delay = self._gapHistoProbdist[when].randomSample()
         if delay is const.INF_LABEL:
             return
@@ -500,15 +790,52 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         self._deferGap[when] = deferLater(delay,
                                           self.timeout,
                                           when=when,
+                                          timer=(self.__class__.__name__, 'gap'),
                                           cbk=self._deferGapCallback[when])
         return delay
 
     def constantRatePaddingDistrib(self, t):
-        self._delayDataProbdist = histo.uniform(t)
+        """Send data and padding messages every `t` ms.
+
+        Messages are scheduled on the absolute deadlines of a constant-rate
+        clock, so the latency of timers does not lower the rate.
+        """
+        self._rateClock = ConstantRateClock(t, self._rateCatchup)
+        self._delayDataProbdist = self._rateClock
+        self.paddingRateDistrib(t)
+
+    def paddingRateDistrib(self, t):
+        """Set the constant period of padding without changing data delays.
+
+        If the padding budget is low, the period is stretched and padding
+        leaves the schedule of the constant-rate clock.
+        """
+        if self._rateClock and not self._budgetDegraded:
+            self._rateClock.setPeriod(t)
+            self._burstHistoProbdist['snd'] = self._rateClock
+            self._gapHistoProbdist['snd'] = self._rateClock
+            return
+        if self._budgetDegraded:
+            t *= const.BUDGET_DEGRADE_FACTOR
         self._burstHistoProbdist['snd'] = histo.uniform(t)
         self._gapHistoProbdist['snd'] = histo.uniform(t)
 
+    def tickRateClock(self):
+        """Account a padding message in the constant-rate clock.
+
+        The slot is consumed even if the message was dropped. Padding that
+        is off the schedule (degraded budget) restarts it, so that data is
+        not sent in a burst to catch up with the slots padding did not use.
+        """
+        if not self._rateClock:
+            return
+        if self._gapHistoProbdist['snd'] is self._rateClock:
+            self._rateClock.tick()
+        else:
+            self._rateClock.resync()
+
     def noPaddingDistrib(self):
+        self._rateClock = None
         self._delayDataProbdist = histo.uniform(0)
         self._burstHistoProbdist = {'rcv': histo.uniform(const.INF_LABEL),
                                     'snd': histo.uniform(const.INF_LABEL)}
@@ -540,7 +867,10 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         To be extended at child classes that implement final website
         fingerprinting countermeasures.
         """
-        self.session = Session()
+        oldSession, self.session = self.session, Session()
+        # Whoever waits for the buffer to drain or for the peer to stop
+        # padding keeps waiting on the new session.
+        self.session.takeWaiters(oldSession)
         if self.weAreClient:
             self.sendControlMessage(const.OP_APP_HINT, [self.getSessId(), True])
         else:
@@ -552,7 +882,8 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         # we will start padding.
         delay = self._delayDataProbdist.randomSample()
         if not self._deferData or (self._deferData and self._deferData.called):
-            self._deferData = deferLater(delay, self.flushBuffer)
+            self._deferData = deferLater(delay, self.flushBuffer,
+                                         timer=(self.__class__.__name__, 'data'))
             log.debug("[wfpad - %s] Delay buffer flush %s ms delay", self.end, delay)
 
         log.info("[wfpad - %s] - Session has started!(sessid = %s)", self.end, sessId)
@@ -564,7 +895,8 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         final website fingerprinting countermeasures.
         """
         if len(self._buffer) > 0:  # don't end the session until the buffer is empty
-            reactor.callLater(0.5, self.onSessionEnds, sessId)
+            d = self.session.whenBufferDrained()
+            d.addCallback(lambda _: self.onSessionEnds(sessId))
             return
         self.session.is_padding = True
         self._visiting = False
@@ -581,7 +913,8 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
 
     def _waitServerStopPadding(self):
         if self.session.is_peer_padding:
-            reactor.callLater(0.5, self._waitServerStopPadding)
+            d = self.session.whenPeerStopsPadding()
+            d.addCallback(lambda _: self._waitServerStopPadding())
             return
         self.session.is_peer_padding = False
         self._shim.notifyEndPadding()
@@ -611,6 +944,9 @@ class WFPadTransport(BaseTransport, PaddingPrimitivesInterface):
         # Cancel deferers
         self.cancelDeferrers('snd')
         self.cancelDeferrers('rcv')
+        # Export the state of the padding budget
+        if budget.get():
+            budget.get().dumpStats()
 
     def getSessId(self):
         """Return current session Id."""